@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import errno
+import fcntl
+import os
+import tempfile
+import time
+
+import girder_worker
+
+# Default limit on the total size of the cached files, 10 GB.
+DEFAULT_CACHE_SIZE = 10 * 1024 ** 3
+
+# Entries used more recently than this, in seconds, are never evicted.
+EVICTION_GRACE_PERIOD = 300
+
+LOCK_SUFFIX = '.lock'
+PARTIAL_PREFIX = 'partial-'
+
+
+class FileCache(object):
+    """
+    Worker side cache of Girder files, shared by every task on the host.
+    Entries are keyed by file id and sha512, so a changed file never hits a
+    stale entry.  Fills are atomic: the download goes to a partial file that
+    is renamed into place while holding a per entry lock, so concurrent tasks
+    asking for the same file share one download.  The least recently used
+    entries are evicted once the total size exceeds ``maxSize``, except
+    those used within ``gracePeriod`` seconds.
+    """
+
+    def __init__(self, root, maxSize=DEFAULT_CACHE_SIZE,
+                 gracePeriod=EVICTION_GRACE_PERIOD):
+        self.root = root
+        self.maxSize = maxSize
+        self.gracePeriod = gracePeriod
+        try:
+            os.makedirs(root)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _entryPath(self, fileId, sha512):
+        return os.path.join(self.root, '%s-%s' % (fileId, sha512))
+
+    def fetch(self, client, fileId):
+        """
+        Get the local path of a Girder file, downloading it if it isn't cached.
+
+        :param client: an authenticated GirderClient.
+        :param fileId: the id of the file.
+        :returns: the path of the cached file, or None if the file has no
+            checksum and can't be cached.
+        """
+        sha512 = client.getFile(fileId).get('sha512')
+        if not sha512:
+            return None
+        path = self._entryPath(fileId, sha512)
+        try:
+            # Mark the entry as recently used, so evictions leave it alone
+            # for the grace period.
+            os.utime(path, None)
+        except OSError:
+            self._fill(client, fileId, path)
+        return path
+
+    def _fill(self, client, fileId, path):
+        """Download a missing entry, then evict entries to make room."""
+        with open(path + LOCK_SUFFIX, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # Another task may have filled the entry while we waited.
+                if not os.path.exists(path):
+                    fd, partial = tempfile.mkstemp(
+                        prefix=PARTIAL_PREFIX, dir=self.root)
+                    os.close(fd)
+                    try:
+                        client.downloadFile(fileId, partial)
+                        os.rename(partial, path)
+                    except Exception:
+                        os.remove(partial)
+                        raise
+                os.utime(path, None)
+                self.evict(keep=path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the cache fits in its
+        size limit.  Entries used within the grace period are kept, as they
+        may just have been handed to a task.
+
+        :param keep: path of an entry that must not be evicted.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.endswith(LOCK_SUFFIX) or name.startswith(PARTIAL_PREFIX):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        recent = time.time() - self.gracePeriod
+        for mtime, size, path in sorted(entries):
+            if total <= self.maxSize or mtime > recent:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                os.remove(path + LOCK_SUFFIX)
+            except OSError:
+                pass
+            total -= size
+
+
+_fileCache = None
+
+
+def getFileCache():
+    """
+    Get the file cache configured in the [minerva] section of the worker
+    config with ``cache_dir`` and ``cache_size`` (in bytes).
+    """
+    global _fileCache
+    if _fileCache is None:
+        try:
+            root = girder_worker.config.get('minerva', 'cache_dir')
+        except Exception:
+            root = os.path.join(tempfile.gettempdir(), 'minerva_gaia_cache')
+        try:
+            maxSize = int(girder_worker.config.get('minerva', 'cache_size'))
+        except Exception:
+            maxSize = DEFAULT_CACHE_SIZE
+        _fileCache = FileCache(root, maxSize)
+    return _fileCache
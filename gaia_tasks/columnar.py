@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Read and write GeoDataFrames as GeoParquet: a parquet table with the
+geometry stored as WKB and described by the ``geo`` schema metadata key.
+"""
+
+import json
+
+import geopandas
+import pandas
+import pyarrow
+import pyarrow.parquet
+from shapely import wkb
+
+GEO_METADATA_KEY = b'geo'
+
+
+def write_geoparquet(data, path):
+    """
+    Write a GeoDataFrame to a GeoParquet file
+    :param data: GeoDataFrame to write
+    :param path: Output file path
+    """
+    geometry_name = data.geometry.name
+    frame = pandas.DataFrame(data.drop(geometry_name, axis=1))
+    frame[geometry_name] = [
+        None if geom is None else geom.wkb for geom in data.geometry]
+    table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+    crs = data.crs
+    if crs is not None and not isinstance(crs, (dict, str)):
+        crs = str(crs)
+    geo = {
+        'version': '0.1.0',
+        'primary_column': geometry_name,
+        'columns': {
+            geometry_name: {'encoding': 'WKB', 'crs': crs}
+        }
+    }
+    metadata = dict(table.schema.metadata or {})
+    metadata[GEO_METADATA_KEY] = json.dumps(geo).encode('utf8')
+    table = table.replace_schema_metadata(metadata)
+    pyarrow.parquet.write_table(table, path)
+
+
+def read_geoparquet(path, columns=None):
+    """
+    Read a GeoDataFrame from a GeoParquet file.  The file is memory mapped, so
+    only the requested columns are read from disk.
+    :param path: GeoParquet file path
+    :param columns: Property columns to read, all columns if None
+    :return: GeoDataFrame
+    """
+    parquet_file = pyarrow.parquet.ParquetFile(path, memory_map=True)
+    geo = json.loads(
+        parquet_file.schema.to_arrow_schema().metadata[
+            GEO_METADATA_KEY].decode('utf8'))
+    geometry_name = geo['primary_column']
+    if columns is not None:
+        columns = [c for c in columns if c != geometry_name] + [geometry_name]
+    frame = parquet_file.read(columns=columns).to_pandas()
+    geometry = geopandas.GeoSeries(
+        [None if g is None else wkb.loads(bytes(g))
+         for g in frame.pop(geometry_name)],
+        index=frame.index)
+    return geopandas.GeoDataFrame(
+        frame, geometry=geometry,
+        crs=geo['columns'][geometry_name].get('crs'))
@@ -17,15 +17,17 @@
 #  limitations under the License.
 ###############################################################################
 
+import gzip
 import json
 import os
+import shutil
 import tempfile
+import time
 from base64 import b64encode
 
 import fiona
 import geopandas
 import requests
-from six import StringIO
 
 from gaia.core import GaiaException
 from gaia.filters import filter_pandas
@@ -34,6 +36,9 @@ from gaia import formats, types
 import girder_worker
 from girder.constants import PACKAGE_DIR
 import girder_client
+from shapely.geometry import box
+
+from gaia_tasks.cache import getFileCache
 
 
 class MinervaVectorIO(GaiaIO):
@@ -45,21 +50,37 @@ class MinervaVectorIO(GaiaIO):
     default_output = formats.JSON
 
     def __init__(self, item_id=None, token=None, name='gaia_result.json',
-                 uri='', **kwargs):
+                 uri='', columns=None, bbox=None, geometry=None,
+                 columnar=None, **kwargs):
         """
         Read and write GeoJSON data to/from Girder
         :param item_id: Item id to read/write from/to
-        :param uri: location of temporary file
+        :param uri: location of the written file, a temporary file by default
+        :param columns: Property columns to read, all columns if None
+        :param bbox: Only read features intersecting [minx, miny, maxx, maxy]
+        :param geometry: Only read features intersecting a GeoJSON geometry
+        :param columnar: Write a GeoParquet file instead of GeoJSON, the
+        GeoJSON is then created by Minerva when it is first downloaded.
+        Defaults to the columnar_output worker setting.
         :param kwargs: Other keyword arguments
         """
 
         self.id = item_id
         self.token = token
-        if uri:
-            self.uri = uri
-        else:
-            tmpdir = tempfile.mkdtemp()
-            self.uri = tempfile.mkstemp(suffix='.json', dir=tmpdir)[1]
+        self.columns = columns
+        self.bbox = bbox
+        self.geometry = geometry
+        if columnar is None:
+            try:
+                columnar = girder_worker.config.getboolean(
+                    'minerva', 'columnar_output')
+            except Exception:
+                columnar = False
+        self.columnar = columnar
+        # Called with (stage, bytes, seconds) after each fetch or upload
+        self.progress = None
+        self.tmpdir = None
+        self.uri = uri
         self.filename = name
         girderHost = None
         girderPort = None
@@ -78,23 +99,47 @@ class MinervaVectorIO(GaiaIO):
         self.meta = self.client.getItem(item_id)
         super(MinervaVectorIO, self).__init__(uri=self.uri, **kwargs)
 
+    def get_tmpdir(self):
+        """
+        Get a temporary directory for this IO, removed by cleanup()
+        """
+        if self.tmpdir is None:
+            self.tmpdir = tempfile.mkdtemp()
+        return self.tmpdir
+
+    def cleanup(self):
+        """
+        Remove the temporary files created by this IO
+        """
+        if self.tmpdir is not None:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+            self.tmpdir = None
+
     def save_geojson(self):
         """
-        Save GeoJSON from a Minerva item
-        TODO: Use caching like the girder_worker.girder_io plugin
+        Save GeoJSON from a Minerva item to a local file.  Girder files are
+        read through the worker's file cache.
         TODO: Separate methods for saving geojson from different sources
         TODO: Get geojson via WFS calls for local WMS vector layers
+        :return: path of the local GeoJSON file
         """
         minerva = self.meta['meta']['minerva']
         if 'geojson_file' in minerva:
             # Uploaded GeoJSON is stored as a file in Girder
-            self.client.downloadFile(minerva['geojson_file']['_id'], self.uri)
+            fileId = minerva['geojson_file']['_id']
+            path = getFileCache().fetch(self.client, fileId)
+            if path is None:
+                # Files without a checksum can't be cached
+                path = os.path.join(self.get_tmpdir(), 'input.json')
+                self.client.downloadFile(fileId, path)
+            return path
         elif 'geojson' in minerva:
             # Mongo collection is stored in item meta
             geojson = json.loads(minerva['geojson']['data'])
-            # TODO: Don't use mongo metadata for filename
-            with open(self.uri, 'w') as outjson:
+            path = os.path.join(self.get_tmpdir(), 'input.json')
+            with open(path, 'w') as outjson:
                 json.dump(geojson, outjson)
+            return path
         # elif 'dataset_type' in minerva and minerva['dataset_type'] == 'wms':
         # from girder.plugins.minerva.utility.minerva_utility import decryptCredentials
         #     servers = config.getConfig()['gaia_minerva_wms']['servers']
@@ -122,6 +167,18 @@ class MinervaVectorIO(GaiaIO):
         else:
             raise GaiaException('Unsupported data source. \n{}'.format(minerva))
 
+    def save_columnar(self):
+        """
+        Save the GeoParquet file of a Minerva item to a local file
+        :return: path of the local GeoParquet file
+        """
+        fileId = self.meta['meta']['minerva']['columnar_file']['_id']
+        path = getFileCache().fetch(self.client, fileId)
+        if path is None:
+            path = os.path.join(self.get_tmpdir(), 'input.parquet')
+            self.client.downloadFile(fileId, path)
+        return path
+
     def read(self, epsg=None, **kwargs):
         """
         Read vector data from Girder
@@ -131,8 +188,10 @@ class MinervaVectorIO(GaiaIO):
         """
 
         if self.data is None:
-            self.save_geojson()
-            self.data = geopandas.read_file(self.uri)
+            try:
+                self.data = self.read_data()
+            finally:
+                self.cleanup()
             if self.filters:
                 self.filter_data()
         out_data = self.data
@@ -146,39 +205,218 @@ class MinervaVectorIO(GaiaIO):
         else:
             return out_data
 
+    def read_data(self):
+        """
+        Read the item's data as a GeoDataFrame, applying the spatial filter
+        and column projection.  GeoJSON is parsed one feature at a time when
+        there is a spatial filter, and only the byte ranges of candidate
+        features are downloaded when the dataset has a spatial index.
+        :return: GeoDataFrame
+        """
+        from gaia_tasks.spatial import FeatureFilter
+        minerva = self.meta['meta']['minerva']
+        spatial = self.bbox is not None or self.geometry is not None
+        feature_filter = FeatureFilter(self.bbox, self.geometry, self.columns)
+        columnar = 'columnar_file' in minerva
+        if (spatial and not columnar and 'spatial_index' in minerva and
+                'geojson_file' in minerva):
+            return self.read_indexed(feature_filter)
+
+        start = time.time()
+        path = self.save_columnar() if columnar else self.save_geojson()
+        if self.progress:
+            self.progress('fetch', os.path.getsize(path), time.time() - start)
+        if columnar:
+            from gaia_tasks.columnar import read_geoparquet
+            data = read_geoparquet(path, self.columns)
+            if spatial:
+                area = feature_filter.geometry or box(*feature_filter.bbox)
+                data = data[data.geometry.intersects(area)]
+            return data
+        if spatial:
+            from gaia_tasks.spatial import stream_features
+            return self.from_features(
+                list(stream_features(path, feature_filter)))
+        data = geopandas.read_file(path)
+        if self.columns is not None:
+            data = data[[c for c in data.columns
+                         if c in self.columns or c == data.geometry.name]]
+        return data
+
+    def read_indexed(self, feature_filter):
+        """
+        Read the features intersecting the filter using the dataset's spatial
+        index, fetching only their byte ranges of the GeoJSON file
+        :param feature_filter: FeatureFilter
+        :return: GeoDataFrame
+        """
+        from gaia_tasks.spatial import indexed_ranges, read_ranges
+        minerva = self.meta['meta']['minerva']
+        index_id = minerva['spatial_index']['_id']
+        index_path = getFileCache().fetch(self.client, index_id)
+        if index_path is None:
+            index_path = os.path.join(self.get_tmpdir(), 'index.npz')
+            self.client.downloadFile(index_id, index_path)
+        ranges = indexed_ranges(index_path, feature_filter.bbox)
+        file_id = minerva['geojson_file']['_id']
+        fetched = [0]
+
+        def fetch(start, end):
+            response = self.client.sendRestRequest(
+                'GET', 'file/{}/download'.format(file_id),
+                parameters={'offset': start, 'endByte': end}, jsonResp=False)
+            fetched[0] += len(response.content)
+            return response.content
+
+        start = time.time()
+        features = list(read_ranges(fetch, ranges, feature_filter))
+        if self.progress:
+            self.progress('fetch', fetched[0], time.time() - start)
+        return self.from_features(features)
+
+    def from_features(self, features):
+        """
+        Create a GeoDataFrame from GeoJSON features, which are in WGS84
+        :param features: List of GeoJSON feature dicts
+        :return: GeoDataFrame
+        """
+        if not features:
+            return geopandas.GeoDataFrame(
+                columns=['geometry'], geometry='geometry',
+                crs=fiona.crs.from_epsg(4326))
+        data = geopandas.GeoDataFrame.from_features(features)
+        data.crs = fiona.crs.from_epsg(4326)
+        return data
+
     def write(self, filename=None, as_type='json'):
         """
-        Write data (assumed geopandas) to geojson or shapefile
+        Write data (assumed geopandas) to geojson or shapefile.  Features are
+        serialized one at a time to a file, which is uploaded in chunks, so
+        the output is never held in memory as a single string.
         :param filename: Base filename
         :param as_type: json or memory
         :return: file girder uri
         """
-        filedata = self.data.to_json()
         if not filename:
             filename = self.filename
+        if self.columnar:
+            return self.write_columnar(filename)
         if as_type == 'json':
-            self.uri = self.uri.replace(os.path.basename(self.uri), filename)
+            if self.uri:
+                self.uri = self.uri.replace(os.path.basename(self.uri),
+                                            filename)
+            else:
+                self.uri = os.path.join(self.get_tmpdir(), filename)
             self.create_output_dir(self.uri)
-            with open(self.uri, 'w') as outfile:
-                outfile.write(filedata)
+            path = self.uri
         elif as_type == 'memory':
-            pass
+            # Still spooled through a temporary file to bound memory use
+            path = os.path.join(self.get_tmpdir(), filename)
         else:
             raise NotImplementedError('{} not a valid type'.format(as_type))
 
-        fd = StringIO(filedata)
-        upload = self.client.uploadFile(parentId=self.id, stream=fd,
-                                        size=len(filedata), name=filename)
-        item_meta = self.client.getItem(self.id)['meta']
-        item_meta['minerva']['geojson_file'] = {
+        self.write_geojson(path)
+        upload = self.upload_file(path, filename, 'application/json')
+        gzip_upload = self.write_gzip(path, filename)
+        self.update_metadata(geojson_file={
             '_id': upload['_id'],
-            'name': upload['name']
-        }
-        item_meta['minerva']['geo_render'] = {
+            'name': upload['name'],
+            'gzip_file': {
+                '_id': gzip_upload['_id'],
+                'name': gzip_upload['name']
+            }
+        }, geo_render={
             'type': 'geojson',
             'file_id': upload['_id']
-        }
+        })
+        self.cleanup()
+        return os.path.join(
+            self.client.urlBase, 'file', upload['_id'], 'download')
+
+    def write_geojson(self, path):
+        """
+        Write data (assumed geopandas) to a GeoJSON FeatureCollection file,
+        one feature at a time
+        :param path: Output file path
+        """
+        with open(path, 'w') as outfile:
+            outfile.write('{"type": "FeatureCollection", "features": [')
+            for index, feature in enumerate(self.data.iterfeatures()):
+                if index:
+                    outfile.write(',')
+                outfile.write('\n')
+                json.dump(feature, outfile)
+            outfile.write('\n]}\n')
+
+    def write_gzip(self, path, filename):
+        """
+        Upload a gzip copy of a GeoJSON file, served to clients accepting a
+        gzip encoding so it isn't compressed again on every download
+        :param path: Local GeoJSON file path
+        :param filename: Name of the GeoJSON Girder file
+        :return: The gzip Girder file
+        """
+        gzip_path = path + '.gz'
+        with open(path, 'rb') as infile:
+            with gzip.open(gzip_path, 'wb') as outfile:
+                shutil.copyfileobj(infile, outfile)
+        try:
+            return self.upload_file(
+                gzip_path, filename + '.gz', 'application/gzip')
+        finally:
+            os.remove(gzip_path)
+
+    def upload_file(self, path, filename, mime_type):
+        """
+        Upload a local file to the item in chunks
+        :param path: Local file path
+        :param filename: Name of the Girder file
+        :param mime_type: Mime type of the Girder file
+        :return: The Girder file
+        """
+        size = os.path.getsize(path)
+        start = time.time()
+        with open(path, 'rb') as fd:
+            upload = self.client.uploadFile(
+                parentId=self.id, stream=fd, size=size,
+                name=filename, mimeType=mime_type)
+        if self.progress:
+            self.progress('upload', size, time.time() - start)
+        return upload
+
+    def update_metadata(self, **minerva):
+        """
+        Update the minerva metadata of the item.  The item is fetched again
+        first, as Girder replaces top level metadata keys and minerva
+        metadata may have been written since this IO was created.
+        :param minerva: Minerva metadata keys to set
+        """
+        self.meta = self.client.getItem(self.id)
+        item_meta = self.meta['meta']
+        item_meta.setdefault('minerva', {}).update(minerva)
         self.client.addMetadataToItem(self.id, item_meta)
+
+    def write_columnar(self, filename):
+        """
+        Write data (assumed geopandas) to a GeoParquet file on the item
+        :param filename: Base filename, the extension is replaced
+        :return: file girder uri
+        """
+        from gaia_tasks.columnar import write_geoparquet
+        filename = os.path.splitext(filename)[0] + '.parquet'
+        path = os.path.join(self.get_tmpdir(), filename)
+        write_geoparquet(self.data, path)
+        upload = self.upload_file(path, filename, 'application/x-parquet')
+        self.update_metadata(columnar_file={
+            '_id': upload['_id'],
+            'name': upload['name']
+        }, geo_render={
+            'type': 'geojson',
+            'file_id': upload['_id']
+        })
+        # Minerva creates the GeoJSON rendering of the file in a job
+        self.client.post('minerva_dataset/{}/geojson'.format(self.id))
+        self.cleanup()
         return os.path.join(
             self.client.urlBase, 'file', upload['_id'], 'download')
 
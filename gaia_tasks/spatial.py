@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Spatially filtered reading of GeoJSON features.
+
+Minerva can store a spatial index next to a GeoJSON file (the
+``spatial_index`` file of the dataset).  It is a numpy ``.npz`` archive with,
+for every feature of the file:
+
+- ``bounds``: float64 array of shape (n, 4), minx, miny, maxx, maxy
+- ``offsets``: int64 array, byte offset of the feature's json in the file
+- ``lengths``: int64 array, byte length of the feature's json
+"""
+
+import decimal
+import json
+
+import numpy
+from shapely.geometry import shape
+
+# Byte ranges closer than this are fetched with a single request.
+RANGE_MERGE_GAP = 64 * 1024
+
+
+def _floats(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, list):
+        return [_floats(v) for v in value]
+    if isinstance(value, dict):
+        return dict((k, _floats(v)) for k, v in value.items())
+    return value
+
+
+def _coordinates(coordinates):
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        yield coordinates
+    else:
+        for child in coordinates:
+            for position in _coordinates(child):
+                yield position
+
+
+def geometry_bounds(geometry):
+    """
+    Bounds of a GeoJSON geometry without building a shapely object
+    :param geometry: GeoJSON geometry dict
+    :return: (minx, miny, maxx, maxy) or None for empty geometries
+    """
+    if geometry is None:
+        return None
+    if geometry['type'] == 'GeometryCollection':
+        parts = [geometry_bounds(g) for g in geometry['geometries']]
+        parts = [p for p in parts if p is not None]
+        if not parts:
+            return None
+        return (min(p[0] for p in parts), min(p[1] for p in parts),
+                max(p[2] for p in parts), max(p[3] for p in parts))
+    positions = list(_coordinates(geometry['coordinates']))
+    if not positions:
+        return None
+    xs = [p[0] for p in positions]
+    ys = [p[1] for p in positions]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def bounds_intersect(a, b):
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+
+class FeatureFilter(object):
+    """
+    Spatial and attribute filter applied to each feature while reading
+    :param bbox: (minx, miny, maxx, maxy) features must intersect
+    :param geometry: GeoJSON geometry dict features must intersect
+    :param columns: Properties to keep, all properties if None
+    """
+
+    def __init__(self, bbox=None, geometry=None, columns=None):
+        self.geometry = shape(geometry) if geometry else None
+        if bbox is None and self.geometry is not None:
+            bbox = self.geometry.bounds
+        self.bbox = tuple(bbox) if bbox is not None else None
+        self.columns = columns
+
+    def __call__(self, feature):
+        """
+        :return: the filtered feature, or None if it is rejected
+        """
+        if self.bbox is not None:
+            bounds = geometry_bounds(feature.get('geometry'))
+            # Reject on the cheap bounding box test first
+            if bounds is None or not bounds_intersect(bounds, self.bbox):
+                return None
+            if (self.geometry is not None and
+                    not shape(feature['geometry']).intersects(self.geometry)):
+                return None
+        if self.columns is not None:
+            properties = feature.get('properties') or {}
+            feature['properties'] = dict(
+                (k, v) for k, v in properties.items() if k in self.columns)
+        return feature
+
+
+def stream_features(path, feature_filter):
+    """
+    Parse the features of a GeoJSON FeatureCollection file one at a time,
+    yielding those accepted by the filter
+    :param path: GeoJSON file path
+    :param feature_filter: FeatureFilter
+    """
+    import ijson
+
+    with open(path, 'rb') as fd:
+        for feature in ijson.items(fd, 'features.item'):
+            feature = feature_filter(_floats(feature))
+            if feature is not None:
+                yield feature
+
+
+def indexed_ranges(index_path, bbox):
+    """
+    Use a spatial index to find the byte ranges of the features that may
+    intersect a bounding box
+    :param index_path: Path of the .npz spatial index
+    :param bbox: (minx, miny, maxx, maxy)
+    :return: list of (start, end, [(offset, length), ...]) ranges, end
+    exclusive, each holding the features within it
+    """
+    index = numpy.load(index_path)
+    bounds = index['bounds']
+    mask = ((bounds[:, 0] <= bbox[2]) & (bounds[:, 2] >= bbox[0]) &
+            (bounds[:, 1] <= bbox[3]) & (bounds[:, 3] >= bbox[1]))
+    offsets = index['offsets'][mask]
+    lengths = index['lengths'][mask]
+    order = numpy.argsort(offsets)
+    ranges = []
+    for offset, length in zip(offsets[order], lengths[order]):
+        offset, length = int(offset), int(length)
+        if ranges and offset - ranges[-1][1] <= RANGE_MERGE_GAP:
+            ranges[-1][1] = max(ranges[-1][1], offset + length)
+            ranges[-1][2].append((offset, length))
+        else:
+            ranges.append([offset, offset + length, [(offset, length)]])
+    return [tuple(r) for r in ranges]
+
+
+def read_ranges(fetch, ranges, feature_filter):
+    """
+    Fetch byte ranges of a GeoJSON file and parse the features in them
+    :param fetch: Function taking (start, end) and returning the bytes
+    :param ranges: Ranges from indexed_ranges
+    :param feature_filter: FeatureFilter for the exact test and projection
+    """
+    for start, end, features in ranges:
+        data = fetch(start, end)
+        for offset, length in features:
+            text = data[offset - start:offset - start + length]
+            feature = feature_filter(json.loads(text.decode('utf8')))
+            if feature is not None:
+                yield feature
@@ -1,9 +1,99 @@
 import json
 import re
+import time
 from girder_worker.app import app
 from girder_worker.utils import girder_job
 from gaia.parser import deserialize
 
+from gaia_tasks.inputs import MinervaVectorIO
+
+
+class TaskCanceled(Exception):
+    pass
+
+
+class StageReporter(object):
+    """
+    Report the stages of a gaia task, fetching inputs, computing each process
+    node and uploading the output, as job progress and log lines, and collect
+    their timing.  Cancellation is checked between stages.
+    """
+
+    def __init__(self, task, process):
+        self.task = task
+        self.timing = {'fetch': [], 'compute': [], 'upload': []}
+        self.inputs = []
+        self.nodes = []
+        self._walk(process)
+        self.current = 0
+        # One stage per input, one per process node and the upload
+        self.total = len(self.inputs) + len(self.nodes) + 1
+        for io in self.inputs:
+            io.progress = self._io_callback(io)
+        if isinstance(process.output, MinervaVectorIO):
+            process.output.progress = self._io_callback(process.output)
+        for node in self.nodes:
+            node.compute = self._timed_compute(node)
+
+    def _walk(self, process):
+        self.nodes.append(process)
+        for input in getattr(process, 'inputs', None) or []:
+            if isinstance(input, MinervaVectorIO):
+                self.inputs.append(input)
+            elif getattr(input, 'process', None) is not None:
+                self._walk(input.process)
+            elif hasattr(input, 'compute'):
+                self._walk(input)
+
+    def check_canceled(self):
+        if self.task.canceled:
+            raise TaskCanceled()
+
+    def update(self, message):
+        self.task.job_manager.updateProgress(
+            total=self.total, current=self.current, message=message,
+            forceFlush=True)
+
+    def _io_callback(self, io):
+        def callback(stage, nbytes, seconds):
+            self.timing[stage].append({
+                'item_id': io.id, 'bytes': nbytes, 'seconds': seconds})
+            self.task.job_manager.write('{} {}: {} bytes in {:.2f}s\n'.format(
+                stage, io.id, nbytes, seconds))
+        return callback
+
+    def _timed_compute(self, node):
+        compute = node.compute
+        name = type(node).__name__
+
+        def timed(*args, **kwargs):
+            self.check_canceled()
+            self.update('Computing {}'.format(name))
+            start = time.time()
+            result = compute(*args, **kwargs)
+            seconds = time.time() - start
+            self.timing['compute'].append({'process': name, 'seconds': seconds})
+            self.task.job_manager.write('compute {}: {:.2f}s\n'.format(
+                name, seconds))
+            self.current += 1
+            return result
+        return timed
+
+    def fetch_inputs(self):
+        for io in self.inputs:
+            self.check_canceled()
+            self.update('Fetching {}'.format(io.id))
+            io.read()
+            self.current += 1
+
+
+def _job_id(task):
+    # The job manager updates the job through its REST url, which ends with
+    # the job id.
+    url = getattr(task.job_manager, 'url', None)
+    if url:
+        return url.rstrip('/').split('/')[-1]
+
 
 @girder_job()
 @app.task(bind=True)
@@ -32,4 +122,24 @@ def gaia_task(self, kwargs):
         analysis['output']['token'] = token['_id']
 
     process = json.loads(json.dumps(analysis), object_hook=deserialize)
-    process.compute()
+    reporter = StageReporter(self, process)
+    start = time.time()
+    try:
+        reporter.fetch_inputs()
+        process.compute()
+        reporter.current = reporter.total
+        reporter.update('Done')
+    except TaskCanceled:
+        self.job_manager.write('Canceled\n')
+        return
+    finally:
+        reporter.timing['total_seconds'] = time.time() - start
+        jobId = _job_id(self)
+        if jobId and isinstance(process.output, MinervaVectorIO):
+            # Keep the timing in the job's minerva metadata for profiling
+            try:
+                process.output.client.put(
+                    'gaia_analysis/{}/timing'.format(jobId),
+                    data=json.dumps(reporter.timing))
+            except Exception as e:
+                self.job_manager.write('Could not save timing: {}\n'.format(e))
@@ -4,6 +4,8 @@ add_python_test(geojson PLUGIN minerva BIND_SERVER)
 add_python_test(session PLUGIN minerva BIND_SERVER)
 add_python_test(geocoder PLUGIN minerva BIND_SERVER)
 add_python_test(wms PLUGIN minerva BIND_SERVER)
+add_python_test(gaia_cache PLUGIN minerva BIND_SERVER)
+add_python_test(file_cache PLUGIN minerva)
 
 set_property(TEST python_static_analysis_minerva PROPERTY LABELS minerva_server)
 set_property(TEST server_minerva.dataset PROPERTY LABELS minerva_server)
@@ -11,6 +13,8 @@ set_property(TEST server_minerva.geojson PROPERTY LABELS minerva_server)
 set_property(TEST server_minerva.session PROPERTY LABELS minerva_server)
 set_property(TEST server_minerva.geocoder PROPERTY LABELS minerva_server)
 set_property(TEST server_minerva.wms PROPERTY LABELS minerva_server)
+set_property(TEST server_minerva.gaia_cache PROPERTY LABELS minerva_server)
+set_property(TEST server_minerva.file_cache PROPERTY LABELS minerva_server)
 
 add_web_client_test(
     minerva "${PROJECT_SOURCE_DIR}/plugins/minerva/plugin_tests/client/minervaSpec.js"
@@ -19,6 +19,8 @@
 
 import json
 import os
+import time
+import zlib
 
 import geojson
 
@@ -60,6 +62,25 @@ class DatasetTestCase(base.TestCase):
             'minervauser', 'password', 'minerva', 'user',
             'minervauser@example.com')
 
+    def _waitForDerivedFiles(self, itemId, timeout=30):
+        """
+        Wait for the job building the derived files of a dataset, returning
+        the dataset's minerva metadata once it has finished.
+        """
+        from girder.plugins.jobs.constants import JobStatus
+
+        item = self.model('item').load(itemId, force=True)
+        jobId = item['meta']['minerva']['derived_files']['job_id']
+        deadline = time.time() + timeout
+        while True:
+            job = self.model('job', 'jobs').load(jobId, force=True)
+            if job['status'] in (JobStatus.SUCCESS, JobStatus.ERROR):
+                break
+            self.assertLess(time.time(), deadline, 'Derived files timed out')
+            time.sleep(0.1)
+        self.assertEqual(job['status'], JobStatus.SUCCESS)
+        return self.model('item').load(itemId, force=True)['meta']['minerva']
+
     def testDataset(self):
         """
         Test the minerva dataset API enppoints.
@@ -220,6 +241,46 @@ class DatasetTestCase(base.TestCase):
                           'geojson', 'Expected geojson dataset original_type')
         self.assertEquals(minervaMetadata['geojson_file']['name'],
                           'states.geojson', 'Expected geojson file to be set')
+        self.assertEquals(minervaMetadata['stats']['feature_count'], 6)
+        self.assertEquals(minervaMetadata['stats']['geometry_types'],
+                          ['LineString', 'Point'])
+        # the derived files are built after promotion, in a single pass
+        self.assertHasKeys(minervaMetadata, ['derived_files'])
+        minervaMetadata = self._waitForDerivedFiles(stateItemId)
+        simplified = minervaMetadata['simplified']
+        self.assertEquals(simplified['vertex_count'], 1132)
+        self.assertEquals([level['zoom'] for level in simplified['levels']],
+                          [8, 5, 2])
+        self.assertLess(simplified['levels'][-1]['vertex_count'],
+                        simplified['levels'][0]['vertex_count'])
+        self.assertEquals(minervaMetadata['spatial_index']['count'], 6)
+
+        # features within a bounding box, found with the spatial index
+        response = self.request(
+            path='/minerva_dataset/{}/features'.format(stateItemId),
+            method='GET',
+            user=self._user,
+            params={'bbox': '-106,38,-103,40'}
+        )
+        self.assertStatusOk(response)
+        # The Colorado outline only intersects the box by its bounds
+        self.assertEquals([feature['geometry']['coordinates'] for feature
+                           in response.json['features']], [[-104.9847, 39.7392]])
+        response = self.request(
+            path='/minerva_dataset/{}/features'.format(stateItemId),
+            method='GET',
+            user=self._user,
+            params={'bbox': '-180,-90,180,90', 'limit': 2, 'offset': 5}
+        )
+        self.assertStatusOk(response)
+        self.assertEquals(len(response.json['features']), 1)
+        response = self.request(
+            path='/minerva_dataset/{}/features'.format(stateItemId),
+            method='GET',
+            user=self._user,
+            params={'bbox': '-180,-90,180'}
+        )
+        self.assertStatus(response, 400)
 
         # geojson-timeseries
         files = [{
@@ -231,6 +292,27 @@ class DatasetTestCase(base.TestCase):
         minervaMetadata = geojsonDatasetItem['meta']['minerva']
         self.assertEquals(minervaMetadata['original_type'], 'geojson-timeseries')
         self.assertEquals(minervaMetadata['geojson_file']['name'], 'geojson-timeseries_1.geojson')
+        self.assertEquals(minervaMetadata['frame_index']['count'], 50)
+
+        # frames of the geojson-timeseries
+        path = '/minerva_dataset/{}/frames'.format(itemId)
+        response = self.request(path=path, method='GET', user=self._user)
+        self.assertStatusOk(response)
+        self.assertEquals(response.json['count'], 50)
+        self.assertEquals(response.json['times'][1], '2017-02-25T15:07:14.188798Z')
+
+        path = '/minerva_dataset/{}/frames/data'.format(itemId)
+        response = self.request(path=path, method='GET', user=self._user,
+                                params={'index': 1}, isJson=False)
+        self.assertStatusOk(response)
+        frames = json.loads(self.getBody(response))
+        self.assertEquals(len(frames), 1)
+        self.assertEquals(frames[0]['time'], '2017-02-25T15:07:14.188798Z')
+        self.assertIn('geojson', frames[0])
+
+        response = self.request(path=path, method='GET', user=self._user,
+                                params={'index': 50}, isJson=False)
+        self.assertStatus(response, 400)
 
         # json array
         files = [{
@@ -243,6 +325,19 @@ class DatasetTestCase(base.TestCase):
         self.assertEquals(jsonMinervaMetadata['original_type'],
                           'json', 'Expected json dataset original_type')
 
+        # zipped json array, read without extracting it
+        files = [{
+            'name': 'tweets100.json.zip',
+            'path': os.path.join(pluginTestDir, 'data', 'tweets100.json.zip'),
+            'mimeType': 'application/zip'
+        }]
+        zipDatasetItem, zipItemId = createDataset('tweets', files)
+        zipMinervaMetadata = zipDatasetItem['meta']['minerva']
+        self.assertEquals(zipMinervaMetadata['original_type'], 'json')
+        self.assertEquals(zipMinervaMetadata['original_files'][0]['compression'], 'zip')
+        self.assertEquals(zipMinervaMetadata['original_files'][0]['member'], 'tweets100.json')
+        self.assertEquals(zipMinervaMetadata['stats']['row_count'], 100)
+
         # csv
         files = [{
             'name': 'points.csv',
@@ -253,6 +348,31 @@ class DatasetTestCase(base.TestCase):
         csvMinervaMetadata = csvDatasetItem['meta']['minerva']
         self.assertEquals(csvMinervaMetadata['original_type'],
                           'csv', 'Expected csv dataset original_type')
+        self.assertEquals(csvMinervaMetadata['stats']['row_count'], 5)
+
+        # shapefile
+        files = [{
+            'name': 'shapefile.' + ext,
+            'path': os.path.join(pluginTestDir, 'data', 'shapefile.' + ext),
+            'mimeType': 'application/octet-stream'
+        } for ext in ('shp', 'shx', 'dbf', 'prj', 'cpg')]
+        shapefileDatasetItem, shapefileItemId = createDataset('shapefile', files)
+        shapefileMinervaMetadata = shapefileDatasetItem['meta']['minerva']
+        self.assertEquals(shapefileMinervaMetadata['original_type'], 'shapefile')
+        self.assertEquals(shapefileMinervaMetadata['dataset_type'], 'geojson')
+        self.assertEquals(shapefileMinervaMetadata['stats']['feature_count'], 5)
+        self.assertEquals(shapefileMinervaMetadata['bounds'], {
+            'ulx': -74.0, 'uly': 45.0, 'lrx': -68.0, 'lry': 39.0})
+        response = self.request(
+            path='/minerva_dataset/{0}/download'.format(shapefileItemId),
+            method='GET',
+            user=self._user
+        )
+        self.assertStatusOk(response)
+        self.assertEquals(len(response.json['features']), 5)
+        self.assertEquals(response.json['features'][0]['geometry']['coordinates'],
+                          [-70.0, 40.0])
+        self.assertEquals(response.json['features'][0]['properties'], {'elevation': 17})
 
         # other type exception
         files = [{
@@ -337,8 +457,6 @@ class DatasetTestCase(base.TestCase):
 
         #
         # Test minerva_dataset/id/geojson creating geojson from csv
-        # Currently should throw an exception as this conversion is
-        # only implemented in javascript.
         #
 
         # get the item metadata
@@ -374,8 +492,120 @@ class DatasetTestCase(base.TestCase):
             method='POST',
             user=self._user,
         )
+        self.assertStatusOk(response)
+        self.assertHasKeys(response.json, ['geojson_file'])
+        self.assertHasKeys(response.json['geojson_file'], ['gzip_file'])
+        self.assertEquals(response.json['csv_conversion']['row_count'], 5)
+        self.assertEquals(
+            self._waitForDerivedFiles(csvItemId)['clusters']['point_count'], 5)
+
+        geojsonFileId = response.json['geojson_file']['_id']
+        path = '/file/{}/download'.format(geojsonFileId)
+        response = self.request(
+            path=path,
+            method='GET',
+            user=self._user,
+            isJson=False
+        )
+        pointsGeojson = geojson.loads(self.getBody(response))
+        self.assertEquals(len(pointsGeojson['features']), 5)
+        self.assertEquals(pointsGeojson['features'][0]['geometry']['coordinates'],
+                          [-78.0, 40.0])
+        self.assertEquals(pointsGeojson['features'][0]['properties'], {'0': 17})
+
+        # the converted csv points are clustered by zoom level
+        response = self.request(
+            path='/minerva_dataset/{}/clusters'.format(csvItemId),
+            method='GET',
+            user=self._user,
+            params={'zoom': 0}
+        )
+        self.assertStatusOk(response)
+        clusters = response.json['features']
+        self.assertEquals(len(clusters), 1)
+        self.assertEquals(clusters[0]['properties']['count'], 5)
+        self.assertEquals(clusters[0]['properties']['summary']['0']['sum'], 33)
+        self.assertEquals(clusters[0]['properties']['summary']['0']['max'], 17)
+        # and served as individual points when zoomed in
+        response = self.request(
+            path='/minerva_dataset/{}/clusters'.format(csvItemId),
+            method='GET',
+            user=self._user,
+            params={'zoom': 12, 'bbox': '-79,39.5,-77,40.5'}
+        )
+        self.assertStatusOk(response)
+        self.assertEquals([feature['properties'] for feature
+                           in response.json['features']], [{'0': 17}])
+
+        # class breaks of a property, computed once
+        for method, breaks, counts in [('equal', [1, 9, 17], [4, 1]),
+                                       ('jenks', [1, 8, 17], [4, 1])]:
+            for attempt in range(2):
+                response = self.request(
+                    path='/minerva_dataset/{}/classify'.format(csvItemId),
+                    method='GET',
+                    user=self._user,
+                    params={'field': '0', 'method': method, 'classes': 2}
+                )
+                self.assertStatusOk(response)
+                self.assertEquals(response.json['breaks'], breaks)
+                self.assertEquals(response.json['counts'], counts)
+        response = self.request(
+            path='/minerva_dataset/{}/dataset'.format(csvItemId),
+            method='GET',
+            user=self._user
+        )
+        # reading class breaks leaves the dataset unchanged
+        self.assertNotIn('classifications', response.json)
+
+        # the property summary is built with the converted geojson
+        self.assertHasKeys(response.json, ['property_summary'])
+        response = self.request(
+            path='/minerva_dataset/{}/summary'.format(csvItemId),
+            method='GET',
+            user=self._user,
+            params={'field': '0'}
+        )
+        self.assertStatusOk(response)
+        self.assertEquals(response.json['count'], 5)
+        self.assertEquals(response.json['missing'], 0)
+        numbers = response.json['number']
+        self.assertEquals([numbers['min'], numbers['max'], numbers['mean']],
+                          [1, 17, 6.6])
+        self.assertEquals(numbers['quantiles'][50], 4)
+        self.assertEquals(sum(numbers['histogram']['counts']), 5)
+        response = self.request(
+            path='/minerva_dataset/{}/summary'.format(csvItemId),
+            method='GET',
+            user=self._user,
+            params={'field': 'missing'}
+        )
         self.assertStatus(response, 400)
 
+        # the converted csv is downloaded from its stored gzip copy
+        response = self.request(
+            path='/minerva_dataset/{0}/download'.format(csvItemId),
+            method='GET',
+            user=self._user,
+            isJson=False,
+            additionalHeaders=[('Accept-Encoding', 'gzip')]
+        )
+        self.assertStatusOk(response)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        pointsGeojson = json.loads(zlib.decompress(
+            self.getBody(response, text=False), 16 + zlib.MAX_WBITS).decode('utf8'))
+        self.assertEquals(len(pointsGeojson['features']), 5)
+        # unless gzip is refused with a zero quality
+        response = self.request(
+            path='/minerva_dataset/{0}/download'.format(csvItemId),
+            method='GET',
+            user=self._user,
+            additionalHeaders=[('Accept-Encoding', 'gzip;q=0, identity')]
+        )
+        self.assertStatusOk(response)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEquals(len(response.json['features']), 5)
+
         # test new dataset download endpoint
         response = self.request(
             path='/minerva_dataset/{0}/download'.format(stateItemId),
@@ -385,6 +615,77 @@ class DatasetTestCase(base.TestCase):
         geojsonContent = response.json
         self.assertEqual(len(geojsonContent['features'][0]['geometry']['coordinates']), 245)
 
+        # a simplified level is served for low zoom levels
+        response = self.request(
+            path='/minerva_dataset/{0}/download'.format(stateItemId),
+            method='GET',
+            user=self._user,
+            params={'zoom': 3}
+        )
+        self.assertStatusOk(response)
+        self.assertLess(len(response.json['features'][0]['geometry']['coordinates']), 245)
+
+        # and a compact TopoJSON encoding, stored by the derived files job
+        response = self.request(
+            path='/minerva_dataset/{0}/download'.format(stateItemId),
+            method='GET',
+            user=self._user,
+            params={'format': 'topojson'}
+        )
+        self.assertStatusOk(response)
+        self.assertEqual(response.json['type'], 'Topology')
+        self.assertEqual(len(response.json['objects']['geojson']['geometries']), 6)
+        response = self.request(
+            path='/minerva_dataset/{0}/dataset'.format(stateItemId),
+            method='GET',
+            user=self._user
+        )
+        self.assertHasKeys(response.json['geojson_file'], ['topojson_file'])
+
+        # the download is gzip encoded for clients accepting it
+        response = self.request(
+            path='/minerva_dataset/{0}/download'.format(stateItemId),
+            method='GET',
+            user=self._user,
+            isJson=False,
+            additionalHeaders=[('Accept-Encoding', 'gzip, deflate')]
+        )
+        self.assertStatusOk(response)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        geojsonContent = json.loads(zlib.decompress(
+            self.getBody(response, text=False), 16 + zlib.MAX_WBITS).decode('utf8'))
+        self.assertEqual(len(geojsonContent['features'][0]['geometry']['coordinates']), 245)
+
+        # downloads can be revalidated and read by ranges
+        response = self.request(
+            path='/minerva_dataset/{0}/download'.format(stateItemId),
+            method='GET',
+            user=self._user,
+            isJson=False
+        )
+        self.assertStatusOk(response)
+        etag = response.headers['ETag']
+        stateContent = self.getBody(response, text=False)
+        response = self.request(
+            path='/minerva_dataset/{0}/download'.format(stateItemId),
+            method='GET',
+            user=self._user,
+            isJson=False,
+            additionalHeaders=[('If-None-Match', etag)]
+        )
+        self.assertStatus(response, 304)
+        response = self.request(
+            path='/minerva_dataset/{0}/download'.format(stateItemId),
+            method='GET',
+            user=self._user,
+            isJson=False,
+            additionalHeaders=[('Range', 'bytes=10-19')]
+        )
+        self.assertStatus(response, 206)
+        self.assertEqual(response.headers['Content-Range'],
+                         'bytes 10-19/{}'.format(len(stateContent)))
+        self.assertEqual(self.getBody(response, text=False), stateContent[10:20])
+
         # test new dataset download endpoint
         response = self.request(
             path='/minerva_dataset/{0}/bound'.format(stateItemId),
@@ -397,6 +698,136 @@ class DatasetTestCase(base.TestCase):
         self.assertEqual(geojsonContent['ulx'], -114.813613)
         self.assertEqual(geojsonContent['uly'], 41.003444)
 
+        # zonal statistics need a geotiff dataset
+        response = self.request(
+            path='/minerva_dataset/{0}/zonal_statistics'.format(stateItemId),
+            method='POST',
+            user=self._user,
+            params={'zonesId': stateItemId}
+        )
+        self.assertStatus(response, 400)
+
+    def testCsvPropertyTypes(self):
+        try:
+            from StringIO import StringIO
+        except ImportError:
+            from io import StringIO
+        from girder.plugins.minerva.utility.csv_utility import \
+            CsvGeoJsonConverter
+
+        # types come from the first chunk and apply to the later ones
+        converter = CsvGeoJsonConverter(
+            {'latitudeColumn': 'lat', 'longitudeColumn': 'lon'}, chunkRows=2)
+        writer = StringIO()
+        converter.toGeoJson([b'lat,lon,a,b,c\n1,2,5,x,1.5\n1,2,,y,\n'
+                             b'1,2,7,,2\n1,2,abc,z,nan\n'], writer)
+        features = json.loads(writer.getvalue())['features']
+        self.assertEqual([feature['properties'] for feature in features], [
+            {'a': 5, 'b': 'x', 'c': 1.5},
+            {'a': None, 'b': 'y', 'c': None},
+            {'a': 7, 'b': None, 'c': 2.0},
+            {'a': None, 'b': 'z', 'c': None}])
+
+        # integers too large for an int64 in a later chunk become floats
+        converter = CsvGeoJsonConverter(
+            {'latitudeColumn': 'lat', 'longitudeColumn': 'lon'}, chunkRows=2)
+        writer = StringIO()
+        converter.toGeoJson([b'lat,lon,a\n1,2,5\n1,2,6\n'
+                             b'1,2,99999999999999999999999\n1,2,7\n'], writer)
+        features = json.loads(writer.getvalue())['features']
+        self.assertEqual([feature['properties']['a'] for feature in features],
+                         [5, 6, 1e23, 7])
+
+    def testClassifyFields(self):
+        from girder.plugins.minerva.utility.classify_utility import \
+            classify, geojsonFieldValues
+
+        data = json.dumps({'type': 'FeatureCollection', 'features': [{
+            'type': 'Feature',
+            'geometry': None,
+            'properties': {'pop.2010': value, 'pop': {'2010': 100}}
+        } for value in (1, 2, 2, 3.5)]}).encode('utf8')
+        # property names with dots aren't taken as nested keys
+        values = geojsonFieldValues([data], 'pop.2010')
+        self.assertEqual(values.tolist(), [1, 2, 2, 3.5])
+        self.assertEqual(len(geojsonFieldValues([data], 'pop')), 0)
+
+        # jenks breaks of few distinct values have a class per value
+        self.assertEqual(classify(values, 'jenks', 5), {
+            'breaks': [1, 1, 2, 3.5], 'counts': [1, 2, 1]})
+
+    def testClusterPropertyNames(self):
+        from girder.plugins.minerva.utility.cluster_utility import \
+            ClusterIndex, PointClusterer
+
+        # non-ASCII names and long integers are kept
+        name = u'poblaci\u00f3n'
+        clusterer = PointClusterer()
+        for value in (10 ** 20, 2):
+            clusterer.addFeature({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [1, 2]},
+                'properties': {name: value}
+            })
+        data, pointCount = clusterer.build()
+        self.assertEqual(pointCount, 2)
+        self.assertEqual(ClusterIndex(data).properties, [name])
+
+    def testZoneStatistics(self):
+        import numpy
+        from girder.plugins.minerva.utility.zonal_utility import \
+            PixelTransform, polygonRings, rasterizeRings, zoneStatistics
+
+        # pixels in the hole of a polygon are left out
+        geometry = {'type': 'Polygon', 'coordinates': [
+            [[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]],
+            [[1, 1], [3, 1], [3, 3], [1, 3], [1, 1]]]}
+        mask = rasterizeRings(polygonRings(geometry), 4, 4)
+        self.assertEqual(mask.sum(), 12)
+        self.assertFalse(mask[1:3, 1:3].any())
+
+        # windows are clipped to the raster
+        transform = PixelTransform({
+            'sizeX': 10, 'sizeY': 10,
+            'bounds': {'xmin': 0, 'xmax': 10, 'ymin': 0, 'ymax': 10}})
+        self.assertEqual(transform.window([transform.pixels(
+            [[-5, 5], [5, 5], [5, 15], [-5, 15]])]), (0, 0, 5, 5))
+        self.assertIsNone(transform.window([transform.pixels(
+            [[20, 20], [30, 20], [30, 30]])]))
+
+        # a window read at half resolution counts four raster pixels each
+        square = [numpy.array([[0, 0], [2, 0], [2, 2], [0, 2]])]
+        stats = zoneStatistics((numpy.ones((2, 2)), square, 4.0, 4, None))
+        self.assertEqual(stats['count'], 16)
+        self.assertEqual(stats['sum'], 16)
+        self.assertEqual(stats['mean'], 1)
+        self.assertEqual(sum(stats['histogram']['counts']), 16)
+
+        # nodata pixels are ignored
+        stats = zoneStatistics((numpy.array([[1, -9999], [3, 5]]), square,
+                                1.0, 2, -9999))
+        self.assertEqual([stats['count'], stats['min'], stats['max'],
+                          stats['mean']], [3, 1, 5, 3])
+
+    def testTileCaches(self):
+        from girder.plugins.minerva.utility.minerva_utility import LruCache
+        from girder.plugins.minerva.utility.tile_utility import neighbourTiles
+
+        cache = LruCache(10, len)
+        cache.put('a', b'12345')
+        cache.put('b', b'1234')
+        self.assertEqual(cache.get('a'), b'12345')
+        # the least recently used tile is evicted first
+        cache.put('c', b'123')
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.size, 8)
+        cache.put('d', b'12345678901')
+        self.assertNotIn('d', cache)
+
+        self.assertEqual(sorted(neighbourTiles(1, 0, 0, 0, 1)),
+                         [(0, 0, 0), (1, 0, 1), (1, 1, 0), (1, 1, 1)])
+        self.assertEqual(len(neighbourTiles(3, 4, 4, 0, 5)), 13)
+
     def testPrepareDatasetSharing(self):
         self.assertEqual(len(self.request(path='/group', user=self._user, method='GET').json), 0)
         response = self.request(path='/minerva_dataset/prepare_sharing',
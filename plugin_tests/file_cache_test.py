@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+# The worker tasks aren't installed with the plugin
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from gaia_tasks.cache import FileCache, LOCK_SUFFIX  # noqa
+
+
+class FakeClient(object):
+    """A Girder client serving files from a dict of id to (sha512, data)."""
+
+    def __init__(self, files):
+        self.files = files
+        self.downloads = []
+
+    def getFile(self, fileId):
+        return {'_id': fileId, 'sha512': self.files[fileId][0]}
+
+    def downloadFile(self, fileId, path):
+        self.downloads.append(fileId)
+        with open(path, 'wb') as fh:
+            fh.write(self.files[fileId][1])
+
+
+class FileCacheTestCase(unittest.TestCase):
+    """
+    Tests of the worker side cache of Girder files.
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.client = FakeClient({
+            'a': ('sha-a', b'a' * 10),
+            'b': ('sha-b', b'b' * 10),
+            'c': ('sha-c', b'c' * 10),
+            'none': (None, b'')
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _age(self, path, seconds):
+        """Make an entry look last used some seconds ago."""
+        then = time.time() - seconds
+        os.utime(path, (then, then))
+
+    def testFetch(self):
+        cache = FileCache(self.root, maxSize=100)
+        path = cache.fetch(self.client, 'a')
+        with open(path, 'rb') as fh:
+            self.assertEqual(fh.read(), b'a' * 10)
+        # a hit doesn't download again
+        self.assertEqual(cache.fetch(self.client, 'a'), path)
+        self.assertEqual(self.client.downloads, ['a'])
+        # files without a checksum aren't cached
+        self.assertIsNone(cache.fetch(self.client, 'none'))
+
+    def testFetchEvictedEntry(self):
+        cache = FileCache(self.root, maxSize=100)
+        path = cache.fetch(self.client, 'a')
+        # an entry evicted by another task is downloaded again
+        os.remove(path)
+        self.assertEqual(cache.fetch(self.client, 'a'), path)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.client.downloads, ['a', 'a'])
+
+    def testEvict(self):
+        cache = FileCache(self.root, maxSize=25, gracePeriod=60)
+        pathA = cache.fetch(self.client, 'a')
+        pathB = cache.fetch(self.client, 'b')
+        self._age(pathA, 120)
+        self._age(pathB, 90)
+        # the least recently used entry goes first
+        pathC = cache.fetch(self.client, 'c')
+        self.assertFalse(os.path.exists(pathA))
+        self.assertFalse(os.path.exists(pathA + LOCK_SUFFIX))
+        self.assertTrue(os.path.exists(pathB))
+        self.assertTrue(os.path.exists(pathC))
+
+    def testEvictionGracePeriod(self):
+        cache = FileCache(self.root, maxSize=15, gracePeriod=60)
+        pathA = cache.fetch(self.client, 'a')
+        # entries used within the grace period are kept over the limit
+        pathB = cache.fetch(self.client, 'b')
+        self.assertTrue(os.path.exists(pathA))
+        self.assertTrue(os.path.exists(pathB))
+        self._age(pathA, 120)
+        cache.evict()
+        self.assertFalse(os.path.exists(pathA))
+        self.assertTrue(os.path.exists(pathB))
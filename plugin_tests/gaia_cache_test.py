@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import io
+import json
+
+from bson.objectid import ObjectId
+
+from tests import base
+
+
+def setUpModule():
+    """
+    Enable the minerva plugin and start the server.
+    """
+    base.enabledPlugins.append('jobs')
+    base.enabledPlugins.append('gravatar')
+    base.enabledPlugins.append('minerva')
+    base.startServer()
+
+
+def tearDownModule():
+    """
+    Stop the server.
+    """
+    base.stopServer()
+
+
+class GaiaCacheTestCase(base.TestCase):
+    """
+    Tests of the cache of Gaia process results.
+    """
+
+    def setUp(self):
+        """
+        Set up the test case with a user and two geojson datasets.
+        """
+        super(GaiaCacheTestCase, self).setUp()
+
+        from girder.plugins.minerva.utility.minerva_utility import \
+            findDatasetFolder, updateMinervaMetadata
+
+        self._user = self.model('user').createUser(
+            'minervauser', 'password', 'minerva', 'user',
+            'minervauser@example.com')
+        folder = findDatasetFolder(self._user, self._user, create=True)
+        self._items = []
+        for name, coordinates in (('a', [1, 2]), ('b', [3, 4])):
+            item = self.model('item').createItem(name, self._user, folder)
+            data = json.dumps({
+                'type': 'FeatureCollection',
+                'features': [{
+                    'type': 'Feature',
+                    'geometry': {'type': 'Point', 'coordinates': coordinates},
+                    'properties': {}
+                }]
+            }).encode('utf8')
+            file = self.model('upload').uploadFromFile(
+                io.BytesIO(data), len(data), name + '.geojson',
+                parentType='item', parent=item, user=self._user,
+                mimeType='application/vnd.geo+json')
+            updateMinervaMetadata(item, {
+                'dataset_type': 'geojson',
+                'geojson_file': {'name': file['name'], '_id': file['_id']}
+            })
+            self._items.append(item)
+
+    def _process(self, itemId, token='token'):
+        return {
+            '_type': 'gaia.geo.CentroidProcess',
+            'inputs': [{
+                '_type': 'gaia.geo.girder_data.GirderDataObject',
+                'item_id': str(itemId),
+                'token': token
+            }]
+        }
+
+    def testProcessCacheKey(self):
+        from girder.plugins.minerva.utility.gaia_utility import \
+            processCacheKey
+
+        key = processCacheKey(self._process(self._items[0]['_id']),
+                              self._user)
+        self.assertIsNotNone(key)
+        # tokens don't change the key, the input files do
+        self.assertEqual(processCacheKey(self._process(
+            self._items[0]['_id'], 'other'), self._user), key)
+        self.assertNotEqual(processCacheKey(self._process(
+            self._items[1]['_id']), self._user), key)
+        # missing items and remote inputs aren't cached
+        self.assertIsNone(processCacheKey(
+            self._process(ObjectId()), self._user))
+        self.assertIsNone(processCacheKey({
+            '_type': 'gaia.geo.CentroidProcess',
+            'inputs': [{'uri': 'http://example.com/points.geojson'}]
+        }, self._user))
+
+    def testCachedResult(self):
+        from girder.plugins.minerva.rest.gaia.geoprocess import GeoProcess
+        from girder.plugins.minerva.utility.gaia_utility import \
+            findCachedProcessResult, processCacheKey
+
+        process = self._process(self._items[0]['_id'])
+        cacheKey = processCacheKey(process, self._user)
+        # a miss before the result is stored
+        self.assertIsNone(findCachedProcessResult(cacheKey, self._user))
+
+        result = {'type': 'FeatureCollection', 'features': []}
+        GeoProcess()._storeResult(cacheKey, result, self._user)
+        self.assertIsNotNone(findCachedProcessResult(cacheKey, self._user))
+        # the result is stored once per key
+        GeoProcess()._storeResult(cacheKey, result, self._user)
+        self.assertEqual(self.model('item').find({
+            'meta.minerva.process_cache_key': cacheKey}).count(), 1)
+        # and only found by users who can read it
+        otherUser = self.model('user').createUser(
+            'otheruser', 'password', 'other', 'user', 'otheruser@example.com')
+        self.assertIsNone(findCachedProcessResult(cacheKey, otherUser))
+
+        # a hit returns a dataset of the stored result without running Gaia
+        response = self.request(
+            path='/gaia_process', method='POST', user=self._user,
+            params={'async': 'true', 'datasetName': 'centroids'},
+            body=json.dumps(process), type='application/json')
+        self.assertStatusOk(response)
+        self.assertIsNone(response.json['job'])
+        dataset = response.json['dataset']
+        self.assertEqual(dataset['name'], 'centroids')
+        minervaMeta = dataset['meta']['minerva']
+        self.assertEqual(minervaMeta['process_cache_key'], cacheKey)
+        self.assertEqual(minervaMeta['geo_render']['file_id'],
+                         minervaMeta['geojson_file']['_id'])
+        response = self.request(
+            path='/file/{}/download'.format(
+                minervaMeta['geojson_file']['_id']),
+            method='GET', user=self._user, isJson=False)
+        self.assertStatusOk(response)
+        self.assertEqual(json.loads(self.getBody(response)), result)
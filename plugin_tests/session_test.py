@@ -17,6 +17,9 @@
 #  limitations under the License.
 ###############################################################################
 
+import io
+import json
+
 from tests import base
 
 
@@ -136,3 +139,42 @@ class SessionTestCase(base.TestCase):
         sessionIds = [d['_id'] for d in response.json]
         self.assertTrue(item1Id in sessionIds, "expected item1Id in sessions")
         self.assertTrue(item2Id in sessionIds, "expected item2Id in sessions")
+
+    def testLoadSession(self):
+        folder = self.request(
+            path='/minerva_session/folder', method='POST', user=self._user,
+            params={'userId': self._user['_id']}).json['folder']
+        folder = self.model('folder').load(folder['_id'], force=True)
+        session = self.model('item').createItem(
+            'session', self._user, folder)
+        datasets = [self.model('item').createItem(
+            'dataset%d' % index, self._user, folder) for index in range(3)]
+        self.model('item').setMetadata(session, {'minerva': {'map': {
+            'features': [{'datasetId': str(datasets[0]['_id'])}]}}})
+        sessionJson = json.dumps({'layers': [
+            {'datasetId': str(datasets[1]['_id'])},
+            {'datasetId': str(datasets[0]['_id'])},
+            {'datasetId': '000000000000000000000000'}]}).encode('utf8')
+        self.model('upload').uploadFromFile(
+            io.BytesIO(sessionJson), len(sessionJson), 'session.json',
+            parentType='item', parent=session, user=self._user,
+            mimeType='application/json')
+
+        response = self.request(
+            path='/minerva_session/{}/session'.format(session['_id']),
+            method='GET', user=self._user)
+        self.assertStatusOk(response)
+        self.assertEquals(response.json['name'], 'session.json')
+
+        for attempt in range(2):
+            response = self.request(
+                path='/minerva_session/{}/load'.format(session['_id']),
+                method='GET', user=self._user)
+            self.assertStatusOk(response)
+            self.assertEquals(response.json['session']['_id'],
+                              str(session['_id']))
+            self.assertEquals(len(response.json['session_json']['layers']), 3)
+            self.assertEquals([d['_id'] for d in response.json['datasets']],
+                              [str(datasets[1]['_id']), str(datasets[0]['_id'])])
+            self.assertEquals(response.json['missing'],
+                              ['000000000000000000000000'])
@@ -27,4 +27,9 @@ class PluginSettings():
     SOURCE_FOLDER = 'source'
     SESSION_FOLDER = 'session'
     GEOJSON_EXTENSION = '.geojson'
+    FRAME_INDEX_EXTENSION = '.frames'
+    TOPOJSON_EXTENSION = '.topojson'
+    SPATIAL_INDEX_EXTENSION = '.index.npz'
+    CLUSTERS_EXTENSION = '.clusters.npz'
+    SUMMARY_EXTENSION = '.summary.json'
     SESSION_FILENAME = 'session.json'
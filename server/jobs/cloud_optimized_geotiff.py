@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+
+from girder.plugins.jobs.constants import JobStatus
+from girder.utility.model_importer import ModelImporter
+
+from girder.plugins.large_image.models.image_item import ImageItem
+from girder.plugins.minerva.utility.minerva_utility import \
+    updateMinervaMetadata
+
+COG_BLOCK_SIZE = 256
+COG_COMPRESSION = 'DEFLATE'
+COG_EXTENSION = '.cog.tif'
+
+
+def isCloudOptimized(dataset):
+    """
+    Whether a GDAL dataset is tiled and has overviews, so any region can be
+    read at any resolution without reading whole rows of the image.
+    """
+    band = dataset.GetRasterBand(1)
+    blockWidth, blockHeight = band.GetBlockSize()
+    small = max(dataset.RasterXSize, dataset.RasterYSize) <= COG_BLOCK_SIZE
+    tiled = blockWidth < dataset.RasterXSize or small
+    return tiled and (band.GetOverviewCount() > 0 or small)
+
+
+def overviewFactors(width, height):
+    """Reduction factors of the overviews, down to a single block."""
+    factors = []
+    factor = 2
+    while max(width, height) > COG_BLOCK_SIZE * factor // 2:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+def convertToCog(source, destination):
+    """
+    Rewrite a GeoTIFF as a cloud optimized GeoTIFF: tiled, with internal
+    overviews and compression.
+
+    :returns: False if the GeoTIFF is already tiled with overviews and was
+        not rewritten.
+    """
+    from osgeo import gdal
+    gdal.UseExceptions()
+    dataset = gdal.Open(source)
+    if isCloudOptimized(dataset):
+        return False
+    if gdal.GetDriverByName('COG') is not None:
+        gdal.Translate(destination, dataset, format='COG', creationOptions=[
+            'BLOCKSIZE=%d' % COG_BLOCK_SIZE,
+            'COMPRESS=' + COG_COMPRESSION,
+            'BIGTIFF=IF_SAFER'])
+        return True
+    # GDAL before 3.1 has no COG driver: tile the image, build its overviews
+    # and copy them to the start of the file.
+    tiled = destination + '.tiled.tif'
+    try:
+        gdal.Translate(tiled, dataset, format='GTiff', creationOptions=[
+            'TILED=YES',
+            'BLOCKXSIZE=%d' % COG_BLOCK_SIZE,
+            'BLOCKYSIZE=%d' % COG_BLOCK_SIZE,
+            'COMPRESS=' + COG_COMPRESSION,
+            'BIGTIFF=IF_SAFER'])
+        tiledDataset = gdal.Open(tiled, gdal.GA_Update)
+        tiledDataset.BuildOverviews('AVERAGE', overviewFactors(
+            tiledDataset.RasterXSize, tiledDataset.RasterYSize))
+        tiledDataset = None
+        gdal.Translate(destination, tiled, format='GTiff', creationOptions=[
+            'TILED=YES',
+            'BLOCKXSIZE=%d' % COG_BLOCK_SIZE,
+            'BLOCKYSIZE=%d' % COG_BLOCK_SIZE,
+            'COMPRESS=' + COG_COMPRESSION,
+            'COPY_SRC_OVERVIEWS=YES',
+            'BIGTIFF=IF_SAFER'])
+    finally:
+        if os.path.exists(tiled):
+            os.remove(tiled)
+    return True
+
+
+def run(job):
+    """
+    Local job that rewrites the GeoTIFF of a geotiff dataset as a cloud
+    optimized GeoTIFF.  The optimized file is added to the dataset item and
+    its tiles are served from it; the original file is kept for download.
+    """
+    jobModel = ModelImporter.model('job', 'jobs')
+    job = jobModel.updateJob(job, status=JobStatus.RUNNING,
+                             log='Started GeoTIFF optimization\n')
+    kwargs = job['kwargs']
+    itemModel = ModelImporter.model('item')
+    fileModel = ModelImporter.model('file')
+    tmpdir = tempfile.mkdtemp()
+    try:
+        item = itemModel.load(kwargs['itemId'], force=True)
+        user = ModelImporter.model('user').load(kwargs['userId'], force=True)
+        original = fileModel.load(kwargs['fileId'], force=True)
+        source = os.path.join(tmpdir, 'source.tif')
+        with open(source, 'wb') as fh:
+            for chunk in fileModel.download(original, headers=False)():
+                fh.write(chunk)
+        name = os.path.splitext(original['name'])[0] + COG_EXTENSION
+        destination = os.path.join(tmpdir, name)
+        if not convertToCog(source, destination):
+            minervaMeta = item['meta']['minerva']
+            minervaMeta['cloud_optimized'].update({
+                'name': original['name'],
+                'file_id': original['_id']
+            })
+            updateMinervaMetadata(item, minervaMeta)
+            jobModel.updateJob(job, status=JobStatus.SUCCESS,
+                               log='Already tiled with overviews\n')
+            return
+        with open(destination, 'rb') as fh:
+            cogFile = ModelImporter.model('upload').uploadFromFile(
+                fh, os.path.getsize(destination), name, parentType='item',
+                parent=item, user=user, mimeType='image/tiff')
+
+        # Serve the tiles of the optimized file
+        imageItem = ImageItem()
+        item = itemModel.load(kwargs['itemId'], force=True)
+        if 'largeImage' in item:
+            imageItem.delete(item)
+        imageItem.createImageItem(item, cogFile, user=user, createJob=False)
+
+        item = itemModel.load(kwargs['itemId'], force=True)
+        minervaMeta = item['meta']['minerva']
+        minervaMeta['cloud_optimized'].update({
+            'name': cogFile['name'],
+            'file_id': cogFile['_id']
+        })
+        tileMetadata = imageItem.tileSource(item).getMetadata()
+        tileMetadata['file_id'] = str(cogFile['_id'])
+        minervaMeta['tile_metadata'] = tileMetadata
+        updateMinervaMetadata(item, minervaMeta)
+        jobModel.updateJob(job, status=JobStatus.SUCCESS,
+                           log='Wrote %s (%d bytes)\n' % (
+                               name, cogFile['size']))
+    except Exception:
+        t, val, tb = sys.exc_info()
+        log = '%s: %s\n%s' % (t.__name__, repr(val), traceback.format_tb(tb))
+        jobModel.updateJob(job, status=JobStatus.ERROR, log=log)
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+
+from girder.plugins.jobs.constants import JobStatus
+from girder.utility.model_importer import ModelImporter
+
+from girder.plugins.minerva.constants import PluginSettings
+from girder.plugins.minerva.utility.columnar_utility import \
+    geoParquetToGeoJson
+from girder.plugins.minerva.utility.minerva_utility import \
+    addGzipCompanion, updateMinervaMetadata
+
+
+def run(job):
+    """
+    Local job creating the GeoJSON file of a dataset that only has a
+    columnar (GeoParquet) file, as written by Gaia intermediate outputs.
+    """
+    jobModel = ModelImporter.model('job', 'jobs')
+    job = jobModel.updateJob(job, status=JobStatus.RUNNING,
+                             log='Started GeoJSON conversion\n')
+    kwargs = job['kwargs']
+    itemModel = ModelImporter.model('item')
+    fileModel = ModelImporter.model('file')
+    tmpdir = tempfile.mkdtemp()
+    try:
+        item = itemModel.load(kwargs['itemId'], force=True)
+        user = ModelImporter.model('user').load(kwargs['userId'], force=True)
+        columnarFile = fileModel.load(kwargs['fileId'], force=True)
+        columnarPath = os.path.join(tmpdir, columnarFile['name'])
+        with open(columnarPath, 'wb') as fh:
+            for chunk in fileModel.download(columnarFile, headers=False)():
+                fh.write(chunk)
+        geojsonPath = os.path.join(
+            tmpdir, item['name'] + PluginSettings.GEOJSON_EXTENSION)
+        with open(geojsonPath, 'w') as fh:
+            geoParquetToGeoJson(columnarPath, fh)
+        with open(geojsonPath, 'rb') as fh:
+            geojsonFile = ModelImporter.model('upload').uploadFromFile(
+                fh, os.path.getsize(geojsonPath),
+                os.path.basename(geojsonPath), parentType='item',
+                parent=item, user=user, mimeType='application/vnd.geo+json')
+
+        # Merge into the current metadata, unless the columnar file was
+        # replaced meanwhile.
+        item = itemModel.load(kwargs['itemId'], force=True)
+        minervaMeta = item['meta']['minerva']
+        if str(minervaMeta['columnar_file']['_id']) != str(
+                columnarFile['_id']):
+            fileModel.remove(geojsonFile)
+            jobModel.updateJob(job, status=JobStatus.SUCCESS,
+                               log='Columnar file replaced, discarded\n')
+            return
+        minervaMeta['geojson_file'] = {
+            'name': geojsonFile['name'],
+            '_id': geojsonFile['_id']
+        }
+        addGzipCompanion(item, minervaMeta['geojson_file'], user)
+        minervaMeta['geo_render'] = {
+            'type': 'geojson',
+            'file_id': geojsonFile['_id']
+        }
+        updateMinervaMetadata(item, minervaMeta)
+        jobModel.updateJob(job, status=JobStatus.SUCCESS,
+                           log='Wrote %s (%d bytes)\n' % (
+                               geojsonFile['name'], geojsonFile['size']))
+    except Exception:
+        t, val, tb = sys.exc_info()
+        log = '%s: %s\n%s' % (t.__name__, repr(val), traceback.format_tb(tb))
+        jobModel.updateJob(job, status=JobStatus.ERROR, log=log)
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
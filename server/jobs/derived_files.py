@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+
+from girder.plugins.jobs.constants import JobStatus
+from girder.utility.model_importer import ModelImporter
+
+from girder.plugins.minerva.constants import PluginSettings
+from girder.plugins.minerva.utility.cluster_utility import PointClusterer
+from girder.plugins.minerva.utility.compression_utility import \
+    decompressChunks
+from girder.plugins.minerva.utility.dataset_utility import \
+    jsonArrayElementRanges
+from girder.plugins.minerva.utility.minerva_utility import \
+    addGzipCompanion, jobCanceled, updateMinervaMetadata
+from girder.plugins.minerva.utility.simplify_utility import \
+    GeoJsonSimplifier, zoomTolerance
+from girder.plugins.minerva.utility.spatial_utility import \
+    SpatialIndexBuilder
+from girder.plugins.minerva.utility.summary_utility import \
+    PropertySummarizer
+from girder.plugins.minerva.utility.topojson_utility import \
+    TopoJsonEncoder, topojsonName
+
+# Number of features between cancellation checks.
+PROGRESS_INTERVAL = 10000
+
+
+def _upload(item, user, data, name, mimeType):
+    return ModelImporter.model('upload').uploadFromFile(
+        io.BytesIO(data), len(data), name, parentType='item', parent=item,
+        user=user, mimeType=mimeType)
+
+
+def _fileChunks(path):
+    with open(path, 'rb') as fh:
+        while True:
+            data = fh.read(65536)
+            if not data:
+                break
+            yield data
+
+
+def _topojson(item, user, name, chunks, tmpdir):
+    """Store the TopoJSON encoding of a GeoJSON file, returning its entry."""
+    path = os.path.join(tmpdir, topojsonName(name))
+    with open(path, 'w') as writer:
+        TopoJsonEncoder(item['name']).toTopoJson(chunks, writer)
+    with open(path, 'rb') as fh:
+        topojsonFile = ModelImporter.model('upload').uploadFromFile(
+            fh, os.path.getsize(path), os.path.basename(path),
+            parentType='item', parent=item, user=user,
+            mimeType='application/json')
+    os.remove(path)
+    entry = {
+        'name': topojsonFile['name'],
+        '_id': topojsonFile['_id']
+    }
+    addGzipCompanion(item, entry, user)
+    return entry
+
+
+def _simplifiedLevels(item, user, simplifier, paths, tmpdir, topojson):
+    """Store the simplified levels worth keeping."""
+    levels = []
+    for level in simplifier.keptLevels():
+        path = paths[level]
+        with open(path, 'rb') as fh:
+            levelFile = ModelImporter.model('upload').uploadFromFile(
+                fh, os.path.getsize(path), os.path.basename(path),
+                parentType='item', parent=item, user=user,
+                mimeType='application/vnd.geo+json')
+        entry = {
+            'name': levelFile['name'],
+            '_id': levelFile['_id'],
+            'zoom': simplifier.zooms[level],
+            'tolerance': zoomTolerance(simplifier.zooms[level]),
+            'vertex_count': simplifier.levelVertexCounts[level]
+        }
+        addGzipCompanion(item, entry, user)
+        if topojson:
+            entry['topojson_file'] = _topojson(
+                item, user, levelFile['name'],
+                lambda: _fileChunks(path), tmpdir)
+        levels.append(entry)
+    return {
+        'vertex_count': simplifier.vertexCount,
+        'levels': levels
+    }
+
+
+def _entryFileIds(value):
+    """The ids of the files stored for metadata entries, recursively."""
+    if isinstance(value, dict):
+        ids = [value['_id']] if '_id' in value else []
+        for child in value.values():
+            ids.extend(_entryFileIds(child))
+        return ids
+    if isinstance(value, list):
+        return [fileId for child in value for fileId in _entryFileIds(child)]
+    return []
+
+
+def run(job):
+    """
+    Local job building the files derived from the GeoJSON file of a dataset
+    in a single pass over its features: the simplified levels, the spatial
+    index, the point clusters and the property summary.  Compressed files
+    can't be read by ranges, so they get no spatial index.  The TopoJSON
+    encodings of the GeoJSON file and of its simplified levels are made
+    last, reading each of them twice.
+    """
+    jobModel = ModelImporter.model('job', 'jobs')
+    job = jobModel.updateJob(job, status=JobStatus.RUNNING,
+                             log='Started building derived files\n')
+    kwargs = job['kwargs']
+    itemModel = ModelImporter.model('item')
+    fileModel = ModelImporter.model('file')
+    tmpdir = tempfile.mkdtemp()
+    writers = []
+    try:
+        item = itemModel.load(kwargs['itemId'], force=True)
+        user = ModelImporter.model('user').load(kwargs['userId'], force=True)
+        derived = kwargs['derived']
+        geojsonEntry = item['meta']['minerva']['geojson_file']
+        geojsonFile = fileModel.load(geojsonEntry['_id'], force=True)
+
+        indexBuilder = SpatialIndexBuilder() \
+            if 'spatial_index' in derived and \
+            not geojsonEntry.get('compression') else None
+        clusterer = PointClusterer() if 'clusters' in derived else None
+        summarizer = PropertySummarizer() \
+            if 'property_summary' in derived else None
+        simplifier = None
+        if 'simplified' in derived:
+            simplifier = GeoJsonSimplifier()
+            paths = [os.path.join(tmpdir, '%s.z%d%s' % (
+                item['name'], zoom, PluginSettings.GEOJSON_EXTENSION))
+                for zoom in simplifier.zooms]
+            writers = [open(path, 'w') for path in paths]
+            simplifier.open(writers)
+
+        count = 0
+        for offset, data in jsonArrayElementRanges(decompressChunks(
+                fileModel.download(geojsonFile, headers=False)())[2],
+                'features'):
+            feature = json.loads(data.decode('utf8'))
+            if indexBuilder is not None:
+                indexBuilder.addFeature(offset, len(data), feature)
+            if clusterer is not None:
+                clusterer.addFeature(feature)
+            if summarizer is not None:
+                summarizer.addProperties(feature.get('properties'))
+            if simplifier is not None:
+                # Last, as it replaces the geometry of the feature
+                simplifier.addFeature(feature)
+            count += 1
+            if not count % PROGRESS_INTERVAL:
+                if jobCanceled(job):
+                    jobModel.updateJob(job, log='Canceled\n')
+                    return
+                job = jobModel.updateJob(
+                    job, progressMessage='%d features' % count)
+        if simplifier is not None:
+            simplifier.close()
+            for writer in writers:
+                writer.close()
+
+        entries = {}
+        if simplifier is not None:
+            entries['simplified'] = _simplifiedLevels(
+                item, user, simplifier, paths, tmpdir, 'topojson' in derived)
+        if indexBuilder is not None:
+            index, indexCount = indexBuilder.build()
+            indexFile = _upload(
+                item, user, index,
+                item['name'] + PluginSettings.SPATIAL_INDEX_EXTENSION,
+                'application/octet-stream')
+            entries['spatial_index'] = {
+                'name': indexFile['name'],
+                '_id': indexFile['_id'],
+                'file_id': geojsonFile['_id'],
+                'count': indexCount
+            }
+        if clusterer is not None:
+            clusters, pointCount = clusterer.build()
+            clustersFile = _upload(
+                item, user, clusters,
+                item['name'] + PluginSettings.CLUSTERS_EXTENSION,
+                'application/octet-stream')
+            entries['clusters'] = {
+                'name': clustersFile['name'],
+                '_id': clustersFile['_id'],
+                'file_id': geojsonFile['_id'],
+                'point_count': pointCount
+            }
+        if summarizer is not None:
+            summary = json.dumps(summarizer.summary()).encode('utf8')
+            summaryFile = _upload(
+                item, user, summary,
+                item['name'] + PluginSettings.SUMMARY_EXTENSION,
+                'application/json')
+            entries['property_summary'] = {
+                'name': summaryFile['name'],
+                '_id': summaryFile['_id'],
+                'file_id': geojsonFile['_id']
+            }
+        topojsonEntry = None
+        if 'topojson' in derived:
+            topojsonEntry = _topojson(
+                item, user, geojsonFile['name'],
+                lambda: decompressChunks(fileModel.download(
+                    geojsonFile, headers=False)())[2], tmpdir)
+
+        # Merge into the current metadata, unless the dataset was converted
+        # again meanwhile.
+        item = itemModel.load(kwargs['itemId'], force=True)
+        minervaMeta = item['meta']['minerva']
+        if str(minervaMeta['geojson_file']['_id']) != str(geojsonFile['_id']):
+            for fileId in _entryFileIds([entries, topojsonEntry]):
+                derivedFile = fileModel.load(fileId, force=True)
+                if derivedFile is not None:
+                    fileModel.remove(derivedFile)
+            jobModel.updateJob(job, status=JobStatus.SUCCESS,
+                               log='GeoJSON file replaced, discarded\n')
+            return
+        minervaMeta.update(entries)
+        if topojsonEntry is not None:
+            minervaMeta['geojson_file']['topojson_file'] = topojsonEntry
+        updateMinervaMetadata(item, minervaMeta)
+        jobModel.updateJob(job, status=JobStatus.SUCCESS,
+                           log='Built %s from %d features\n' % (
+                               ', '.join(sorted(entries)), count))
+    except Exception:
+        t, val, tb = sys.exc_info()
+        log = '%s: %s\n%s' % (t.__name__, repr(val), traceback.format_tb(tb))
+        jobModel.updateJob(job, status=JobStatus.ERROR, log=log)
+        raise
+    finally:
+        for writer in writers:
+            writer.close()
+        shutil.rmtree(tmpdir)
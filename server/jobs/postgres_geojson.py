@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import datetime
+import decimal
+import hashlib
+import json
+import sys
+import tempfile
+import traceback
+
+from girder.constants import AccessType
+from girder.plugins.jobs.constants import JobStatus
+from girder.utility import assetstore_utilities, config
+from girder.utility.model_importer import ModelImporter
+
+from girder.plugins.minerva.rest.geojson_dataset import GeojsonDataset
+from girder.plugins.minerva.utility.minerva_utility import jobCanceled
+
+# Number of rows written between progress updates and cancellation checks.
+PROGRESS_INTERVAL = 1000
+
+# Shared sqlalchemy engines for reading table statistics, keyed by db uri.
+_engines = {}
+
+FEATURE_COLLECTION_HEADER = '{"type": "FeatureCollection", "features": [\n'
+FEATURE_COLLECTION_FOOTER = '\n]}\n'
+
+
+def _jsonDefault(value):
+    # Database drivers return Decimal and datetime values that json can't
+    # serialize directly.
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def _encode(data):
+    if not isinstance(data, bytes):
+        data = data.encode('utf8')
+    return data
+
+
+def _rowToJson(row, geometryType):
+    if geometryType == 'built-in':
+        feature = row['feature']
+        if isinstance(feature, (bytes, type(u''))):
+            # Some drivers hand back json columns as text.
+            return feature
+        return json.dumps(feature, default=_jsonDefault)
+    return json.dumps(row, default=_jsonDefault)
+
+
+def streamRows(job, rows, fh, geometryType):
+    """
+    Write rows from a database cursor to a file handle as either a GeoJSON
+    FeatureCollection (built-in geometry) or a json array of records (linked
+    geometry), updating job progress as rows are written.
+
+    :param job: the job document to report progress on.
+    :param rows: an iterable of row dicts.
+    :param fh: a binary file handle to write to.
+    :param geometryType: 'built-in' or 'link'.
+    :returns: the number of rows written, or None if the job was canceled.
+    """
+    jobModel = ModelImporter.model('job', 'jobs')
+    if geometryType == 'built-in':
+        header, footer = FEATURE_COLLECTION_HEADER, FEATURE_COLLECTION_FOOTER
+    else:
+        header, footer = '[\n', '\n]\n'
+    fh.write(_encode(header))
+    count = 0
+    for row in rows:
+        if count:
+            fh.write(b',\n')
+        fh.write(_encode(_rowToJson(row, geometryType)))
+        count += 1
+        if not count % PROGRESS_INTERVAL:
+            if jobCanceled(job):
+                return None
+            job = jobModel.updateJob(
+                job, progressCurrent=count,
+                progressMessage='%d rows written' % count)
+    fh.write(_encode(footer))
+    return count
+
+
+def _statisticsEngine(uri):
+    import sqlalchemy
+    if uri not in _engines:
+        _engines[uri] = sqlalchemy.create_engine(uri)
+    return _engines[uri]
+
+
+def tableChangeMarker(assetstore, adapter, conn, schema, table):
+    """
+    Get a value that changes whenever the contents of a table change.  If the
+    table has the configured ``postgres_version_column``, the maximum value of
+    that column is used, otherwise the insert/update/delete counters from
+    ``pg_stat_user_tables``.
+
+    :returns: a marker string, or None if no marker could be determined, in
+        which case results must not be reused.
+    """
+    versionColumn = config.getConfig().get('minerva', {}).get(
+        'postgres_version_column')
+    try:
+        if versionColumn and versionColumn in [
+                f['name'] for f in conn.getFieldInfo()]:
+            result = adapter.queryDatabase(conn, {
+                'fields': [{
+                    'func': 'max',
+                    'param': {'field': versionColumn},
+                    'reference': 'version'
+                }],
+                'format': 'rawdict'})
+            return 'version:%s' % list(result[0]())[0]['version']
+        engine = _statisticsEngine(assetstore['database']['uri'])
+        row = engine.execute(
+            'SELECT n_tup_ins, n_tup_upd, n_tup_del FROM pg_stat_user_tables '
+            'WHERE schemaname = %s AND relname = %s', (schema, table)).fetchone()
+    except Exception:
+        return None
+    if row is None:
+        return None
+    return 'stat:%d:%d:%d' % tuple(row)
+
+
+def resultCacheKey(kwargs, marker):
+    """
+    Hash everything that determines the content of a postgres dataset: the
+    assetstore, the full query and the geometry definition, plus the table
+    change marker.
+    """
+    dbParams = dict(kwargs['dbParams'])
+    dbParams.pop('clientid', None)
+    spec = {
+        'assetstoreId': kwargs['assetstoreId'],
+        'dbParams': dbParams,
+        'postgresGeojson': kwargs['postgresGeojson'],
+        'marker': marker
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True)).hexdigest()
+
+
+def findCachedResult(cacheKey, item, user):
+    """
+    Find the file of an up to date result for the same query that is stored on
+    another dataset item the user can read.  Results are only reused across
+    users who can read each other's datasets.
+    """
+    itemModel = ModelImporter.model('item')
+    cursor = itemModel.find({
+        'meta.minerva.postgresGeojson.cacheKey': cacheKey,
+        'meta.minerva.geo_render': {'$exists': True},
+        '_id': {'$ne': item['_id']}
+    })
+    for cached in itemModel.filterResultsByPermission(
+            cursor, user, AccessType.READ):
+        file = ModelImporter.model('file').load(
+            cached['meta']['minerva']['geo_render']['file_id'], force=True)
+        # The result file may have been deleted from its dataset
+        if file is not None:
+            return file
+    return None
+
+
+def run(job):
+    """
+    Local job that materializes a postgres query into a geojson dataset.  Rows
+    are streamed from the database into a temporary file, so the full result
+    is never held in memory, and the file is then uploaded to the dataset item
+    created by the REST endpoint.
+    """
+    jobModel = ModelImporter.model('job', 'jobs')
+    job = jobModel.updateJob(job, status=JobStatus.RUNNING,
+                             log='Started postgres query\n')
+    kwargs = job['kwargs']
+    itemModel = ModelImporter.model('item')
+    item = itemModel.load(kwargs['itemId'], force=True)
+    try:
+        user = ModelImporter.model('user').load(kwargs['userId'], force=True)
+        assetstore = ModelImporter.model('assetstore').load(
+            kwargs['assetstoreId'])
+        adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
+        conn = adapter.getDBConnectorForTable(kwargs['table'])
+        postgresGeojson = kwargs['postgresGeojson']
+        geometryField = postgresGeojson['geometryField']
+
+        dbTable = kwargs['dbParams']['tables'][0]
+        marker = tableChangeMarker(
+            assetstore, adapter, conn, dbTable['schema'], dbTable['table'])
+        if marker is not None:
+            postgresGeojson['cacheKey'] = resultCacheKey(kwargs, marker)
+            cachedFile = findCachedResult(
+                postgresGeojson['cacheKey'], item, user)
+            if cachedFile is not None:
+                # Reference the stored result rather than running the query.
+                ModelImporter.model('file').copyFile(
+                    cachedFile, user, item=item)
+                GeojsonDataset().createGeojsonDatasetFromItem(
+                    item, user, postgresGeojson=postgresGeojson)
+                jobModel.updateJob(job, status=JobStatus.SUCCESS,
+                                   log='Reused result file %s\n' %
+                                   cachedFile['_id'])
+                return
+
+        rows = adapter.queryDatabase(conn, kwargs['dbParams'])[0]()
+        with tempfile.TemporaryFile() as fh:
+            count = streamRows(job, rows, fh, geometryField['type'])
+            if count is None:
+                itemModel.remove(item)
+                jobModel.updateJob(job, log='Canceled, removed dataset\n')
+                return
+            size = fh.tell()
+            fh.seek(0)
+            job = jobModel.updateJob(
+                job, progressCurrent=count, progressTotal=count,
+                progressMessage='Uploading %d rows' % count,
+                log='Wrote %d rows (%d bytes)\n' % (count, size))
+            ModelImporter.model('upload').uploadFromFile(
+                fh, size, item['name'], parentType='item', parent=item,
+                user=user, mimeType='application/json')
+
+        GeojsonDataset().createGeojsonDatasetFromItem(
+            item, user, postgresGeojson=postgresGeojson)
+        jobModel.updateJob(job, status=JobStatus.SUCCESS,
+                           log='Finished postgres dataset\n')
+    except Exception:
+        t, val, tb = sys.exc_info()
+        log = '%s: %s\n%s' % (t.__name__, repr(val), traceback.format_tb(tb))
+        # Don't leave the empty dataset behind, as on cancel
+        if item is not None:
+            itemModel.remove(item)
+            log += 'Removed dataset\n'
+        jobModel.updateJob(job, status=JobStatus.ERROR, log=log)
+        raise
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import itertools
+import json
+import multiprocessing
+import sys
+import tempfile
+import traceback
+from multiprocessing.pool import ThreadPool
+
+from girder.plugins.jobs.constants import JobStatus
+from girder.utility.model_importer import ModelImporter
+
+from girder.plugins.large_image.constants import TILE_FORMAT_NUMPY
+from girder.plugins.large_image.models.image_item import ImageItem
+from girder.plugins.minerva.rest.geojson_dataset import GeojsonDataset
+from girder.plugins.minerva.utility.compression_utility import \
+    ChunkReader, decompressChunks
+from girder.plugins.minerva.utility.dataset_utility import geojsonFeatures
+from girder.plugins.minerva.utility.minerva_utility import jobCanceled
+from girder.plugins.minerva.utility.zonal_utility import MAX_WINDOW_SIZE, \
+    ZONAL_STATISTICS, PixelTransform, geographicReprojector, polygonRings, \
+    zoneStatistics
+
+# Number of zones between progress updates and cancellation checks.
+PROGRESS_INTERVAL = 100
+
+ZONAL_THREADS = min(4, multiprocessing.cpu_count())
+
+# Zones whose raster windows are read before they are summarized, bounding
+# the windows held in memory.
+ZONE_BATCH_SIZE = 2 * ZONAL_THREADS
+
+
+def bandNodata(source, metadata, band):
+    """
+    The nodata value of a band of a raster, from the band information of its
+    tile source or else from its GDAL dataset, or None.
+    """
+    bands = metadata.get('bands') or {}
+    info = bands.get(band) or bands.get(str(band))
+    if info is not None:
+        return info.get('nodata')
+    dataset = getattr(source, 'dataset', None)
+    if dataset is not None and band <= dataset.RasterCount:
+        return dataset.GetRasterBand(band).GetNoDataValue()
+    return None
+
+
+def zoneTask(source, transform, feature, band, bins, nodata):
+    """
+    Read the raster window under a feature, returning the argument of
+    zoneStatistics.  Features without polygons in the raster get an empty
+    window.
+    """
+    rings = [transform.pixels(ring)
+             for ring in polygonRings(feature.get('geometry'))]
+    window = transform.window(rings)
+    if window is None:
+        return None, [], 1.0, bins, nodata
+    left, top, right, bottom = window
+    values, _ = source.getRegion(
+        region={'left': left, 'top': top, 'right': right,
+                'bottom': bottom, 'units': 'base_pixels'},
+        output={'maxWidth': MAX_WINDOW_SIZE,
+                'maxHeight': MAX_WINDOW_SIZE},
+        format=TILE_FORMAT_NUMPY)
+    if values.ndim == 3:
+        values = values[:, :, min(band, values.shape[2]) - 1]
+    # Large windows are read at a lower resolution
+    scaleX = values.shape[1] / float(right - left)
+    scaleY = values.shape[0] / float(bottom - top)
+    rings = [(ring - (left, top)) * (scaleX, scaleY) for ring in rings]
+    return values, rings, 1.0 / (scaleX * scaleY), bins, nodata
+
+
+def zonePool():
+    """
+    A thread pool for zoneStatistics.  Local jobs run in a thread of the
+    server, where forking a process holding pymongo connections is unsafe,
+    and Python 2.7 can't spawn processes instead, so the zones are
+    summarized in threads; numpy releases the GIL in the rasterization,
+    masking and reductions that make up most of the work.
+    """
+    return ThreadPool(ZONAL_THREADS)
+
+
+def run(job):
+    """
+    Local job computing the statistics of a geotiff dataset under each
+    polygon of a GeoJSON dataset.  The polygons are streamed a batch at a
+    time: the raster windows of a batch are read in the job's thread, then
+    rasterized and summarized in a thread pool.  The features are written
+    with their statistics as properties to the GeoJSON dataset item created
+    by the REST endpoint.
+    """
+    jobModel = ModelImporter.model('job', 'jobs')
+    job = jobModel.updateJob(job, status=JobStatus.RUNNING,
+                             log='Started zonal statistics\n')
+    kwargs = job['kwargs']
+    itemModel = ModelImporter.model('item')
+    item = itemModel.load(kwargs['itemId'], force=True)
+    pool = None
+    try:
+        user = ModelImporter.model('user').load(kwargs['userId'], force=True)
+        raster = itemModel.load(kwargs['rasterId'], force=True)
+        zones = itemModel.load(kwargs['zonesId'], force=True)
+        source = ImageItem().tileSource(raster)
+        metadata = source.getMetadata()
+        transform = PixelTransform(metadata, geographicReprojector(
+            metadata['bounds'].get('srs')))
+        band = kwargs['band']
+        nodata = bandNodata(source, metadata, band)
+        zonesMeta = zones['meta']['minerva']
+        zonesFile = ModelImporter.model('file').load(
+            zonesMeta['geojson_file']['_id'], force=True)
+        features = geojsonFeatures(ChunkReader(decompressChunks(
+            ModelImporter.model('file').download(
+                zonesFile, headers=False)())[2]))
+        job = jobModel.updateJob(
+            job, progressCurrent=0,
+            progressTotal=zonesMeta.get('stats', {}).get('feature_count'))
+
+        pool = zonePool()
+        prefix = kwargs['prefix']
+        index = 0
+        with tempfile.TemporaryFile() as fh:
+            fh.write(b'{"type": "FeatureCollection", "features": [\n')
+            while True:
+                batch = list(itertools.islice(features, ZONE_BATCH_SIZE))
+                if not batch:
+                    break
+                tasks = [zoneTask(source, transform, feature, band,
+                                  kwargs['bins'], nodata)
+                         for feature in batch]
+                statistics = pool.map(zoneStatistics, tasks)
+                for feature, stats in zip(batch, statistics):
+                    properties = dict(feature.get('properties') or {})
+                    for name in ZONAL_STATISTICS:
+                        properties[prefix + name] = stats[name]
+                    feature['properties'] = properties
+                    if index:
+                        fh.write(b',\n')
+                    fh.write(json.dumps(feature).encode('utf8'))
+                    index += 1
+                    if not index % PROGRESS_INTERVAL:
+                        if jobCanceled(job):
+                            itemModel.remove(item)
+                            jobModel.updateJob(
+                                job, log='Canceled, removed dataset\n')
+                            return
+                        job = jobModel.updateJob(
+                            job, progressCurrent=index,
+                            progressMessage='%d zones' % index)
+            fh.write(b'\n]}\n')
+            size = fh.tell()
+            fh.seek(0)
+            ModelImporter.model('upload').uploadFromFile(
+                fh, size, item['name'], parentType='item', parent=item,
+                user=user, mimeType='application/vnd.geo+json')
+
+        GeojsonDataset().createGeojsonDatasetFromItem(item, user)
+        jobModel.updateJob(job, status=JobStatus.SUCCESS,
+                           progressCurrent=index,
+                           log='Computed statistics of %d zones\n' % index)
+    except Exception:
+        t, val, tb = sys.exc_info()
+        log = '%s: %s\n%s' % (t.__name__, repr(val), traceback.format_tb(tb))
+        # Don't leave the empty dataset behind, as on cancel
+        if item is not None:
+            itemModel.remove(item)
+            log += 'Removed dataset\n'
+        jobModel.updateJob(job, status=JobStatus.ERROR, log=log)
+        raise
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
@@ -22,6 +22,7 @@ import requests
 import cherrypy
 from base64 import b64encode
 from girder import events
+from girder.utility.model_importer import ModelImporter
 from girder.utility.webroot import Webroot
 from girder.plugins.minerva.rest import \
     dataset, session, \
@@ -76,6 +77,13 @@ def load(info):
 
     events.bind('model.setting.validate', 'minerva', validate_settings)
 
+    # Postgres dataset results are looked up by their query hash for reuse.
+    ModelImporter.model('item').ensureIndex(
+        ('meta.minerva.postgresGeojson.cacheKey', {'sparse': True}))
+    # Gaia process results are looked up by their process cache key.
+    ModelImporter.model('item').ensureIndex(
+        ('meta.minerva.process_cache_key', {'sparse': True}))
+
     info['apiRoot'].minerva_dataset = dataset.Dataset()
     info['apiRoot'].minerva_session = session.Session()
 
@@ -17,18 +17,24 @@
 #  limitations under the License.
 ###############################################################################
 
+import hashlib
+import io
+import itertools
 import os
 import shutil
 import pymongo
 import tempfile
 import json
+import cherrypy
+import dateutil.parser
 import geojson
 
-from shapely.geometry import shape
+from shapely.geometry import box, shape
 
 from girder.api import access
 from girder.api.describe import Description, autoDescribeRoute
-from girder.api.rest import Resource, loadmodel, RestException, GirderException
+from girder.api.rest import Resource, loadmodel, RestException, \
+    GirderException, setRawResponse
 from girder.constants import AccessType
 from girder.utility import config, assetstore_utilities
 
@@ -37,11 +43,38 @@ from girder.models.user import User
 from girder.models.setting import Setting
 from girder.plugins.minerva.constants import PluginSettings
 from girder.plugins.minerva.utility.minerva_utility import findDatasetFolder, \
-    updateMinervaMetadata, findSharedDatasetFolders, \
-    findSharedFolder
+    updateMinervaMetadata, addGzipCompanion, addJobOutput, \
+    findSharedDatasetFolders, findSharedFolder, LruCache
 from girder.plugins.minerva.utility.dataset_utility import \
-    jsonArrayHead, GeoJsonMapper, jsonObjectReader
+    jsonArrayHead, GeoJsonMapper, jsonObjectReader, jsonArrayElementRanges, \
+    chunkRanges, geojsonFeatures
+from girder.plugins.minerva.utility.compression_utility import \
+    ChunkReader, acceptsEncoding, decompressChunks, detectCompression, \
+    gzipChunks, uncompressedExtensions
+from girder.plugins.minerva.utility.columnar_utility import \
+    geoParquetToGeoJson
+from girder.plugins.minerva.utility.csv_utility import \
+    CsvGeoJsonConverter
+from girder.plugins.minerva.utility.shapefile_utility import \
+    ShapefileReader
+from girder.plugins.minerva.utility.classify_utility import \
+    CLASSIFICATION_CACHE_SIZE, CLASSIFY_METHODS, MAX_CLASSES, \
+    geojsonFieldValues, classify as classifyValues
+from girder.plugins.minerva.utility.cluster_utility import \
+    CLUSTER_CACHE_SIZE, ClusterIndex, PointClusterer, isPointDataset
+from girder.plugins.minerva.utility.spatial_utility import SpatialIndex
+from girder.plugins.minerva.utility.summary_utility import \
+    SUMMARY_CACHE_SIZE, summarizeGeojsonProperties
+from girder.plugins.minerva.utility.simplify_utility import \
+    isSimplifiable, levelForTolerance, zoomTolerance
+from girder.plugins.minerva.utility.tile_utility import TilePrefetcher, \
+    TILE_CACHE_SIZE, TILE_METADATA_CACHE_SIZE, TILE_SOURCE_CACHE_SIZE, \
+    neighbourTiles
+from girder.plugins.minerva.utility.topojson_utility import TopoJsonEncoder
+from girder.plugins.minerva.utility.format_utility import SniffStream, \
+    sniffFile
 from girder.plugins.large_image.models.image_item import ImageItem
+from girder.plugins.large_image.tilesource import TileSourceException
 
 
 import girder_client
@@ -65,7 +98,27 @@ class Dataset(Resource):
         self.route('POST', (':id', 'jsonrow'), self.createJsonRow)
         self.route('GET', (':id', 'download'), self.download)
         self.route('GET', (':id', 'bound'), self.getBound)
+        self.route('GET', (':id', 'frames'), self.getFrameIndex)
+        self.route('GET', (':id', 'frames', 'data'), self.getFrames)
+        self.route('GET', (':id', 'features'), self.getFeatures)
+        self.route('GET', (':id', 'clusters'), self.getClusters)
+        self.route('GET', (':id', 'classify'), self.classify)
+        self.route('GET', (':id', 'summary'), self.getSummary)
+        self.route('GET', (':id', 'tiles', 'zxy', ':z', ':x', ':y'),
+                   self.getTile)
+        self.route('POST', (':id', 'zonal_statistics'),
+                   self.createZonalStatistics)
         self.client = None
+        # Shared by every request, keyed by item and image file ids
+        self.tileSources = LruCache(TILE_SOURCE_CACHE_SIZE)
+        self.tiles = LruCache(TILE_CACHE_SIZE, lambda tile: len(tile[0]))
+        self.tileMetadataCache = LruCache(TILE_METADATA_CACHE_SIZE)
+        self.tilePrefetcher = TilePrefetcher(self._fetchTile)
+        # Keyed by GeoJSON file id
+        self.clusterCache = LruCache(CLUSTER_CACHE_SIZE)
+        self.summaryCache = LruCache(SUMMARY_CACHE_SIZE)
+        # Keyed by GeoJSON file id, field, method and class count
+        self.classificationCache = LruCache(CLASSIFICATION_CACHE_SIZE)
 
     def _initClient(self):
         if self.client is None:
@@ -107,22 +160,23 @@ class Dataset(Resource):
 
     def _convertJsonfileToGeoJson(self, item, tmpdir):
         # use the first filename with json ext found in original_files
-        filename = None
+        jsonFile = None
         files = item['meta']['minerva']['original_files']
         for f in files:
-            if f['name'].endswith('.json'):
-                filename = f['name']
-        if filename is None:
+            if f['name'].endswith('.json') or \
+                    f.get('member', '').endswith('.json'):
+                jsonFile = f
+        if jsonFile is None:
             raise RestException('Dataset %s has no json files' % item['name'])
-        jsonFilepath = os.path.join(tmpdir, item['name'],
-                                    filename)
         geoJsonFilename = item['name'] + PluginSettings.GEOJSON_EXTENSION
         geoJsonFilepath = os.path.join(tmpdir, item['name'], geoJsonFilename)
 
         mapping = item['meta']['minerva']['mapper']
         geoJsonMapper = GeoJsonMapper(objConverter=None,
                                       mapping=mapping)
-        objects = jsonObjectReader(jsonFilepath)
+        # Read the file from the assetstore, as it may be compressed
+        file = self.model('file').load(jsonFile['_id'], force=True)
+        objects = jsonObjectReader(ChunkReader(self._fileChunks(file)))
         geoJsonMapper.mapToJsonFile(tmpdir, objects, geoJsonFilepath)
 
         return geoJsonFilepath
@@ -167,6 +221,96 @@ class Dataset(Resource):
         self.model('item').setMetadata(item, item['meta'])
         return minerva_metadata
 
+    def _convertCsvToGeoJson(self, item):
+        """
+        Stream the csv file of a dataset through a CsvGeoJsonConverter into a
+        GeoJSON file, so the csv is never held in memory.
+        """
+        minervaMeta = item['meta']['minerva']
+        if 'mapper' not in minervaMeta:
+            raise RestException('Dataset %s has no csv mapper' % item['name'])
+        csvFile = self.model('file').load(
+            minervaMeta['original_files'][0]['_id'], force=True)
+        converter = CsvGeoJsonConverter(minervaMeta['mapper'])
+        tmpdir = tempfile.mkdtemp()
+        try:
+            geojsonPath = os.path.join(
+                tmpdir, item['name'] + PluginSettings.GEOJSON_EXTENSION)
+            with open(geojsonPath, 'w') as writer:
+                try:
+                    converter.toGeoJson(self._fileChunks(csvFile), writer)
+                except ValueError as e:
+                    raise RestException(str(e))
+            with open(geojsonPath, 'rb') as reader:
+                geojsonFile = self.model('upload').uploadFromFile(
+                    reader, os.path.getsize(geojsonPath),
+                    os.path.basename(geojsonPath), parentType='item',
+                    parent=item, user=self.getCurrentUser(),
+                    mimeType='application/vnd.geo+json')
+        finally:
+            shutil.rmtree(tmpdir)
+        minervaMeta['geojson_file'] = {
+            'name': geojsonFile['name'],
+            '_id': geojsonFile['_id']
+        }
+        addGzipCompanion(item, minervaMeta['geojson_file'],
+                         self.getCurrentUser())
+        minervaMeta['source'] = {'layer_source': 'GeoJSON'}
+        minervaMeta['csv_conversion'] = {
+            'row_count': converter.rowCount,
+            'skipped_count': converter.skippedCount
+        }
+        self._scheduleDerivedFiles(
+            item, minervaMeta, self.getCurrentUser(),
+            ['spatial_index', 'clusters', 'property_summary'])
+        return minervaMeta
+
+    def _shapefileReader(self, minervaMeta):
+        components = {}
+        for ext, entry in minervaMeta['shapefile'].items():
+            components[ext] = self.model('file').load(entry['_id'], force=True)
+
+        def text(ext):
+            if ext not in components:
+                return None
+            return b''.join(self.model('file').download(
+                components[ext], headers=False)()).decode('utf8', 'replace')
+        return ShapefileReader(
+            self._rangeReader(components['shp']),
+            self._rangeReader(components['shx']),
+            components['shx']['size'],
+            self._rangeReader(components['dbf']) if 'dbf' in components
+            else None,
+            prj=text('prj'), encoding=text('cpg') or 'utf-8')
+
+    def _convertShapefileToGeoJson(self, item, minervaMeta):
+        """
+        Write the GeoJSON file of a shapefile dataset, reading the records a
+        batch at a time with ranged reads.
+        """
+        reader = self._shapefileReader(minervaMeta)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            geojsonPath = os.path.join(
+                tmpdir, item['name'] + PluginSettings.GEOJSON_EXTENSION)
+            with open(geojsonPath, 'w') as writer:
+                reader.toGeoJson(writer)
+            with open(geojsonPath, 'rb') as fh:
+                geojsonFile = self.model('upload').uploadFromFile(
+                    fh, os.path.getsize(geojsonPath),
+                    os.path.basename(geojsonPath), parentType='item',
+                    parent=item, user=self.getCurrentUser(),
+                    mimeType='application/vnd.geo+json')
+        finally:
+            shutil.rmtree(tmpdir)
+        minervaMeta['geojson_file'] = {
+            'name': geojsonFile['name'],
+            '_id': geojsonFile['_id']
+        }
+        addGzipCompanion(item, minervaMeta['geojson_file'],
+                         self.getCurrentUser())
+        return updateMinervaMetadata(item, minervaMeta)
+
     def createGeoJsonFromDataset(self, item, params):
         # TODO there is probably a problem when
         # we look for a name in an item as a duplicate
@@ -191,6 +335,8 @@ class Dataset(Resource):
                 'name': geojsonFile['name'],
                 '_id': geojsonFile['_id']
             }
+            addGzipCompanion(item, item['meta']['minerva']['geojson_file'],
+                             self.getCurrentUser())
 
         return self.datasetJob(item, converterJob)
 
@@ -230,73 +376,221 @@ class Dataset(Resource):
         minerva_metadata = {
             'source_type': 'item'
         }
+        # Sniff the start of every file, keeping the streams open so that the
+        # statistics of the detected file come from the same download.
+        best = (0, None, None, None, None)
+        streams = []
         for file in self.model('item').childFiles(item=item, limit=0):
-            # Check the first few k of a file to see if this might be a
-            # geojson timeseries.  Crudely, we expect this to be a json array
-            # which contains objects, each of which has at least a geojson
-            # element.  This test will fail if there are other elements in the
-            # first object that push the geojson element beyond the tested
-            # header length.  It could give a false positive, too.  The correct
-            # way would be to download and parse the whole file, but that would
-            # be more expensive in memory and time.
-            headerLen = 2048
-            fileHeader = ''
-            for headerData in self.model('file').download(file, headers=False, endByte=headerLen)():
-                fileHeader = (fileHeader + headerData)[:headerLen]
-                if len(fileHeader) >= headerLen:
-                    break
-            if (fileHeader.lstrip()[:1] == '[' and
-                    fileHeader.lstrip()[1:].lstrip()[:1] == '{' and
-                    '"geojson"' in fileHeader):
-                minerva_metadata['original_type'] = 'geojson-timeseries'
-                minerva_metadata['dataset_type'] = 'geojson-timeseries'
-                minerva_metadata['original_files'] = [{
-                    'name': file['name'], '_id': file['_id']}]
-                minerva_metadata['geojson_file'] = {
-                    'name': file['name'], '_id': file['_id']}
-                minerva_metadata['source'] = {
-                    'layer_source': 'GeoJSON'}
-                break
-            # TODO This switching based on which file is found first is
-            # fairly brittle and should only be called after first upload.
-            if 'geojson' in file['exts']:
-                # we found a geojson, assume this is geojson original
-                minerva_metadata['original_type'] = 'geojson'
-                minerva_metadata['dataset_type'] = 'geojson'
-                minerva_metadata['original_files'] = [{
-                    'name': file['name'], '_id': file['_id']}]
-                minerva_metadata['geojson_file'] = {
-                    'name': file['name'], '_id': file['_id']}
-                minerva_metadata['source'] = {
-                    'layer_source': 'GeoJSON'}
-                break
-            elif 'json' in file['exts']:
-                minerva_metadata['original_type'] = 'json'
-                minerva_metadata['dataset_type'] = 'json'
-                minerva_metadata['original_files'] = [{
-                    'name': file['name'], '_id': file['_id']}]
-                break
-            elif 'csv' in file['exts']:
-                minerva_metadata['original_type'] = 'csv'
-                minerva_metadata['dataset_type'] = 'csv'
-                minerva_metadata['original_files'] = [{
-                    'name': file['name'], '_id': file['_id']}]
-                break
-            elif ({'tif', 'tiff'}.intersection(file['exts']) and
-                  file['mimeType'] == 'image/tiff'):
-                info = ImageItem().tileSource(item).getMetadata()
-                if 'srs' in info['sourceBounds'] and info['sourceBounds']['srs']:
-                    minerva_metadata['original_type'] = 'tiff'
-                    minerva_metadata['dataset_type'] = 'geotiff'
-                    minerva_metadata['original_files'] = [{
-                        'name': file['name'], '_id': file['_id']}]
-                    minerva_metadata['source'] = {
-                        'layer_source': 'Tiff'}
-                break
+            compression, member, chunks = decompressChunks(
+                self.model('file').download(file, headers=False)())
+            stream = SniffStream(chunks)
+            streams.append(stream)
+            if compression:
+                # Sniff the uncompressed data by the name it will have, and
+                # only look at its start, as it can't be read by ranges.
+                sniffed = dict(file, exts=uncompressedExtensions(
+                    member or file['name']))
+                readRange = self._headReader(stream)
+            else:
+                sniffed = file
+                readRange = self._rangeReader(file)
+            confidence, sniffer = sniffFile(sniffed, stream, readRange)
+            if confidence > best[0]:
+                best = (confidence, sniffer, stream, compression, member)
+        confidence, sniffer, stream, compression, member = best
+        try:
+            if sniffer is not None:
+                minerva_metadata.update(sniffer.metadata())
+                if compression:
+                    self._recordCompression(
+                        minerva_metadata, compression, member)
+                minerva_metadata['stats'] = sniffer.stats(stream.chunks())
+        finally:
+            for stream in streams:
+                stream.close()
+        if minerva_metadata.get('dataset_type') == 'geojson-timeseries':
+            self._buildFrameIndex(item, minerva_metadata, sniffer.frames)
+        if minerva_metadata.get('original_type') == 'shapefile':
+            self._convertShapefileToGeoJson(item, minerva_metadata)
         updateMinervaMetadata(item, minerva_metadata)
+        if minerva_metadata.get('dataset_type') == 'geotiff' and \
+                'largeImage' in item:
+            try:
+                self._tileMetadata(item, store=True)
+            except TileSourceException:
+                # Read when first needed, once the image is ready
+                pass
 
         return minerva_metadata
 
+    def _recordCompression(self, minerva_metadata, compression, member):
+        """Mark the files of a dataset that have to be decompressed."""
+        entries = list(minerva_metadata.get('original_files', []))
+        if 'geojson_file' in minerva_metadata:
+            entries.append(minerva_metadata['geojson_file'])
+        for entry in entries:
+            entry['compression'] = compression
+            if member:
+                entry['member'] = member
+
+    def _fileChunks(self, file):
+        """The chunks of a dataset file, decompressed if it is compressed."""
+        return decompressChunks(
+            self.model('file').download(file, headers=False)())[2]
+
+    def _headReader(self, stream):
+        def readRange(offset, length):
+            return stream.head(offset + length)[offset:]
+        return readRange
+
+    def _rangeReader(self, file):
+        def readRange(offset, length):
+            return b''.join(self.model('file').download(
+                file, offset=offset, endByte=offset + length,
+                headers=False)())
+        return readRange
+
+    def _buildFrameIndex(self, item, minerva_metadata, frames):
+        """
+        Record the byte range and time of every frame of a geojson-timeseries
+        dataset in an index file on the item, so that frames can be read
+        individually.
+
+        :param frames: (offset, length, time) tuples of the frames, gathered
+            while sniffing the file.
+        """
+        offsets = [frame[0] for frame in frames]
+        lengths = [frame[1] for frame in frames]
+        times = [frame[2] for frame in frames]
+        index = json.dumps({
+            'offsets': offsets,
+            'lengths': lengths,
+            'times': times
+        }).encode('utf8')
+        indexFile = self.model('upload').uploadFromFile(
+            io.BytesIO(index), len(index),
+            item['name'] + PluginSettings.FRAME_INDEX_EXTENSION,
+            parentType='item', parent=item, user=self.getCurrentUser(),
+            mimeType='application/json')
+        minerva_metadata['frame_index'] = {
+            'name': indexFile['name'],
+            '_id': indexFile['_id'],
+            'count': len(offsets)
+        }
+        return minerva_metadata
+
+    def _loadFrameIndex(self, item):
+        minervaMeta = item['meta']['minerva']
+        if 'frame_index' not in minervaMeta:
+            raise RestException('Dataset has no frame index.')
+        indexFile = self.model('file').load(
+            minervaMeta['frame_index']['_id'], force=True)
+        return json.loads(b''.join(
+            self.model('file').download(indexFile, headers=False)()
+        ).decode('utf8'))
+
+    def _loadSpatialIndex(self, item):
+        """
+        The spatial index of the GeoJSON file of a dataset, or None if it is
+        missing or was built for another file.  Indexes are only built when
+        a dataset is promoted, never when it is read.
+        """
+        minervaMeta = item['meta']['minerva']
+        entry = minervaMeta.get('spatial_index')
+        if entry is None or \
+                str(entry.get('file_id')) != \
+                str(minervaMeta['geojson_file']['_id']):
+            return None
+        indexFile = self.model('file').load(entry['_id'], force=True)
+        return SpatialIndex(b''.join(
+            self.model('file').download(indexFile, headers=False)()))
+
+    def _clusterGeojsonFile(self, geojsonFile):
+        """The point clusters of a GeoJSON file and its number of points."""
+        clusterer = PointClusterer()
+        for feature in geojsonFeatures(
+                ChunkReader(self._fileChunks(geojsonFile))):
+            clusterer.addFeature(feature)
+        return clusterer.build()
+
+    def _loadClusters(self, item):
+        """
+        The point clusters of a dataset.  Clusters missing from the dataset
+        or built for another file are built in memory and kept in the
+        cluster cache, without changing the dataset.
+        """
+        minervaMeta = item['meta']['minerva']
+        if 'geojson_file' not in minervaMeta or \
+                minervaMeta.get('dataset_type') == 'geojson-timeseries':
+            raise RestException('Dataset has no GeoJSON features.')
+        fileId = str(minervaMeta['geojson_file']['_id'])
+        entry = minervaMeta.get('clusters')
+        if entry is None or str(entry.get('file_id')) != fileId:
+            clusters = self.clusterCache.get(fileId)
+            if clusters is None:
+                geojsonFile = self.model('file').load(fileId, force=True)
+                clusters = ClusterIndex(
+                    self._clusterGeojsonFile(geojsonFile)[0])
+                self.clusterCache.put(fileId, clusters)
+            return clusters
+        clustersFile = self.model('file').load(entry['_id'], force=True)
+        return ClusterIndex(b''.join(
+            self.model('file').download(clustersFile, headers=False)()))
+
+    def _loadSummary(self, item):
+        """
+        The property summary of a dataset.  Summaries missing from the
+        dataset or built for another file are computed in memory and kept in
+        the summary cache, without changing the dataset.
+        """
+        minervaMeta = item['meta']['minerva']
+        if 'geojson_file' not in minervaMeta or \
+                minervaMeta.get('dataset_type') == 'geojson-timeseries':
+            raise RestException('Dataset has no GeoJSON features.')
+        fileId = str(minervaMeta['geojson_file']['_id'])
+        entry = minervaMeta.get('property_summary')
+        if entry is None or str(entry.get('file_id')) != fileId:
+            summary = self.summaryCache.get(fileId)
+            if summary is None:
+                geojsonFile = self.model('file').load(fileId, force=True)
+                summary = summarizeGeojsonProperties(
+                    self._fileChunks(geojsonFile))
+                self.summaryCache.put(fileId, summary)
+            return summary
+        summaryFile = self.model('file').load(entry['_id'], force=True)
+        return json.loads(b''.join(
+            self.model('file').download(summaryFile, headers=False)())
+            .decode('utf8'))
+
+    def _readFrames(self, item, index, frames):
+        """
+        Read the bytes of frames of a geojson-timeseries, in increasing order,
+        with a ranged read for each frame.  Compressed files are read once,
+        decompressing up to the last frame.
+        """
+        geojsonFile = item['meta']['minerva']['geojson_file']
+        file = self.model('file').load(geojsonFile['_id'], force=True)
+        ranges = [(index['offsets'][frame], index['lengths'][frame])
+                  for frame in frames]
+        if geojsonFile.get('compression'):
+            for frame in chunkRanges(self._fileChunks(file), ranges):
+                yield frame
+            return
+        for offset, length in ranges:
+            yield b''.join(self.model('file').download(
+                file, offset=offset, endByte=offset + length,
+                headers=False)())
+
+    def _readFirstFrame(self, item):
+        minervaMeta = item['meta']['minerva']
+        if 'frame_index' in minervaMeta:
+            return next(self._readFrames(item, self._loadFrameIndex(item), [0]))
+        # Without an index, stop reading once the first frame is complete.
+        file = self.model('file').load(
+            minervaMeta['geojson_file']['_id'], force=True)
+        for offset, frame in jsonArrayElementRanges(self._fileChunks(file)):
+            return frame
+
     # REST Endpoints
 
     @access.public
@@ -445,15 +739,103 @@ class Dataset(Resource):
         if bounds:
             minerva_metadata['bounds'] = bounds
             updateMinervaMetadata(item, minerva_metadata)
+        if minerva_metadata.get('dataset_type') == 'geojson':
+            stats = minerva_metadata.get('stats', {})
+            derived = ['spatial_index', 'property_summary', 'topojson']
+            if isSimplifiable(stats):
+                derived.append('simplified')
+            if isPointDataset(stats):
+                derived.append('clusters')
+            self._scheduleDerivedFiles(item, minerva_metadata, user, derived)
+        if minerva_metadata.get('dataset_type') == 'geotiff' and \
+                self.boolParam('cloudOptimize', params, default=False):
+            self._scheduleCloudOptimize(item, minerva_metadata, user)
         return item
     promoteItemToDataset.description = (
         Description('Create metadata for an Item in a user\'s Minerva Dataset' +
                     ' folder, promoting the Item to a Dataset.')
         .responseClass('Item')
         .param('id', 'The Item ID', paramType='path')
+        .param('cloudOptimize', 'Whether to rewrite a GeoTIFF as a tiled '
+               'GeoTIFF with overviews in a background job, serving its '
+               'tiles from the rewritten file once the job completes.',
+               required=False, dataType='boolean', default=False)
         .errorResponse('ID was invalid.')
         .errorResponse('Write permission denied on the Item.', 403))
 
+    def _scheduleDerivedFiles(self, item, minervaMeta, user, derived):
+        """
+        Start a local job building the files derived from the GeoJSON file
+        of a dataset in a single pass, so promotion doesn't read the file
+        once per derived file.  Call this after the last change to the
+        dataset's metadata in the request, as the job updates it.
+
+        :param derived: the metadata keys of the files to build, among
+            simplified, spatial_index, clusters and property_summary, and
+            topojson for the TopoJSON encodings of the GeoJSON files.
+        """
+        jobModel = self.model('job', 'jobs')
+        job = jobModel.createLocalJob(
+            module='girder.plugins.minerva.jobs.derived_files',
+            title='Derived files of %s' % item['name'],
+            type='minerva.derived_files',
+            user=user,
+            kwargs={
+                'itemId': str(item['_id']),
+                'userId': str(user['_id']),
+                'derived': derived
+            },
+            asynchronous=True)
+        minervaMeta['derived_files'] = {'job_id': job['_id']}
+        updateMinervaMetadata(item, minervaMeta)
+        jobModel.scheduleJob(job)
+        return job
+
+    def _scheduleCloudOptimize(self, item, minervaMeta, user):
+        """
+        Start a local job rewriting the GeoTIFF of a dataset as a cloud
+        optimized GeoTIFF.
+        """
+        jobModel = self.model('job', 'jobs')
+        job = jobModel.createLocalJob(
+            module='girder.plugins.minerva.jobs.cloud_optimized_geotiff',
+            title='Optimize %s' % item['name'],
+            type='minerva.cloud_optimized_geotiff',
+            user=user,
+            kwargs={
+                'itemId': str(item['_id']),
+                'userId': str(user['_id']),
+                'fileId': str(minervaMeta['original_files'][0]['_id'])
+            },
+            asynchronous=True)
+        addJobOutput(job, item)
+        minervaMeta['cloud_optimized'] = {'job_id': job['_id']}
+        updateMinervaMetadata(item, minervaMeta)
+        jobModel.scheduleJob(job)
+        return job
+
+    def _scheduleColumnarGeojson(self, item, minervaMeta, user):
+        """
+        Start a local job creating the GeoJSON file of a dataset that only
+        has a columnar (GeoParquet) file.
+        """
+        jobModel = self.model('job', 'jobs')
+        job = jobModel.createLocalJob(
+            module='girder.plugins.minerva.jobs.columnar_geojson',
+            title='GeoJSON of %s' % item['name'],
+            type='minerva.columnar_geojson',
+            user=user,
+            kwargs={
+                'itemId': str(item['_id']),
+                'userId': str(user['_id']),
+                'fileId': str(minervaMeta['columnar_file']['_id'])
+            },
+            asynchronous=True)
+        minervaMeta['columnar_geojson'] = {'job_id': job['_id']}
+        updateMinervaMetadata(item, minervaMeta)
+        jobModel.scheduleJob(job)
+        return job
+
     @access.public
     @loadmodel(model='item', level=AccessType.WRITE)
     def createJsonRow(self, item, params):
@@ -479,6 +861,11 @@ class Dataset(Resource):
         item_meta = item['meta']
         minerva_meta = item_meta['minerva']
         supported_conversions = ['json', 'mongo']
+        if 'columnar_file' in minerva_meta:
+            if 'geojson_file' not in minerva_meta:
+                self._scheduleColumnarGeojson(
+                    item, minerva_meta, self.getCurrentUser())
+            return minerva_meta
         if minerva_meta['original_type'] in supported_conversions:
             # TODO passing params for limit and offset
             # maybe better to make those explicit and for all original_type
@@ -486,12 +873,16 @@ class Dataset(Resource):
         elif minerva_meta['original_type'] == 'geojson':
             return minerva_meta
         elif minerva_meta['original_type'] == 'csv':
-            raise RestException('CSV to geojson not implemented')
+            minerva_meta = self._convertCsvToGeoJson(item)
+        elif minerva_meta['original_type'] == 'shapefile':
+            minerva_meta = self._convertShapefileToGeoJson(item, minerva_meta)
         else:
             raise RestException('create geojson on unknown type')
         return minerva_meta
     createGeojson.description = (
-        Description('Create geojson for a dataset, if possible.')
+        Description('Create geojson for a dataset, if possible.  The '
+                    'geojson of datasets with a columnar file is created by '
+                    'a background job.')
         .param('id', 'The Item ID', paramType='path')
         .param('dateField', 'date field for filtering results, required for ' +
                'startTime or endTime params', required=False)
@@ -504,26 +895,273 @@ class Dataset(Resource):
     @autoDescribeRoute(
         Description('Download a dataset.')
         .modelParam('id', model='item', level=AccessType.READ)
+        .param('zoom', 'The zoom level the dataset is shown at, to serve a '
+               'simplified level of line and polygon datasets.  Each '
+               'geometry is simplified on its own, so borders shared by '
+               'polygons can show gaps or overlaps of up to about a pixel.',
+               required=False, dataType='number')
+        .param('tolerance', 'The simplification tolerance, in degrees, '
+               'acceptable for the dataset.', required=False,
+               dataType='number')
+        .param('format', 'The encoding of GeoJSON datasets, topojson for '
+               'quantized and delta encoded coordinates.', required=False,
+               enum=['geojson', 'topojson'], default='geojson')
         .errorResponse('ID was invalid.')
         .errorResponse('Read access was denied on the parent folder.', 403))
-    def download(self, item, params):
-        return self.downloadDataset(item)
+    def download(self, item, zoom, tolerance, format, params):
+        if self._columnarOnly(item) and format == 'geojson':
+            return self._streamColumnarGeojson(item)
+        file = self._datasetFile(item)
+        if file is None:
+            return self.downloadDataset(item)
+        if zoom is not None and tolerance is None:
+            tolerance = zoomTolerance(zoom)
+        if tolerance is not None:
+            file = self._simplifiedFile(item, tolerance) or file
+        cherrypy.response.headers['Vary'] = 'Accept-Encoding'
+        if format == 'topojson':
+            topojsonFile = self._topojsonFile(item, file)
+            if topojsonFile is None:
+                # Not stored by the derived files job (yet)
+                return self._streamConverted(
+                    file, 'topojson',
+                    lambda writer: TopoJsonEncoder(item['name']).toTopoJson(
+                        lambda: self._fileChunks(file), writer))
+            file = topojsonFile
+        compression = detectCompression(self._rangeReader(file)(0, 4))
+        acceptEncoding = cherrypy.request.headers.get('Accept-Encoding', '')
+        if acceptsEncoding(acceptEncoding, 'gzip'):
+            # Serve gzip without parsing the data.  Derived files have a
+            # stored gzip copy, and gzip and zip uploads are passed through
+            # without being recompressed.
+            gzipFile = self._gzipCompanion(item, file)
+            if gzipFile is None and compression == 'gzip':
+                gzipFile = file
+            if gzipFile is not None:
+                return self._sendFile(gzipFile, 'gzip')
+            if self._notModified(self._etag(file, 'gzip')):
+                return ''
+            cherrypy.response.headers['Content-Encoding'] = 'gzip'
+            return lambda: gzipChunks(
+                self.model('file').download(file, headers=False)())
+        if compression is None:
+            return self._sendFile(file)
+        if self._notModified(self._etag(file, 'identity')):
+            return ''
+        return lambda: self._fileChunks(file)
+
+    def _etag(self, file, variant=None):
+        """
+        A strong ETag of a stored file, from its sha512 or else from its id
+        and modification time.  A variant distinguishes encodings of the file
+        made while it is downloaded.
+        """
+        tag = file.get('sha512')
+        if not tag:
+            tag = hashlib.sha1(('%s-%s' % (
+                file['_id'], file.get('updated', file.get('created')))
+            ).encode('utf8')).hexdigest()
+        if variant:
+            tag += '-' + variant
+        return '"%s"' % tag
+
+    def _notModified(self, etag):
+        """
+        Set the raw response headers of a dataset download with the given
+        ETag, making it a 304 if the client already has that version.
+        """
+        setRawResponse()
+        headers = cherrypy.response.headers
+        headers['Content-Type'] = 'application/json'
+        headers['ETag'] = etag
+        ifNoneMatch = cherrypy.request.headers.get('If-None-Match')
+        if not ifNoneMatch:
+            return False
+        # If-None-Match uses the weak comparison
+        tags = [tag.strip() for tag in ifNoneMatch.split(',')]
+        tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+        if '*' in tags or etag in tags:
+            cherrypy.response.status = 304
+            return True
+        return False
+
+    def _sendFile(self, file, encoding=None):
+        """
+        Stream a stored file as is, answering conditional and single range
+        requests.
+        """
+        etag = self._etag(file)
+        if self._notModified(etag):
+            return ''
+        headers = cherrypy.response.headers
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        headers['Accept-Ranges'] = 'bytes'
+        size = file.get('size', 0)
+        offset, endByte = 0, size
+        rangeHeader = cherrypy.request.headers.get('Range')
+        ifRange = cherrypy.request.headers.get('If-Range')
+        if rangeHeader and (not ifRange or ifRange.strip() == etag):
+            ranges = cherrypy.lib.httputil.get_ranges(rangeHeader, size)
+            if ranges == []:
+                headers['Content-Range'] = 'bytes */%d' % size
+                raise RestException('Requested range not satisfiable.',
+                                    code=416)
+            if ranges:
+                # Only a single range is supported, as for Girder files.
+                offset, endByte = ranges[0]
+                cherrypy.response.status = 206
+                headers['Content-Range'] = 'bytes %d-%d/%d' % (
+                    offset, endByte - 1, size)
+        headers['Content-Length'] = endByte - offset
+        return self.model('file').download(
+            file, offset=offset, endByte=endByte, headers=False)
+
+    def _columnarOnly(self, item):
+        """
+        Whether a dataset only has a columnar (GeoParquet) file, its GeoJSON
+        file not being created yet.
+        """
+        minervaMeta = item['meta']['minerva']
+        return 'columnar_file' in minervaMeta and \
+            'geojson_file' not in minervaMeta
 
-    def downloadDataset(self, item):
+    def _streamColumnarGeojson(self, item):
+        """
+        Convert the columnar file of a dataset to GeoJSON while it is
+        downloaded, until the job started when the file was registered has
+        stored the GeoJSON file.
+        """
+        columnarFile = self.model('file').load(
+            item['meta']['minerva']['columnar_file']['_id'], force=True)
+
+        def write(writer):
+            tmpdir = tempfile.mkdtemp()
+            try:
+                columnarPath = os.path.join(tmpdir, columnarFile['name'])
+                with open(columnarPath, 'wb') as fh:
+                    for chunk in self.model('file').download(
+                            columnarFile, headers=False)():
+                        fh.write(chunk)
+                geoParquetToGeoJson(columnarPath, writer)
+            finally:
+                shutil.rmtree(tmpdir)
+        return self._streamConverted(columnarFile, 'geojson', write)
+
+    def _datasetFile(self, item):
+        """
+        The file holding the geojson of a dataset, or None for datasets that
+        are not stored in a file.
+        """
         minervaMeta = item['meta']['minerva']
-        if not minervaMeta.get('postgresGeojson'):
-            fileId = None
-            # The storing of file id on item is a little bit messy, so multiple place
-            # needs to be checked
-            if 'original_files' in minervaMeta:
-                fileId = minervaMeta['original_files'][0]['_id']
-            elif 'geojson_file' in minervaMeta:
-                fileId = minervaMeta['geojson_file']['_id']
-            else:
-                fileId = minervaMeta['geo_render']['file_id']
-            file = self.model('file').load(fileId, force=True)
-            func = self.model('file').download(file, headers=False)
-            return geojson.loads(''.join(list(func())))
+        if self._columnarOnly(item):
+            raise RestException('The GeoJSON file of dataset %s is not '
+                                'created yet.' % item['name'])
+        if minervaMeta.get('postgresGeojson'):
+            return None
+        fileId = None
+        # The storing of file id on item is a little bit messy, so multiple place
+        # needs to be checked
+        if 'geojson_file' in minervaMeta and \
+                minervaMeta.get('original_type') != 'json':
+            # Derived GeoJSON, e.g. of a csv, rather than the original file
+            fileId = minervaMeta['geojson_file']['_id']
+        elif 'original_files' in minervaMeta:
+            fileId = minervaMeta['original_files'][0]['_id']
+        elif 'geojson_file' in minervaMeta:
+            fileId = minervaMeta['geojson_file']['_id']
+        else:
+            fileId = minervaMeta['geo_render']['file_id']
+        return self.model('file').load(fileId, force=True)
+
+    def _simplifiedFile(self, item, tolerance):
+        """
+        The smallest simplified level of a dataset within a tolerance, or
+        None if it has to be served at full resolution.
+        """
+        levels = item['meta']['minerva'].get('simplified', {}).get('levels')
+        level = levelForTolerance(levels or [], tolerance)
+        if level is None:
+            return None
+        return self.model('file').load(level['_id'], force=True)
+
+    def _fileEntries(self, minervaMeta):
+        """The entries of the minerva metadata describing dataset files."""
+        entries = list(minervaMeta.get('original_files', []))
+        if 'geojson_file' in minervaMeta:
+            entries.append(minervaMeta['geojson_file'])
+        entries.extend(minervaMeta.get('simplified', {}).get('levels', []))
+        entries.extend([entry['topojson_file'] for entry in entries
+                        if 'topojson_file' in entry])
+        return entries
+
+    def _gzipCompanion(self, item, file):
+        """The stored gzip encoding of a dataset file, if there is one."""
+        for entry in self._fileEntries(item['meta']['minerva']):
+            if entry['_id'] == file['_id'] and 'gzip_file' in entry:
+                return self.model('file').load(
+                    entry['gzip_file']['_id'], force=True)
+        return None
+
+    def _topojsonFile(self, item, file):
+        """
+        The stored TopoJSON encoding of a GeoJSON dataset file, made by the
+        derived files job, or None if it isn't stored.
+        """
+        minervaMeta = item['meta']['minerva']
+        if minervaMeta.get('dataset_type') != 'geojson':
+            raise RestException('Only GeoJSON datasets can be encoded as '
+                                'TopoJSON.')
+        entries = [entry for entry in self._fileEntries(minervaMeta)
+                   if entry['_id'] == file['_id']]
+        if not entries:
+            raise RestException('Dataset file %s is not a GeoJSON file.' %
+                                file['name'])
+        for entry in entries:
+            if 'topojson_file' in entry:
+                topojsonFile = self.model('file').load(
+                    entry['topojson_file']['_id'], force=True)
+                if topojsonFile is not None:
+                    return topojsonFile
+        return None
+
+    def _streamConverted(self, file, variant, write):
+        """
+        Stream a conversion of a dataset file made while it is downloaded,
+        gzip encoded for clients accepting it.  Nothing is stored, as
+        downloads only need read access.
+
+        :param file: the converted file, giving the ETag.
+        :param variant: the name of the conversion, in the ETag.
+        :param write: a function writing the conversion to a text file.
+        """
+        cherrypy.response.headers['Vary'] = 'Accept-Encoding'
+        acceptEncoding = cherrypy.request.headers.get('Accept-Encoding', '')
+        gzip = acceptsEncoding(acceptEncoding, 'gzip')
+        if self._notModified(self._etag(
+                file, variant + '-gzip' if gzip else variant)):
+            return ''
+
+        def chunks():
+            with tempfile.TemporaryFile('w+') as fh:
+                write(fh)
+                fh.seek(0)
+                while True:
+                    data = fh.read(65536)
+                    if not data:
+                        break
+                    yield data if isinstance(data, bytes) \
+                        else data.encode('utf8')
+        if gzip:
+            cherrypy.response.headers['Content-Encoding'] = 'gzip'
+            return lambda: gzipChunks(chunks())
+        return chunks
+
+    def downloadDataset(self, item):
+        file = self._datasetFile(item)
+        if file is not None:
+            return geojson.loads(
+                b''.join(self._fileChunks(file)).decode('utf8'))
         else:
             return self._getPostgresGeojsonData(item)
 
@@ -589,6 +1227,368 @@ class Dataset(Resource):
                 )
         return geojson.FeatureCollection(assembled), linkingDuplicateCount
 
+    @access.public
+    @autoDescribeRoute(
+        Description('Get the number and times of the frames of a '
+                    'geojson-timeseries dataset.')
+        .modelParam('id', model='item', level=AccessType.READ)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied on the parent folder.', 403))
+    def getFrameIndex(self, item, params):
+        index = self._loadFrameIndex(item)
+        return {
+            'count': len(index['offsets']),
+            'times': index['times']
+        }
+
+    @access.public
+    @autoDescribeRoute(
+        Description('Get frames of a geojson-timeseries dataset, either a '
+                    'single frame or the frames within a time range.')
+        .modelParam('id', model='item', level=AccessType.READ)
+        .param('index', 'The index of a single frame.', required=False,
+               dataType='integer')
+        .param('startTime', 'Earliest time of frames to include.',
+               required=False)
+        .param('endTime', 'Latest time of frames to include.', required=False)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied on the parent folder.', 403))
+    def getFrames(self, item, index, startTime, endTime, params):
+        frameIndex = self._loadFrameIndex(item)
+        count = len(frameIndex['offsets'])
+        if index is not None:
+            if index < 0 or index >= count:
+                raise RestException('Frame index out of range.')
+            frames = [index]
+        else:
+            start = dateutil.parser.parse(startTime) if startTime else None
+            end = dateutil.parser.parse(endTime) if endTime else None
+            frames = []
+            for frame, time in enumerate(frameIndex['times']):
+                if time is None:
+                    continue
+                time = dateutil.parser.parse(time)
+                if (start is None or time >= start) and \
+                        (end is None or time <= end):
+                    frames.append(frame)
+
+        setRawResponse()
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+
+        def stream():
+            yield b'['
+            for position, frame in enumerate(
+                    self._readFrames(item, frameIndex, frames)):
+                if position:
+                    yield b','
+                yield frame
+            yield b']'
+        return stream
+
+    @access.public
+    @autoDescribeRoute(
+        Description('Get the features of a dataset intersecting a bounding '
+                    'box, as a GeoJSON FeatureCollection.')
+        .modelParam('id', model='item', level=AccessType.READ)
+        .param('bbox', 'The bounding box, as minx,miny,maxx,maxy in '
+               'longitude and latitude.')
+        .param('limit', 'Result set size limit.', required=False,
+               dataType='integer', default=1000)
+        .param('offset', 'Offset into result set.', required=False,
+               dataType='integer', default=0)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied on the parent folder.', 403))
+    def getFeatures(self, item, bbox, limit, offset, params):
+        features = self._featuresInBox(item, self._parseBbox(bbox))
+        return {
+            'type': 'FeatureCollection',
+            'features': list(
+                itertools.islice(features, offset, offset + limit))
+        }
+
+    def _parseBbox(self, bbox):
+        try:
+            bbox = [float(value) for value in bbox.split(',')]
+        except ValueError:
+            bbox = None
+        if bbox is None or len(bbox) != 4:
+            raise RestException('bbox must be minx,miny,maxx,maxy.')
+        return bbox
+
+    def _featuresInBox(self, item, bbox):
+        """
+        Generate the features of a dataset intersecting a bounding box,
+        using its spatial index when it has one and scanning the file otherwise.
+        """
+        minervaMeta = item['meta']['minerva']
+        if 'geojson_file' not in minervaMeta or \
+                minervaMeta.get('dataset_type') == 'geojson-timeseries':
+            raise RestException('Dataset has no GeoJSON features.')
+        area = box(*bbox)
+        geojsonFile = self.model('file').load(
+            minervaMeta['geojson_file']['_id'], force=True)
+        index = self._loadSpatialIndex(item)
+        if index is not None:
+            features = self._indexedFeatures(
+                geojsonFile, index, index.search(bbox))
+        else:
+            features = geojsonFeatures(
+                ChunkReader(self._fileChunks(geojsonFile)))
+        for feature in features:
+            geometry = feature.get('geometry')
+            if geometry and shape(geometry).intersects(area):
+                yield feature
+
+    @access.public
+    @autoDescribeRoute(
+        Description('Get the point clusters of a dataset at a zoom level, '
+                    'as a GeoJSON FeatureCollection.  Each cluster has the '
+                    'number of its points and the minimum, maximum, sum and '
+                    'mean of their numeric properties.  Individual points '
+                    'are returned at zoom levels without clusters.')
+        .modelParam('id', model='item', level=AccessType.READ)
+        .param('zoom', 'The zoom level of the map.', dataType='number')
+        .param('bbox', 'The bounding box of the map, as minx,miny,maxx,maxy '
+               'in longitude and latitude.', required=False)
+        .param('limit', 'The maximum number of individual points.',
+               required=False, dataType='integer', default=10000)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied on the parent folder.', 403))
+    def getClusters(self, item, zoom, bbox, limit, params):
+        bbox = self._parseBbox(bbox) if bbox else None
+        clusters = self._loadClusters(item)
+        if zoom <= clusters.maxZoom:
+            features = clusters.clusters(zoom, bbox)
+        else:
+            features = list(itertools.islice(self._featuresInBox(
+                item, bbox or [-180, -90, 180, 90]), limit))
+        return {
+            'type': 'FeatureCollection',
+            'features': features
+        }
+
+    @access.public
+    @autoDescribeRoute(
+        Description('Compute choropleth class breaks of a numeric property '
+                    'of a dataset.  Results are cached in memory per file, '
+                    'property, method and class count.')
+        .modelParam('id', model='item', level=AccessType.READ)
+        .param('field', 'The feature property to classify.')
+        .param('method', 'The classification method.', required=False,
+               enum=list(CLASSIFY_METHODS), default='quantile')
+        .param('classes', 'The number of classes.  There are classes + 1 '
+               'breaks, except for jenks breaks of a property with at most '
+               'that many distinct values, which have one class per '
+               'distinct value.', required=False, dataType='integer',
+               default=5)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied on the parent folder.', 403))
+    def classify(self, item, field, method, classes, params):
+        if classes < 1 or classes > MAX_CLASSES:
+            raise RestException('classes must be between 1 and %d.' %
+                                MAX_CLASSES)
+        minervaMeta = item['meta']['minerva']
+        if 'geojson_file' not in minervaMeta or \
+                minervaMeta.get('dataset_type') == 'geojson-timeseries':
+            raise RestException('Dataset has no GeoJSON features.')
+        fileId = str(minervaMeta['geojson_file']['_id'])
+        cacheKey = (fileId, field, method, classes)
+        entry = self.classificationCache.get(cacheKey)
+        if entry is None:
+            geojsonFile = self.model('file').load(fileId, force=True)
+            values = geojsonFieldValues(self._fileChunks(geojsonFile), field)
+            entry = dict(classifyValues(values, method, classes),
+                         file_id=fileId, field=field, method=method,
+                         classes=classes)
+            self.classificationCache.put(cacheKey, entry)
+        return entry
+
+    @access.public
+    @autoDescribeRoute(
+        Description('Get a summary of the values of the feature properties '
+                    'of a dataset.  Strings with few distinct values are '
+                    'counted exactly; others have an estimated distinct '
+                    'count and their most frequent values.  Numbers have '
+                    'their extremes, mean, percentiles and a histogram.')
+        .modelParam('id', model='item', level=AccessType.READ)
+        .param('field', 'Only summarize this feature property.',
+               required=False)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied on the parent folder.', 403))
+    def getSummary(self, item, field, params):
+        summary = self._loadSummary(item)
+        if field is None:
+            return summary
+        if field not in summary['properties']:
+            raise RestException('Dataset has no property %s.' % field)
+        return summary['properties'][field]
+
+    def _tileSource(self, sourceKey):
+        """
+        An opened tile source of a geotiff dataset, from the cache of tile
+        sources if it was opened before.
+
+        :param sourceKey: a tuple of the item id, the id of its image file
+            and the encoding, projection and style of the tiles.
+        """
+        source = self.tileSources.get(sourceKey)
+        if source is None:
+            itemId, fileId, encoding, projection, style = sourceKey
+            kwargs = {'encoding': encoding}
+            if projection:
+                kwargs['projection'] = projection
+            if style:
+                kwargs['style'] = style
+            source = ImageItem().tileSource(
+                self.model('item').load(itemId, force=True), **kwargs)
+            self.tileSources.put(sourceKey, source)
+        return source
+
+    def _tileMetadata(self, item, store=False):
+        """
+        The metadata of the tile source of a geotiff dataset, as stored in
+        the minerva metadata of the dataset when it was promoted.  Metadata
+        missing from the dataset or read for another image file is kept in
+        the tile metadata cache.
+
+        :param store: store the metadata in the dataset if it is missing,
+            only when the user can write the dataset.
+        """
+        minervaMeta = item['meta']['minerva']
+        fileId = self._imageFileId(item)
+        entry = minervaMeta.get('tile_metadata')
+        if entry is not None and entry.get('file_id') == fileId:
+            return entry
+        cacheKey = (str(item['_id']), fileId)
+        entry = self.tileMetadataCache.get(cacheKey)
+        if entry is None:
+            entry = self._tileSource(
+                (str(item['_id']), fileId, 'PNG', None, None)).getMetadata()
+            entry['file_id'] = fileId
+        if store:
+            minervaMeta['tile_metadata'] = entry
+            updateMinervaMetadata(item, minervaMeta)
+        else:
+            self.tileMetadataCache.put(cacheKey, entry)
+        return entry
+
+    def _imageFileId(self, item):
+        return str(item.get('largeImage', {}).get('fileId'))
+
+    def _fetchTile(self, key):
+        """The data and mime type of a tile, from the tile cache if cached."""
+        tile = self.tiles.get(key)
+        if tile is None:
+            sourceKey, z, x, y = key
+            source = self._tileSource(sourceKey)
+            tile = (source.getTile(x, y, z), source.getTileMimeType())
+            self.tiles.put(key, tile)
+        return tile
+
+    @access.public
+    @autoDescribeRoute(
+        Description('Get a tile of a geotiff dataset.  Tiles are cached and '
+                    'the tiles around the requested tile are fetched ahead, '
+                    'so panning and zooming is served from the cache.')
+        .modelParam('id', model='item', level=AccessType.READ)
+        .param('z', 'The zoom level of the tile.', paramType='path',
+               dataType='integer')
+        .param('x', 'The column of the tile.', paramType='path',
+               dataType='integer')
+        .param('y', 'The row of the tile.', paramType='path',
+               dataType='integer')
+        .param('encoding', 'The encoding of the tile.', required=False,
+               enum=['PNG', 'JPEG'], default='PNG')
+        .param('projection', 'The projection of the tiles, like EPSG:3857.',
+               required=False)
+        .param('style', 'A JSON style of the tiles.', required=False)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied on the parent folder.', 403)
+        .errorResponse('The tile does not exist.', 404))
+    def getTile(self, item, z, x, y, encoding, projection, style, params):
+        if item['meta'].get('minerva', {}).get('dataset_type') != 'geotiff':
+            raise RestException('Dataset is not a geotiff.')
+        sourceKey = (str(item['_id']), self._imageFileId(item), encoding,
+                     projection, style)
+        try:
+            data, mimeType = self._fetchTile((sourceKey, z, x, y))
+        except TileSourceException as e:
+            raise RestException(str(e), code=404)
+        source = self._tileSource(sourceKey)
+        self.tilePrefetcher.prefetch(
+            (sourceKey, tz, tx, ty) for tz, tx, ty in neighbourTiles(
+                z, x, y, 0, source.levels - 1)
+            if (sourceKey, tz, tx, ty) not in self.tiles)
+        setRawResponse()
+        cherrypy.response.headers['Content-Type'] = mimeType
+        return data
+
+    @access.user
+    @autoDescribeRoute(
+        Description('Compute the count, sum, mean, extremes and histogram of '
+                    'the pixels of a geotiff dataset under each polygon of a '
+                    'GeoJSON dataset, in a local job.  The polygons are '
+                    'written with their statistics as properties to a new '
+                    'GeoJSON dataset, the output of the job.')
+        .modelParam('id', 'The geotiff dataset.', model='item',
+                    level=AccessType.READ)
+        .modelParam('zonesId', 'The GeoJSON dataset of the polygons.',
+                    model='item', level=AccessType.READ, paramType='query',
+                    destName='zones')
+        .param('band', 'The band of the raster, from 1.', required=False,
+               dataType='integer', default=1)
+        .param('bins', 'The number of histogram bins.', required=False,
+               dataType='integer', default=10)
+        .param('prefix', 'The prefix of the statistics properties.',
+               required=False, default='zonal_')
+        .param('datasetName', 'The name of the new dataset.', required=False)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied on the parent folder.', 403))
+    def createZonalStatistics(self, item, zones, band, bins, prefix,
+                              datasetName, params):
+        if item['meta'].get('minerva', {}).get('dataset_type') != 'geotiff':
+            raise RestException('Dataset is not a geotiff.')
+        zonesMeta = zones['meta'].get('minerva', {})
+        if 'geojson_file' not in zonesMeta or \
+                zonesMeta.get('dataset_type') == 'geojson-timeseries':
+            raise RestException('Zones dataset has no GeoJSON features.')
+        if band < 1 or bins < 1:
+            raise RestException('band and bins must be positive.')
+        user = self.getCurrentUser()
+        name = datasetName or '%s.%s%s' % (
+            zones['name'], item['name'], PluginSettings.GEOJSON_EXTENSION)
+        output = self.model('item').createItem(
+            name, user, findDatasetFolder(user, user, create=True),
+            'created by zonal statistics')
+        jobModel = self.model('job', 'jobs')
+        job = jobModel.createLocalJob(
+            module='girder.plugins.minerva.jobs.zonal_statistics',
+            title=name,
+            type='minerva.zonal_statistics',
+            user=user,
+            kwargs={
+                'itemId': str(output['_id']),
+                'userId': str(user['_id']),
+                'rasterId': str(item['_id']),
+                'zonesId': str(zones['_id']),
+                'band': band,
+                'bins': bins,
+                'prefix': prefix
+            },
+            asynchronous=True)
+        addJobOutput(job, output)
+        jobModel.scheduleJob(job)
+        return job
+
+    def _indexedFeatures(self, file, index, matches):
+        """Read features found with a spatial index, in file order."""
+        readRange = self._rangeReader(file)
+        for start, end, features in index.ranges(matches):
+            data = readRange(start, end - start)
+            for offset, length in features:
+                yield json.loads(data[offset - start:offset - start + length]
+                                 .decode('utf8'))
+
     @access.public
     @autoDescribeRoute(
         Description('Calculate bounding box of a dataset.')
@@ -607,12 +1607,22 @@ class Dataset(Resource):
             return
         if (minervaMeta['dataset_type'] == 'geojson' or
                 minervaMeta['dataset_type'] == 'geojson-timeseries'):
+            bbox = minervaMeta.get('stats', {}).get('bbox')
+            if bbox:
+                # Collected when the dataset was promoted
+                return {
+                    'lrx': bbox[2],
+                    'lry': bbox[1],
+                    'ulx': bbox[0],
+                    'uly': bbox[3]
+                }
             geometry = None
             if minervaMeta['dataset_type'] == 'geojson':
                 geometry = self.downloadDataset(item)
             if minervaMeta['dataset_type'] == 'geojson-timeseries':
-                geometries = self.downloadDataset(item)
-                geometry = geometries[0]['geojson']
+                # Bounds come from the first frame only.
+                geometry = geojson.loads(
+                    self._readFirstFrame(item).decode('utf8'))['geojson']
             geometry = unwrapFeature(geometry)
             geom = shape(geometry)
             return {
@@ -622,8 +1632,7 @@ class Dataset(Resource):
                 'uly': geom.bounds[3]
             }
         elif minervaMeta['dataset_type'] == 'geotiff':
-            info = ImageItem().tileSource(item).getMetadata()
-            bounds = info['bounds']
+            bounds = self._tileMetadata(item)['bounds']
             return {
                 'lrx': bounds['xmax'],
                 'lry': bounds['ymin'],
@@ -21,7 +21,10 @@ import json
 from girder.api import access
 from girder.api.describe import Description, autoDescribeRoute
 from girder.api.rest import Resource
-from girder.plugins.minerva.utility.minerva_utility import addJobOutput
+from girder.constants import AccessType
+from girder.plugins.minerva.utility.minerva_utility import addJobOutput, \
+    jobMM
+from girder.plugins.minerva.utility.gaia_utility import processCacheKey
 from girder.plugins.minerva.rest.dataset import Dataset
 from girder.utility import config
 from gaia_tasks.tasks import gaia_task
@@ -33,6 +36,7 @@ class GaiaAnalysis(Resource):
         self.resourceName = 'gaia_analysis'
         self.config = config.getConfig()
         self.route('POST', (), self.gaiaAnalysisTask)
+        self.route('PUT', (':id', 'timing'), self.setAnalysisTiming)
 
     @access.user
     @autoDescribeRoute(
@@ -42,40 +46,71 @@ class GaiaAnalysis(Resource):
                    paramType='body')
     )
     def gaiaAnalysisTask(self, analysis, params):
-        currentUser = self.getCurrentUser()
+        user, token = self.getCurrentUser(returnToken=True)
+        # Record the cache key so this output can be reused by gaia_process.
+        cacheKey = processCacheKey(analysis['process'], user)
+        job, dataset = dispatchGaiaAnalysis(
+            user, token, analysis['datasetName'], analysis['process'], params,
+            cacheKey)
+        return job
 
-        gaia_json = json.dumps(analysis['process'])
-        datasetName = analysis['datasetName']
+    @access.user
+    @autoDescribeRoute(
+        Description('Record the stage timing of a Gaia analysis job.')
+        .modelParam('id', 'The ID of the job.', model='job', plugin='jobs',
+                    level=AccessType.WRITE)
+        .jsonParam('timing', 'Timing of the fetch, compute and upload stages',
+                   paramType='body')
+    )
+    def setAnalysisTiming(self, job, timing, params):
+        minerva_metadata = jobMM(job)
+        minerva_metadata['timing'] = timing
+        jobMM(job, minerva_metadata)
+        return minerva_metadata
 
-        minerva_metadata = {
-            'dataset_type': 'geojson',
-            'source_type': 'gaia_process',
-            'original_type': 'json',
-            'process_json': gaia_json,
-            'source': {
-                'layer_source': 'GeoJSON'
-            }
-        }
 
-        datasetResource = Dataset()
-        dataset = datasetResource.constructDataset(
-            datasetName,
-            minerva_metadata,
-            'created by Gaia'
-        )
+def dispatchGaiaAnalysis(user, token, datasetName, process, params,
+                         cacheKey=None):
+    """
+    Create an output dataset for a Gaia process and run the process on it in
+    girder_worker.
 
-        # TODO change token to job token
-        user, token = self.getCurrentUser(returnToken=True)
-        kwargs = {
-            'params': params,
-            'user': currentUser,
-            'dataset': dataset,
-            'analysis': gaia_json,
-            'token': token
+    :param cacheKey: if the process result can be reused, its process cache
+        key, which is recorded on the output dataset.
+    :returns: the job and the output dataset.
+    """
+    gaia_json = json.dumps(process)
+
+    minerva_metadata = {
+        'dataset_type': 'geojson',
+        'source_type': 'gaia_process',
+        'original_type': 'json',
+        'process_json': gaia_json,
+        'source': {
+            'layer_source': 'GeoJSON'
         }
-        result = gaia_task.delay(kwargs, girder_job_title=datasetName)
-        job = result.job
+    }
+    if cacheKey is not None:
+        minerva_metadata['process_cache_key'] = cacheKey
+
+    datasetResource = Dataset()
+    dataset = datasetResource.constructDataset(
+        datasetName,
+        minerva_metadata,
+        'created by Gaia'
+    )
 
-        addJobOutput(job, dataset)
+    # TODO change token to job token
+    kwargs = {
+        'params': params,
+        'user': user,
+        'dataset': dataset,
+        'analysis': gaia_json,
+        'token': token
+    }
+    result = gaia_task.delay(kwargs, girder_job_title=datasetName)
+    job = result.job
 
-        return job
+    addJobOutput(job, dataset)
+
+    return job, dataset
@@ -20,8 +20,16 @@ from girder.api.rest import Resource, setRawResponse
 from girder.api import access
 from girder.api.describe import Description
 from girder.utility import config
+from girder.plugins.minerva.rest.dataset import Dataset
+from girder.plugins.minerva.rest.gaia.analysis import dispatchGaiaAnalysis
+from girder.plugins.minerva.utility.gaia_utility import processCacheKey, \
+    findCachedProcessResult, findProcessCacheFolder
+from girder.plugins.minerva.utility.minerva_utility import \
+    updateMinervaMetadata
 import cherrypy
+import io
 import json
+import pymongo
 from gaia.parser import deserialize
 import gaia.formats
 
@@ -48,14 +56,88 @@ class GeoProcess(Resource):
         Description('Get a list of available Gaia processes and inputs')
         .errorResponse('An error occurred making the request', 500))
 
+    def _storeResult(self, cacheKey, result, user):
+        """
+        Store the result of a synchronous process in the cache folder, once
+        per cache key and user.  Identical requests running concurrently may
+        each store it; the first item stored is kept and the others removed.
+        """
+        folder = findProcessCacheFolder(user, create=True)
+        query = {
+            'folderId': folder['_id'],
+            'creatorId': user['_id'],
+            'meta.minerva.process_cache_key': cacheKey
+        }
+        if self.model('item').findOne(query) is not None:
+            return
+        item = self.model('item').createItem(cacheKey, user, folder)
+        data = json.dumps(result).encode('utf8')
+        file = self.model('upload').uploadFromFile(
+            io.BytesIO(data), len(data), cacheKey + '.geojson',
+            parentType='item', parent=item, user=user,
+            mimeType='application/json')
+        updateMinervaMetadata(item, {
+            'process_cache_key': cacheKey,
+            'geojson_file': {'name': file['name'], '_id': file['_id']}
+        })
+        stored = list(self.model('item').find(
+            query, sort=[('_id', pymongo.ASCENDING)]))
+        for duplicate in stored[1:]:
+            self.model('item').remove(duplicate)
+
+    def _datasetFromCachedResult(self, datasetName, process, cacheKey,
+                                 cachedFile):
+        dataset = Dataset().constructDataset(datasetName, {
+            'dataset_type': 'geojson',
+            'source_type': 'gaia_process',
+            'original_type': 'json',
+            'process_json': json.dumps(process),
+            'process_cache_key': cacheKey,
+            'source': {
+                'layer_source': 'GeoJSON'
+            }
+        }, 'created by Gaia')
+        file = self.model('file').copyFile(
+            cachedFile, self.getCurrentUser(), item=dataset)
+        minerva_metadata = dataset['meta']['minerva']
+        minerva_metadata['geojson_file'] = {
+            'name': file['name'], '_id': file['_id']}
+        minerva_metadata['geo_render'] = {
+            'type': 'geojson', 'file_id': file['_id']}
+        updateMinervaMetadata(dataset, minerva_metadata)
+        return dataset
+
     @access.user
     def processTask(self, params=None):
         """
         Based on the process name in the URL and JSON in the request body,
-        create & send a WPS request and pass on the response.
+        create & send a WPS request and pass on the response.  Results of
+        processes over Minerva datasets are cached by the process json and the
+        checksums of the input files.
         """
 
         json_body = self.getBodyJson()
+        user, token = self.getCurrentUser(returnToken=True)
+        cacheKey = processCacheKey(json_body, user)
+        cachedFile = None
+        if cacheKey is not None:
+            cachedFile = findCachedProcessResult(cacheKey, user)
+
+        if self.boolParam('async', params, default=False):
+            datasetName = params.get('datasetName', 'gaia_process')
+            if cachedFile is not None:
+                return {
+                    'job': None,
+                    'dataset': self._datasetFromCachedResult(
+                        datasetName, json_body, cacheKey, cachedFile)
+                }
+            job, dataset = dispatchGaiaAnalysis(
+                user, token, datasetName, json_body, params, cacheKey)
+            return {'job': job, 'dataset': dataset}
+
+        if cachedFile is not None:
+            return json.loads(''.join(
+                self.model('file').download(cachedFile, headers=False)()))
 
         process = json.loads(json.dumps(json_body),
                              object_hook=deserialize)
@@ -69,10 +151,18 @@ class GeoProcess(Resource):
         if not isinstance(result, dict):
             setRawResponse(True)
             cherrypy.response.headers['Content-Type'] = 'image/tiff'
+        elif cacheKey is not None:
+            self._storeResult(cacheKey, result, user)
         return result
 
     processTask.description = (
         Description('Make a gaia request and return the response')
         .param('body', 'A JSON object containing the process parameters',
                paramType='body')
+        .param('async', 'Run the process in girder_worker, returning the job '
+               'and the output dataset.  If a cached result exists, the job is '
+               'null and the dataset is ready.', required=False,
+               dataType='boolean', default=False)
+        .param('datasetName', 'Name of the output dataset in async mode.',
+               required=False)
         .errorResponse('An error occurred making the request', 500))
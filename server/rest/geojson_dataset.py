@@ -23,7 +23,7 @@ from girder.constants import AccessType
 from girder.plugins.minerva.rest.dataset import Dataset
 
 from girder.plugins.minerva.utility.minerva_utility import findDatasetFolder, \
-    updateMinervaMetadata
+    updateMinervaMetadata, addGzipCompanion
 
 
 class GeojsonDataset(Dataset):
@@ -35,8 +35,20 @@ class GeojsonDataset(Dataset):
     @access.user
     @loadmodel(map={'itemId': 'item'}, model='item',
                level=AccessType.WRITE)
-    def createGeojsonDataset(self, item, params, postgresGeojson=None):
-        user = self.getCurrentUser()
+    def createGeojsonDataset(self, item, params):
+        return self.createGeojsonDatasetFromItem(item, self.getCurrentUser())
+    createGeojsonDataset.description = (
+        Description('Create a Geojson Dataset from an Item.')
+        .responseClass('Item')
+        .param('itemId', 'Item ID of the existing Geojson Item', required=True)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Write permission denied on the Item.', 403))
+
+    def createGeojsonDatasetFromItem(self, item, user, postgresGeojson=None):
+        """
+        Add geojson dataset metadata to an item in the user's Minerva Dataset
+        folder.  This is usable outside of a request, e.g. from a local job.
+        """
         folder = findDatasetFolder(user, user, create=True)
         if folder is None:
             raise RestException('User has no Minerva Dataset folder.')
@@ -49,6 +61,9 @@ class GeojsonDataset(Dataset):
         }
         # Use the first geojson or json file found as the dataset.
         for file in self.model('item').childFiles(item=item, limit=0):
+            if 'gz' in file['exts']:
+                # A gzip companion of the geojson
+                continue
             if ('geojson' in file['exts'] or 'json' in file['exts'] or
                     file.get('mimeType') in (
                         'application/json', 'application/vnd.geo+json',
@@ -74,11 +89,9 @@ class GeojsonDataset(Dataset):
                 break
         if 'geojson_file' not in minerva_metadata:
             raise RestException('Item contains no geojson file.')
+        if postgresGeojson is None:
+            # These datasets are mostly generated, e.g. by the geocoder, so
+            # keep a gzip copy for downloads.
+            addGzipCompanion(item, minerva_metadata['geojson_file'], user)
         updateMinervaMetadata(item, minerva_metadata)
         return item
-    createGeojsonDataset.description = (
-        Description('Create a Geojson Dataset from an Item.')
-        .responseClass('Item')
-        .param('itemId', 'Item ID of the existing Geojson Item', required=True)
-        .errorResponse('ID was invalid.')
-        .errorResponse('Write permission denied on the Item.', 403))
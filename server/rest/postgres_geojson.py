@@ -4,9 +4,9 @@ import json
 from girder.api import access
 from girder.api.describe import describeRoute, Description
 from girder.api.rest import Resource, ValidationException, loadmodel
-from girder.utility import assetstore_utilities, progress
-from girder.plugins.minerva.rest.geojson_dataset import GeojsonDataset
-from girder.plugins.minerva.utility.minerva_utility import findDatasetFolder
+from girder.utility import assetstore_utilities
+from girder.plugins.minerva.utility.minerva_utility import findDatasetFolder, \
+    addJobOutput
 from .dataset import Dataset
 
 
@@ -125,7 +125,8 @@ class PostgresGeojson(Resource):
     @access.user
     @loadmodel(model='assetstore', map={'assetstoreId': 'assetstore'})
     @describeRoute(
-        Description('Create json dataset for the given view/table filtering values')
+        Description('Create json dataset for the given view/table filtering '
+                    'values.  The query runs in a job, which is returned.')
         .param('assetstoreId', 'assetstore ID of the target database')
         .param('table', 'Table name from the database')
         .param('field', 'Field to which the aggregate function will be applied')
@@ -160,7 +161,7 @@ class PostgresGeojson(Resource):
                         'reference': i['name']
                     }))
             fields = [{
-                'func': 'json_build_object', 'param': [
+                'func': 'json_build_object', 'reference': 'feature', 'param': [
                     'type', 'Feature',
                     'geometry', {
                         'func': 'cast', 'param': [{
@@ -205,23 +206,35 @@ class PostgresGeojson(Resource):
                 table, field, hash[-6:])
         currentUser = self.getCurrentUser()
         datasetFolder = findDatasetFolder(currentUser, currentUser)
-        adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
-        # Create the item
         dbParams = self._getQueryParams(
-            schema, table, fields, group, filter,
-            'GeoJSON' if geometryField['type'] == 'built-in' else 'json')
-        dbParams['tables'][0]['name'] = output_name
-        result = adapter.importData(datasetFolder, 'folder', dbParams,
-                                    progress.noProgress, currentUser)
-        resItem = result[0]['item']
-        GeojsonDataset().createGeojsonDataset(
-            itemId=resItem['_id'],
-            postgresGeojson={
-                'geometryField': geometryField,
-                'field': field,
-                'aggregateFunction': aggregateFunction
-            }, params={})
-        return resItem['_id']
+            schema, table, fields, group, filter, 'rawdict')
+        # The item is created up front so that it can be listed as the job
+        # output; the job fills it in once the query has been streamed.
+        item = self.model('item').createItem(
+            output_name, currentUser, datasetFolder, 'created by postgres query')
+
+        jobModel = self.model('job', 'jobs')
+        job = jobModel.createLocalJob(
+            module='girder.plugins.minerva.jobs.postgres_geojson',
+            title=output_name,
+            type='minerva.postgres_geojson',
+            user=currentUser,
+            kwargs={
+                'itemId': str(item['_id']),
+                'userId': str(currentUser['_id']),
+                'assetstoreId': str(assetstore['_id']),
+                'table': table,
+                'dbParams': dbParams,
+                'postgresGeojson': {
+                    'geometryField': geometryField,
+                    'field': field,
+                    'aggregateFunction': aggregateFunction
+                }
+            },
+            asynchronous=True)
+        addJobOutput(job, item)
+        jobModel.scheduleJob(job)
+        return job
 
     @access.user
     @loadmodel(model='assetstore', map={'assetstoreId': 'assetstore'})
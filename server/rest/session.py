@@ -17,6 +17,9 @@
 #  limitations under the License.
 ###############################################################################
 
+import json
+
+import bson.objectid
 import pymongo
 
 from girder.api import access
@@ -25,7 +28,26 @@ from girder.api.rest import Resource, loadmodel
 from girder.constants import AccessType
 
 from girder.plugins.minerva.constants import PluginSettings
-from girder.plugins.minerva.utility.minerva_utility import findSessionFolder
+from girder.plugins.minerva.utility.minerva_utility import LruCache, \
+    findSessionFolder
+
+# Parsed session json files kept, keyed by file checksum.
+SESSION_CACHE_SIZE = 256
+
+
+def _datasetIds(value, ids):
+    """Collect the datasetId values of session json, in order."""
+    if isinstance(value, dict):
+        for key, child in value.items():
+            if key == 'datasetId' and isinstance(child, (str, type(u''))):
+                if child not in ids:
+                    ids.append(child)
+            else:
+                _datasetIds(child, ids)
+    elif isinstance(value, list):
+        for child in value:
+            _datasetIds(child, ids)
+    return ids
 
 
 class Session(Resource):
@@ -36,6 +58,8 @@ class Session(Resource):
         self.route('GET', ('folder',), self.getSessionFolder)
         self.route('POST', ('folder',), self.createSessionFolder)
         self.route('GET', (':id', 'session'), self.getSessionJson)
+        self.route('GET', (':id', 'load'), self.loadSession)
+        self.sessionCache = LruCache(SESSION_CACHE_SIZE)
 
     @access.public
     @loadmodel(map={'userId': 'user'}, model='user', level=AccessType.READ)
@@ -87,14 +111,71 @@ class Session(Resource):
     @access.public
     @loadmodel(model='item', level=AccessType.READ)
     def getSessionJson(self, item, params):
-        itemSessionJson = PluginSettings.SESSION_FILENAME
-        # TODO if not found try pagination
-        for file in self.model('item').childFiles(item):
-            if file['name'] == itemSessionJson:
-                return file
-        return {}
+        return self._sessionFile(item) or {}
     getSessionJson.description = (
         Description('Get session json file from a minerva session item.')
         .param('id', 'The Item ID', paramType='path')
         .errorResponse('ID was invalid.')
         .errorResponse('Read permission denied on the Item.', 403))
+
+    def _sessionFile(self, item):
+        return self.model('file').findOne({
+            'itemId': item['_id'],
+            'name': PluginSettings.SESSION_FILENAME
+        })
+
+    def _sessionJson(self, file):
+        """
+        The parsed contents of a session json file and the ids of the
+        datasets it references, cached by the checksum of the file.
+        """
+        key = file.get('sha512') or (
+            str(file['_id']), file['size'], str(file.get('updated') or
+                                                file.get('created')))
+        cached = self.sessionCache.get(key)
+        if cached is None:
+            sessionJson = json.loads(b''.join(self.model('file').download(
+                file, headers=False)()).decode('utf8'))
+            cached = (sessionJson, _datasetIds(sessionJson, []))
+            self.sessionCache.put(key, cached)
+        return cached
+
+    @access.public
+    @loadmodel(model='item', level=AccessType.READ)
+    def loadSession(self, item, params):
+        user = self.getCurrentUser()
+        sessionJson = None
+        datasetIds = []
+        file = self._sessionFile(item)
+        if file is not None:
+            sessionJson, datasetIds = self._sessionJson(file)
+        features = item.get('meta', {}).get('minerva', {}).get(
+            'map', {}).get('features', [])
+        datasetIds = _datasetIds(features, list(datasetIds))
+        objectIds = [bson.objectid.ObjectId(datasetId)
+                     for datasetId in datasetIds
+                     if bson.objectid.ObjectId.is_valid(datasetId)]
+        datasets = {}
+        if objectIds:
+            cursor = self.model('item').find({'_id': {'$in': objectIds}})
+            for dataset in self.model('item').filterResultsByPermission(
+                    cursor, user, AccessType.READ):
+                datasets[str(dataset['_id'])] = \
+                    self.model('item').filter(dataset, user)
+        return {
+            'session': self.model('item').filter(item, user),
+            'session_json': sessionJson,
+            'datasets': [datasets[datasetId] for datasetId in datasetIds
+                         if datasetId in datasets],
+            'missing': [datasetId for datasetId in datasetIds
+                        if datasetId not in datasets]
+        }
+    loadSession.description = (
+        Description('Load a minerva session in one request: the session '
+                    'item, the contents of its session json file and the '
+                    'datasets its map and session json reference.  Datasets '
+                    'that do not exist or can not be read are listed as '
+                    'missing.')
+        .param('id', 'The Item ID', paramType='path')
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read permission denied on the Item.', 403))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Classification of the values of a numeric property into classes, for
+choropleth maps.
+"""
+
+import ijson
+import numpy
+
+from girder.plugins.minerva.utility.compression_utility import ChunkReader
+
+CLASSIFY_METHODS = ('quantile', 'jenks', 'equal')
+MAX_CLASSES = 32
+
+# Classifications kept in memory, shared by every dataset.
+CLASSIFICATION_CACHE_SIZE = 256
+
+
+def geojsonFieldValues(chunks, field):
+    """
+    The numeric values of a property of the features of a GeoJSON
+    FeatureCollection, parsing only that property.  The property is matched
+    by its key rather than by an ijson prefix, as the dots of property names
+    such as ``pop.2010`` would be taken as nested keys.
+
+    :param chunks: an iterable of byte strings making up the GeoJSON.
+    """
+    values = []
+    target = 'features.item.properties.' + field
+    key = None
+    for prefix, event, value in ijson.parse(ChunkReader(chunks)):
+        if prefix == 'features.item.properties':
+            key = value if event == 'map_key' else None
+        elif event == 'number' and key == field and prefix == target:
+            values.append(float(value))
+    return numpy.array(values, dtype=numpy.float64)
+
+
+def equalBreaks(values, classes):
+    return numpy.linspace(values.min(), values.max(), classes + 1)
+
+
+def quantileBreaks(values, classes):
+    return numpy.percentile(values, numpy.linspace(0, 100, classes + 1))
+
+
+def _segmentArgmin(costs, starts):
+    """The index of the first minimum of each segment of an array."""
+    minimums = numpy.minimum.reduceat(costs, starts)
+    lengths = numpy.diff(numpy.append(starts, len(costs)))
+    isMinimum = costs == numpy.repeat(minimums, lengths)
+    firsts = numpy.flatnonzero(isMinimum)
+    return firsts[numpy.searchsorted(firsts, starts)]
+
+
+def jenksBreaks(values, classes):
+    """
+    Jenks natural breaks, minimizing the sum of squared deviations from the
+    class means.
+
+    The optimal partition is found by dynamic programming over the distinct
+    sorted values, weighted by their counts.  The start of the last class of
+    an optimal partition doesn't decrease with the end of the partition, so
+    each class count is computed by divide and conquer in O(n log n), with
+    every level of the recursion evaluated at once with numpy.
+    """
+    distinct, weights = numpy.unique(values, return_counts=True)
+    count = len(distinct)
+    if count <= classes:
+        return numpy.concatenate([distinct[:1], distinct])
+    # Prefix sums, so the squared deviations of values j to i are O(1)
+    weights = weights.astype(numpy.float64)
+    w = numpy.concatenate([[0], numpy.cumsum(weights)])
+    s = numpy.concatenate([[0], numpy.cumsum(weights * distinct)])
+    s2 = numpy.concatenate([[0], numpy.cumsum(weights * distinct ** 2)])
+
+    def deviations(first, last):
+        total = s[last + 1] - s[first]
+        return (s2[last + 1] - s2[first] -
+                total * total / (w[last + 1] - w[first]))
+
+    cost = deviations(numpy.zeros(count, dtype=numpy.int64),
+                      numpy.arange(count))
+    starts = []
+    for level in range(1, classes):
+        # Intervals of ends [lo, hi] whose class starts are in [optLo, optHi]
+        lo = numpy.array([level])
+        hi = numpy.array([count - 1])
+        optLo = numpy.array([level])
+        optHi = numpy.array([count - 1])
+        best = numpy.zeros(count, dtype=numpy.int64)
+        newCost = numpy.full(count, numpy.inf)
+        while len(lo):
+            mid = (lo + hi) // 2
+            first = numpy.maximum(optLo, level)
+            last = numpy.minimum(mid, optHi)
+            lengths = last - first + 1
+            segmentStarts = numpy.concatenate(
+                [[0], numpy.cumsum(lengths)[:-1]])
+            ends = numpy.repeat(mid, lengths)
+            candidates = numpy.arange(lengths.sum()) - numpy.repeat(
+                segmentStarts - first, lengths)
+            costs = cost[candidates - 1] + deviations(candidates, ends)
+            chosen = _segmentArgmin(costs, segmentStarts)
+            best[mid] = candidates[chosen]
+            newCost[mid] = costs[chosen]
+            left = lo < mid
+            right = mid < hi
+            lo, hi, optLo, optHi = (
+                numpy.concatenate([lo[left], mid[right] + 1]),
+                numpy.concatenate([mid[left] - 1, hi[right]]),
+                numpy.concatenate([optLo[left], best[mid][right]]),
+                numpy.concatenate([best[mid][left], optHi[right]]))
+        cost = newCost
+        starts.append(best)
+    # Follow the class starts back from the last value
+    ends = [count - 1]
+    for best in reversed(starts):
+        ends.append(best[ends[-1]] - 1)
+    ends.reverse()
+    return numpy.concatenate([distinct[:1], distinct[ends]])
+
+
+def classify(values, method, classes):
+    """
+    Compute class breaks of values.
+
+    :param values: a numpy array of numbers.
+    :param method: one of CLASSIFY_METHODS.
+    :param classes: the number of classes.
+    :returns: a dict with the classes + 1 breaks, from the minimum to the
+        maximum value, and the number of values in each class.  Values equal
+        to a break belong to the class it ends.  Jenks breaks of values with
+        at most as many distinct values as classes are one class per
+        distinct value instead, so there are fewer breaks.
+    """
+    if not len(values):
+        return {'breaks': [], 'counts': []}
+    breaks = {
+        'quantile': quantileBreaks,
+        'jenks': jenksBreaks,
+        'equal': equalBreaks
+    }[method](values, classes)
+    classIndex = numpy.searchsorted(breaks[1:-1], values, side='left')
+    counts = numpy.bincount(classIndex, minlength=len(breaks) - 1)
+    return {
+        'breaks': breaks.tolist(),
+        'counts': counts.tolist()
+    }
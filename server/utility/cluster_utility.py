@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Hierarchical grid clustering of point datasets.
+
+Points are grouped in square cells of CLUSTER_CELL_SIZE web map pixels at
+every zoom level.  A cell contains exactly four cells of the next zoom level,
+so each level is aggregated from the next finer one rather than from the
+points.  The clusters are stored in a numpy ``.npz`` archive, the
+``clusters`` file of a dataset, with the clusters of every level
+concatenated, coarsest first:
+
+- ``level_sizes``: int64 array, the number of clusters of each zoom level,
+  from zoom 0 to ``max_zoom``
+- ``count``: int64 array, the number of points of each cluster
+- ``lon``, ``lat``: float64 arrays, the centroid of each cluster
+- ``sum``, ``min``, ``max``, ``valued``: float64 arrays of shape
+  (clusters, properties), the sum, extremes and number of values of the
+  numeric properties named by ``properties``, a uint8 array holding the
+  UTF-8 JSON list of their names
+"""
+
+import io
+import json
+import math
+import numbers
+
+import numpy
+
+CLUSTER_CELL_SIZE = 64
+CLUSTER_MAX_ZOOM = 16
+TILE_SIZE = 256
+
+# Levels with more clusters than this fraction of the points are not stored,
+# as they hardly cluster anything; individual points are served instead.
+CLUSTER_MAX_RATIO = 0.5
+
+# Numeric properties summarized in clusters.
+MAX_CLUSTER_PROPERTIES = 4
+
+# Clusters built in memory for datasets promoted without a clusters file.
+CLUSTER_CACHE_SIZE = 16
+
+_MAX_LATITUDE = 85.0511287798
+
+
+def _isNumber(value):
+    # numbers.Real includes the long integers of Python 2
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def isPointDataset(stats):
+    """Whether the statistics of a dataset show only points."""
+    geometryTypes = stats.get('geometry_types')
+    return bool(geometryTypes) and all(
+        geometryType in ('Point', 'MultiPoint')
+        for geometryType in geometryTypes)
+
+
+def _cells(lon, lat, zoom):
+    """The integer cell of points at a zoom level, in web mercator."""
+    cellCount = TILE_SIZE * 2 ** zoom // CLUSTER_CELL_SIZE
+    x = (lon + 180.0) / 360.0
+    sinLat = numpy.sin(numpy.radians(
+        numpy.clip(lat, -_MAX_LATITUDE, _MAX_LATITUDE)))
+    y = 0.5 - numpy.log((1 + sinLat) / (1 - sinLat)) / (4 * math.pi)
+    cellX = numpy.clip((x * cellCount).astype(numpy.int64), 0, cellCount - 1)
+    cellY = numpy.clip((y * cellCount).astype(numpy.int64), 0, cellCount - 1)
+    return cellX, cellY
+
+
+class PointClusterer(object):
+    """
+    Gather the points of a GeoJSON dataset and cluster them.  Points are the
+    Point and MultiPoint geometries of the features; other geometries are
+    skipped.
+    """
+
+    def __init__(self):
+        self.lon = []
+        self.lat = []
+        # Values of the first numeric properties seen, by name
+        self.columns = {}
+        self.names = []
+        self.invalid = set()
+
+    def addFeature(self, feature):
+        geometry = feature.get('geometry')
+        if not geometry or geometry['type'] not in ('Point', 'MultiPoint'):
+            return
+        positions = [geometry['coordinates']] \
+            if geometry['type'] == 'Point' else geometry['coordinates']
+        properties = feature.get('properties') or {}
+        for name, value in sorted(properties.items()):
+            if name not in self.columns and _isNumber(value) and \
+                    len(self.names) < MAX_CLUSTER_PROPERTIES:
+                self.names.append(name)
+                self.columns[name] = [numpy.nan] * len(self.lon)
+        for name in self.names:
+            value = properties.get(name)
+            if _isNumber(value):
+                value = float(value)
+            else:
+                if value is not None:
+                    self.invalid.add(name)
+                value = numpy.nan
+            self.columns[name].extend([value] * len(positions))
+        for position in positions:
+            self.lon.append(position[0])
+            self.lat.append(position[1])
+
+    def build(self):
+        """
+        :returns: the bytes of the .npz clusters and the number of points.
+        """
+        lon = numpy.array(self.lon, dtype=numpy.float64)
+        lat = numpy.array(self.lat, dtype=numpy.float64)
+        names = [name for name in self.names if name not in self.invalid]
+        values = numpy.array([self.columns[name] for name in names],
+                             dtype=numpy.float64).reshape(
+                                 len(names), len(lon)).T
+
+        cellX, cellY = _cells(lon, lat, CLUSTER_MAX_ZOOM)
+        level = {
+            'cellX': cellX, 'cellY': cellY,
+            'count': numpy.ones(len(lon), dtype=numpy.int64),
+            'lonSum': lon, 'latSum': lat,
+            'sum': numpy.nan_to_num(values),
+            'min': values, 'max': values,
+            'valued': (~numpy.isnan(values)).astype(numpy.float64)
+        }
+        levels = []
+        for zoom in range(CLUSTER_MAX_ZOOM, -1, -1):
+            if zoom != CLUSTER_MAX_ZOOM:
+                level['cellX'] = level['cellX'] // 2
+                level['cellY'] = level['cellY'] // 2
+            level = _aggregate(level)
+            if len(lon) and \
+                    len(level['count']) <= CLUSTER_MAX_RATIO * len(lon):
+                levels.append(level)
+        levels.reverse()
+        maxZoom = len(levels) - 1
+
+        def concatenated(key, shape=()):
+            if not levels:
+                return numpy.zeros((0,) + shape)
+            return numpy.concatenate([level[key] for level in levels])
+
+        count = concatenated('count')
+        buffer = io.BytesIO()
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            numpy.savez(
+                buffer,
+                level_sizes=numpy.array([len(level['count'])
+                                         for level in levels],
+                                        dtype=numpy.int64),
+                max_zoom=numpy.int64(maxZoom),
+                count=count.astype(numpy.int64),
+                lon=concatenated('lonSum') / count,
+                lat=concatenated('latSum') / count,
+                sum=concatenated('sum', (len(names),)),
+                min=concatenated('min', (len(names),)),
+                max=concatenated('max', (len(names),)),
+                valued=concatenated('valued', (len(names),)),
+                properties=numpy.frombuffer(
+                    json.dumps(names).encode('utf8'), dtype=numpy.uint8))
+        return buffer.getvalue(), len(lon)
+
+
+def _aggregate(level):
+    """Merge the clusters of a level that are in the same cell."""
+    keys = (level['cellX'] << 32) | level['cellY']
+    keys, first, inverse = numpy.unique(
+        keys, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    size = len(keys)
+
+    def summed(values):
+        if values.ndim == 1:
+            return numpy.bincount(inverse, weights=values, minlength=size)
+        if not values.shape[1]:
+            return numpy.zeros((size, 0))
+        return numpy.column_stack([
+            numpy.bincount(inverse, weights=values[:, column], minlength=size)
+            for column in range(values.shape[1])]).reshape(
+                size, values.shape[1])
+
+    def extreme(values, function, initial):
+        result = numpy.full((size, values.shape[1]), initial)
+        function.at(result, inverse, values)
+        # Cells without any value have no extremes
+        result[numpy.isinf(result)] = numpy.nan
+        return result
+
+    return {
+        'cellX': level['cellX'][first], 'cellY': level['cellY'][first],
+        'count': numpy.bincount(inverse, weights=level['count'],
+                                minlength=size).astype(numpy.int64),
+        'lonSum': summed(level['lonSum']), 'latSum': summed(level['latSum']),
+        'sum': summed(level['sum']),
+        'min': extreme(level['min'], numpy.fmin, numpy.inf),
+        'max': extreme(level['max'], numpy.fmax, -numpy.inf),
+        'valued': summed(level['valued'])
+    }
+
+
+class ClusterIndex(object):
+    """The clusters of a dataset, loaded from the bytes of their .npz file."""
+
+    def __init__(self, data):
+        index = numpy.load(io.BytesIO(data))
+        self.maxZoom = int(index['max_zoom'])
+        self.properties = json.loads(
+            index['properties'].tobytes().decode('utf8'))
+        self.starts = numpy.cumsum([0] + index['level_sizes'].tolist())
+        self.arrays = dict((key, index[key]) for key in (
+            'count', 'lon', 'lat', 'sum', 'min', 'max', 'valued'))
+
+    def clusters(self, zoom, bbox=None):
+        """
+        The clusters of a zoom level within a bounding box, as GeoJSON point
+        features with the number of points and a summary of their numeric
+        properties.  Zoom levels above maxZoom have no clusters.
+        """
+        zoom = max(0, int(zoom))
+        if zoom > self.maxZoom:
+            return []
+        start, end = self.starts[zoom], self.starts[zoom + 1]
+        arrays = dict((key, values[start:end])
+                      for key, values in self.arrays.items())
+        if bbox is not None:
+            mask = ((arrays['lon'] >= bbox[0]) & (arrays['lon'] <= bbox[2]) &
+                    (arrays['lat'] >= bbox[1]) & (arrays['lat'] <= bbox[3]))
+            arrays = dict((key, values[mask])
+                          for key, values in arrays.items())
+        features = []
+        columns = dict((key, values.tolist())
+                       for key, values in arrays.items())
+        for row in range(len(columns['count'])):
+            summary = {}
+            for column, name in enumerate(self.properties):
+                valued = columns['valued'][row][column]
+                if not valued:
+                    continue
+                summary[name] = {
+                    'min': columns['min'][row][column],
+                    'max': columns['max'][row][column],
+                    'sum': columns['sum'][row][column],
+                    'mean': columns['sum'][row][column] / valued
+                }
+            features.append({
+                'type': 'Feature',
+                'geometry': {
+                    'type': 'Point',
+                    'coordinates': [columns['lon'][row], columns['lat'][row]]
+                },
+                'properties': {
+                    'cluster': True,
+                    'count': columns['count'][row],
+                    'summary': summary
+                }
+            })
+        return features
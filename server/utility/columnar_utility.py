@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import json
+
+import geojson
+from shapely import wkb
+from shapely.geometry import mapping
+
+from girder.plugins.minerva.utility.dataset_utility import GeoJsonMapper
+
+
+def geoParquetRows(filepath):
+    """
+    Creates a generator over the rows of a GeoParquet file, reading one row
+    group at a time, yielding a (geometry, properties) tuple per row.
+
+    :param filepath: path to the GeoParquet file.
+    """
+    # pyarrow is only needed when datasets have columnar files.
+    import pyarrow.parquet
+
+    parquetFile = pyarrow.parquet.ParquetFile(filepath, memory_map=True)
+    geo = json.loads(parquetFile.schema.to_arrow_schema().metadata[
+        b'geo'].decode('utf8'))
+    geometryName = geo['primary_column']
+    for index in range(parquetFile.num_row_groups):
+        columns = parquetFile.read_row_group(index).to_pydict()
+        geometries = columns.pop(geometryName)
+        names = list(columns.keys())
+        for row, geometry in enumerate(geometries):
+            properties = dict((name, columns[name][row]) for name in names)
+            yield geometry, properties
+
+
+def geoParquetToGeoJson(filepath, writer):
+    """
+    Convert a GeoParquet file to a GeoJSON FeatureCollection without loading
+    the whole file in memory.
+
+    :param filepath: path to the GeoParquet file.
+    :param writer: a file like object the GeoJSON is written to.
+    """
+    def convertToGeoJson(row):
+        geometry, properties = row
+        if geometry is not None:
+            geometry = mapping(wkb.loads(bytes(geometry)))
+        return geojson.Feature(geometry=geometry, properties=properties)
+
+    GeoJsonMapper(objConverter=convertToGeoJson).mapToJson(
+        geoParquetRows(filepath), writer)
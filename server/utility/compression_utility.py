@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Streaming decompression of uploaded dataset files.
+
+Compressed files are recognized by their magic bytes and decompressed a chunk
+at a time while they are downloaded from the assetstore, so the extracted data
+is never written to disk.  Zip archives are read through their local file
+headers, in order, without the central directory at the end of the archive.
+"""
+
+import bz2
+import struct
+import zlib
+
+GZIP_MAGIC = b'\x1f\x8b'
+BZ2_MAGIC = b'BZh'
+ZIP_MAGIC = b'PK\x03\x04'
+
+COMPRESSION_EXTENSIONS = {
+    'gz': 'gzip',
+    'gzip': 'gzip',
+    'bz2': 'bz2',
+    'zip': 'zip'
+}
+
+_ZIP_LOCAL_HEADER = struct.Struct('<4s5H3I2H')
+_ZIP_DESCRIPTOR_MAGIC = b'PK\x07\x08'
+_ZIP_STORED = 0
+_ZIP_DEFLATED = 8
+_ZIP_HAS_DESCRIPTOR = 0x08
+_ZIP64_EXTRA = 0x0001
+
+# Header of a gzip member with no name and no modification time.
+_GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+class ChunkReader(object):
+    """A file like object over an iterable of chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def readChunk(self, size=None):
+        """
+        Read the next buffered or downloaded chunk, up to size bytes, without
+        joining chunks.  Returns an empty string at the end of the data.
+        """
+        if not self._buffer:
+            self._buffer = next(self._chunks, b'')
+        if size is None:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def read(self, size=-1):
+        parts = []
+        length = 0
+        while size < 0 or length < size:
+            data = self.readChunk(None if size < 0 else size - length)
+            if not data:
+                break
+            parts.append(data)
+            length += len(data)
+        return b''.join(parts)
+
+    def unread(self, data):
+        """Put data back in front of the remaining chunks."""
+        self._buffer = data + self._buffer
+
+
+def detectCompression(head):
+    """
+    :param head: the first bytes of a file.
+    :returns: 'gzip', 'bz2', 'zip' or None.
+    """
+    if head[:2] == GZIP_MAGIC:
+        return 'gzip'
+    if head[:3] == BZ2_MAGIC:
+        return 'bz2'
+    if head[:4] == ZIP_MAGIC:
+        return 'zip'
+    return None
+
+
+def uncompressedExtensions(name):
+    """
+    The extensions of a file name without the trailing compression
+    extensions, so that 'points.csv.gz' gives ['csv'].
+    """
+    exts = name.split('.')[1:]
+    while exts and exts[-1].lower() in COMPRESSION_EXTENSIONS:
+        exts.pop()
+    return exts
+
+
+def _decompressedChunks(reader, newDecompressor):
+    """
+    Decompress a stream that may hold several concatenated members, as gzip
+    and bz2 files can.
+    """
+    decompressor = newDecompressor()
+    while True:
+        data = reader.readChunk()
+        if not data:
+            break
+        while data:
+            try:
+                output = decompressor.decompress(data)
+            except EOFError:
+                # A bz2 member ended exactly at the end of the last chunk
+                decompressor = newDecompressor()
+                output = decompressor.decompress(data)
+            if output:
+                yield output
+            # Data after the end of a member starts the next member
+            data = decompressor.unused_data
+            if data:
+                decompressor = newDecompressor()
+
+
+def _zipLocalHeader(reader):
+    """
+    Read the local header of the next zip member.
+
+    :returns: a dict describing the member, or None after the last member.
+    """
+    header = reader.read(_ZIP_LOCAL_HEADER.size)
+    if len(header) < _ZIP_LOCAL_HEADER.size or header[:4] != ZIP_MAGIC:
+        # The central directory follows the last member
+        return None
+    (magic, version, flags, method, time, date, crc, compressedSize,
+     size, nameLength, extraLength) = _ZIP_LOCAL_HEADER.unpack(header)
+    name = reader.read(nameLength).decode('utf8', 'replace')
+    extra = reader.read(extraLength)
+    position = 0
+    while position + 4 <= len(extra):
+        extraId, extraSize = struct.unpack('<2H', extra[position:position + 4])
+        if extraId == _ZIP64_EXTRA and extraSize >= 16:
+            size, compressedSize = struct.unpack(
+                '<2Q', extra[position + 4:position + 20])
+        position += 4 + extraSize
+    return {
+        'name': name,
+        'method': method,
+        'crc': crc,
+        'size': size,
+        'compressedSize': compressedSize,
+        'descriptor': bool(flags & _ZIP_HAS_DESCRIPTOR)
+    }
+
+
+def _zipMemberData(reader, member):
+    """
+    Yield the raw (still compressed) data of a zip member, followed by None
+    and then the (crc, size) of its uncompressed data.  The reader is left at
+    the next local header.
+    """
+    if not member['descriptor']:
+        remaining = member['compressedSize']
+        while remaining:
+            data = reader.readChunk(remaining)
+            if not data:
+                raise ValueError('Truncated zip member %s' % member['name'])
+            remaining -= len(data)
+            yield data
+        yield None
+        yield member['crc'], member['size']
+        return
+    if member['method'] != _ZIP_DEFLATED:
+        raise ValueError('Zip member %s can not be streamed' % member['name'])
+    # Without sizes in the header, the end of the member is found by
+    # inflating it.
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    crc = 0
+    size = 0
+    while True:
+        data = reader.readChunk()
+        if not data:
+            raise ValueError('Truncated zip member %s' % member['name'])
+        output = decompressor.decompress(data)
+        crc = zlib.crc32(output, crc)
+        size += len(output)
+        unused = decompressor.unused_data
+        if unused:
+            reader.unread(unused)
+            data = data[:len(data) - len(unused)]
+            yield data
+            break
+        yield data
+    # Skip the data descriptor, which may start with a signature
+    descriptor = reader.read(16)
+    if descriptor[:4] != _ZIP_DESCRIPTOR_MAGIC:
+        reader.unread(descriptor[12:])
+    yield None
+    yield crc & 0xffffffff, size
+
+
+def _isDataMember(member):
+    name = member['name']
+    return not name.endswith('/') and not name.startswith('__MACOSX/')
+
+
+def _firstZipMember(reader):
+    """Skip to the first member of a zip archive that is a data file."""
+    while True:
+        member = _zipLocalHeader(reader)
+        if member is None:
+            raise ValueError('Zip archive has no data files')
+        if _isDataMember(member):
+            return member
+        for data in _zipMemberData(reader, member):
+            pass
+
+
+def _inflatedZipMember(reader, member):
+    data = _zipMemberData(reader, member)
+    if member['method'] == _ZIP_STORED:
+        for chunk in data:
+            if chunk is None:
+                break
+            yield chunk
+        return
+    if member['method'] != _ZIP_DEFLATED:
+        raise ValueError('Unsupported zip compression method %d' %
+                         member['method'])
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    for chunk in data:
+        if chunk is None:
+            break
+        output = decompressor.decompress(chunk)
+        if output:
+            yield output
+    output = decompressor.flush()
+    if output:
+        yield output
+
+
+def decompressChunks(chunks):
+    """
+    Decompress the chunks of a file if it is compressed.
+
+    :param chunks: an iterable of byte strings.
+    :returns: a (compression, name, chunks) tuple.  compression is None for
+        files that aren't compressed, whose chunks are returned unchanged.
+        name is the name of the zip member that is read, the first data file
+        of the archive, or None for other files.
+    """
+    reader = ChunkReader(chunks)
+    head = reader.read(4)
+    reader.unread(head)
+    compression = detectCompression(head)
+    if compression == 'gzip':
+        return compression, None, _decompressedChunks(
+            reader, lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+    elif compression == 'bz2':
+        return compression, None, _decompressedChunks(
+            reader, bz2.BZ2Decompressor)
+    elif compression == 'zip':
+        member = _firstZipMember(reader)
+        return compression, member['name'], _inflatedZipMember(
+            reader, member)
+    return None, None, _remainingChunks(reader)
+
+
+def _remainingChunks(reader):
+    while True:
+        data = reader.readChunk()
+        if not data:
+            return
+        yield data
+
+
+def gzipChunks(chunks):
+    """
+    Get a gzip encoding of a file, uncompressing it if it is compressed.
+    Gzip files are passed through and deflated zip members are rewrapped as
+    gzip without inflating them; anything else is compressed on the fly.
+
+    :param chunks: an iterable of byte strings.
+    """
+    reader = ChunkReader(chunks)
+    head = reader.read(4)
+    reader.unread(head)
+    compression = detectCompression(head)
+    if compression == 'gzip':
+        for data in _remainingChunks(reader):
+            yield data
+        return
+    if compression == 'zip':
+        member = _firstZipMember(reader)
+        if member['method'] == _ZIP_DEFLATED:
+            yield _GZIP_HEADER
+            data = _zipMemberData(reader, member)
+            for chunk in data:
+                if chunk is None:
+                    break
+                yield chunk
+            crc, size = next(data)
+            yield struct.pack('<2I', crc, size & 0xffffffff)
+            return
+        source = _inflatedZipMember(reader, member)
+    elif compression == 'bz2':
+        source = _decompressedChunks(reader, bz2.BZ2Decompressor)
+    else:
+        source = _remainingChunks(reader)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in source:
+        output = compressor.compress(chunk)
+        if output:
+            yield output
+    yield compressor.flush()
+
+
+def acceptsEncoding(acceptEncoding, encoding):
+    """
+    Whether an Accept-Encoding header accepts a content coding, honoring
+    quality values: a coding with q=0, or matched only by a ``*`` with q=0,
+    is refused.
+
+    :param acceptEncoding: the value of the header.
+    :param encoding: a content coding, such as gzip.
+    """
+    wildcard = None
+    for entry in acceptEncoding.split(','):
+        parts = entry.split(';')
+        coding = parts[0].strip().lower()
+        quality = 1.0
+        for param in parts[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding == encoding:
+            return quality > 0
+        if coding == '*':
+            wildcard = quality
+    return wildcard is not None and wildcard > 0
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import codecs
+import csv
+import math
+
+import numpy
+
+from girder.plugins.minerva.utility.dataset_utility import GeoJsonMapper
+
+# Rows converted at a time; memory use depends on this, not on the file size.
+CSV_CHUNK_ROWS = 65536
+
+
+def csvLines(chunks):
+    """
+    Split the chunks of a csv file into lines, keeping the line endings so
+    the csv reader can handle quoted newlines.
+
+    :param chunks: an iterable of byte strings.
+    """
+    if str is not bytes:
+        chunks = codecs.iterdecode(chunks, 'utf-8')
+    partial = ''
+    for chunk in chunks:
+        lines = (partial + chunk).split('\n')
+        partial = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if partial:
+        yield partial
+
+
+def csvRowChunks(rows, size=CSV_CHUNK_ROWS):
+    """Group the rows of a csv reader into lists of at most size rows."""
+    chunk = []
+    for row in rows:
+        if not row:
+            continue
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _column(rows, index):
+    return numpy.array([row[index].strip() if index < len(row) else ''
+                        for row in rows])
+
+
+def _numbers(values):
+    """
+    Convert an array of strings to floats in one pass, falling back to a per
+    value conversion, with NaN for values that aren't numbers.
+    """
+    try:
+        return values.astype(numpy.float64)
+    except ValueError:
+        pass
+
+    def toFloat(value):
+        try:
+            return float(value)
+        except ValueError:
+            return numpy.nan
+    return numpy.array([toFloat(value) for value in values],
+                       dtype=numpy.float64)
+
+
+def _columnType(values):
+    """
+    The json type of a property column, ignoring blanks: int or float if
+    every value is a number, str otherwise, or None if every value is blank.
+    """
+    values = values[values != '']
+    if not len(values):
+        return None
+    for dtype, columnType in ((numpy.int64, 'int'), (numpy.float64, 'float')):
+        try:
+            numbers = values.astype(dtype)
+        except (ValueError, OverflowError):
+            continue
+        if dtype is numpy.int64 or numpy.isfinite(numbers).all():
+            return columnType
+    return 'str'
+
+
+def _parse(value, columnType):
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    if math.isinf(number) or math.isnan(number):
+        return None
+    if columnType != 'int':
+        return number
+    try:
+        integer = int(value)
+    except ValueError:
+        return None
+    # Integers that don't fit in an int64 are kept as floats
+    return integer if -2 ** 63 <= integer < 2 ** 63 else number
+
+
+def _properties(values, columnType):
+    """
+    Json values of a property column of a type, with None for blanks and
+    for values that aren't of that type.
+    """
+    if columnType is None:
+        return [None] * len(values)
+    if columnType == 'str':
+        return [value or None for value in values.tolist()]
+    dtype = numpy.int64 if columnType == 'int' else numpy.float64
+    try:
+        numbers = values.astype(dtype)
+        if dtype is numpy.int64 or numpy.isfinite(numbers).all():
+            return numbers.tolist()
+    except (ValueError, OverflowError):
+        pass
+    return [_parse(value, columnType) for value in values.tolist()]
+
+
+def _columnIndex(key, header):
+    if key is None:
+        raise ValueError('The mapper needs latitudeColumn and longitudeColumn')
+    key = str(key)
+    if header is not None and key in header:
+        return header.index(key)
+    if key.isdigit():
+        return int(key)
+    raise ValueError('Unknown csv column %s' % key)
+
+
+class CsvGeoJsonConverter(object):
+    """
+    Convert csv rows to GeoJSON point features, mapping a latitude and a
+    longitude column to the point coordinates, like GeoJsonMapper does for
+    json objects.  Columns are given by name or by index in the mapping
+    ``latitudeColumn`` and ``longitudeColumn``.  The rows are converted a
+    chunk at a time, parsing the coordinates of the whole chunk at once.
+    Rows without valid coordinates are skipped and counted.
+
+    The type of each property column is inferred from the first chunk with
+    values in it and applied to every later chunk, so a property has the
+    same type in every feature.  Blanks, and values of later chunks that
+    aren't of the column's type, are null; integers of later chunks too
+    large for an int64 are floats.
+    """
+
+    def __init__(self, mapping, dialect='excel', chunkRows=CSV_CHUNK_ROWS):
+        self.mapping = mapping
+        self.dialect = dialect
+        self.chunkRows = chunkRows
+        self.rowCount = 0
+        self.skippedCount = 0
+        self.columnTypes = {}
+
+    def _propertyColumn(self, chunk, index):
+        column = _column(chunk, index)
+        if self.columnTypes.get(index) is None:
+            self.columnTypes[index] = _columnType(column)
+        return _properties(column, self.columnTypes[index])
+
+    def features(self, lines):
+        rows = csv.reader(lines, self.dialect)
+        header = None
+        for chunkIndex, chunk in enumerate(
+                csvRowChunks(rows, self.chunkRows)):
+            if chunkIndex == 0:
+                header, chunk = self._header(chunk)
+                if not chunk:
+                    continue
+            latIndex = _columnIndex(self.mapping.get('latitudeColumn'), header)
+            longIndex = _columnIndex(
+                self.mapping.get('longitudeColumn'), header)
+            lat = _numbers(_column(chunk, latIndex))
+            lon = _numbers(_column(chunk, longIndex))
+            valid = (numpy.isfinite(lat) & numpy.isfinite(lon) &
+                     (numpy.abs(lat) <= 90) & (numpy.abs(lon) <= 180))
+            width = max(len(row) for row in chunk)
+            names = [header[index] if header and index < len(header)
+                     else str(index) for index in range(width)]
+            propertyIndices = [index for index in range(width)
+                               if index not in (latIndex, longIndex)]
+            columns = [self._propertyColumn(chunk, index)
+                       for index in propertyIndices]
+            propertyNames = [names[index] for index in propertyIndices]
+            lat = lat.tolist()
+            lon = lon.tolist()
+            self.rowCount += len(chunk)
+            self.skippedCount += len(chunk) - int(valid.sum())
+            for row in numpy.flatnonzero(valid).tolist():
+                yield {
+                    'type': 'Feature',
+                    'geometry': {
+                        'type': 'Point',
+                        'coordinates': [lon[row], lat[row]]
+                    },
+                    'properties': dict(zip(
+                        propertyNames, [column[row] for column in columns]))
+                }
+
+    def _header(self, chunk):
+        """
+        Split off the header row.  The first row is a header unless its
+        mapped coordinate columns hold numbers.
+        """
+        first = [value.strip() for value in chunk[0]]
+        try:
+            latIndex = _columnIndex(self.mapping.get('latitudeColumn'), None)
+            longIndex = _columnIndex(
+                self.mapping.get('longitudeColumn'), None)
+            float(first[latIndex])
+            float(first[longIndex])
+            return None, chunk
+        except (ValueError, IndexError):
+            return first, chunk[1:]
+
+    def toGeoJson(self, chunks, writer):
+        """
+        Write a GeoJSON FeatureCollection of the rows of a csv file.
+
+        :param chunks: an iterable of byte strings making up the csv file.
+        :param writer: a file like object the GeoJSON is written to.
+        """
+        GeoJsonMapper(objConverter=lambda feature: feature).mapToJson(
+            self.features(csvLines(chunks)), writer)
@@ -19,6 +19,7 @@
 
 import decimal
 import json
+import re
 import tempfile
 
 import geojson
@@ -31,13 +32,16 @@ def jsonObjectReader(filepath):
     Creates a generator that parses an array of json objects from a valid
     json array file, yielding each top level json object in the array.
 
-    :param filepath: path to json file.
+    :param filepath: path to json file, or a file like object.
     """
     top_level_array = False
     array_stack = 0
     top_level_object = False
     object_stack = 0
-    parser = ijson.parse(open(filepath, 'r'))
+    if hasattr(filepath, 'read'):
+        parser = ijson.parse(filepath)
+    else:
+        parser = ijson.parse(open(filepath, 'r'))
 
     for prefix, event, value in parser:
         if event == 'start_array':
@@ -79,6 +83,27 @@ def jsonObjectReader(filepath):
         builder.event(event, value)
 
 
+def _floats(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, list):
+        return [_floats(v) for v in value]
+    if isinstance(value, dict):
+        return dict((k, _floats(v)) for k, v in value.items())
+    return value
+
+
+def geojsonFeatures(reader):
+    """
+    Parse the features of a GeoJSON FeatureCollection one at a time, with
+    floats rather than Decimals for numbers.
+
+    :param reader: a file like object over the GeoJSON.
+    """
+    for feature in ijson.items(reader, 'features.item'):
+        yield _floats(feature)
+
+
 def jsonArrayHead(filepath, limit=10):
     # TODO rewrite to be more agnostic of source, file or mongo etc
     """
@@ -101,6 +126,110 @@ def jsonArrayHead(filepath, limit=10):
     return objs
 
 
+_jsonStructure = re.compile(br'[\[\]{}"\\]')
+
+
+def jsonArrayElementRanges(chunks, key=None):
+    """
+    Scan a json array for the byte ranges of its top level elements without
+    parsing it.  Only structural characters are inspected, so this is much
+    cheaper than a full parse.  Elements are expected to be objects or arrays.
+
+    :param chunks: an iterable of byte strings making up the json.
+    :param key: scan the array under this key of a top level object, such as
+        the features of a FeatureCollection, rather than a top level array.
+    :returns: a generator of (offset, element bytes) tuples.
+    """
+    elementDepth = 2 if key is None else 3
+    inArray = key is None
+    if key is not None:
+        key = key.encode('utf8')
+    depth = 0
+    inString = False
+    escaped = False
+    # The position of the character following a backslash
+    escapedPosition = None
+    position = 0
+    start = None
+    element = []
+    # The last string of the top level object, the key of an array value
+    lastString = None
+    stringParts = None
+    for chunk in chunks:
+        chunkStart = 0
+        stringStart = 0
+        for match in _jsonStructure.finditer(chunk):
+            char = match.group()
+            index = match.start()
+            if escaped:
+                escaped = False
+                if position + index == escapedPosition:
+                    continue
+            if inString:
+                if char == b'\\':
+                    escaped = True
+                    escapedPosition = position + index + 1
+                elif char == b'"':
+                    inString = False
+                    if stringParts is not None:
+                        stringParts.append(chunk[stringStart:index])
+                        lastString = b''.join(stringParts)
+                        stringParts = None
+                continue
+            if char == b'"':
+                inString = True
+                if key is not None and depth == 1:
+                    stringParts = []
+                    stringStart = index + 1
+            elif char in (b'{', b'['):
+                depth += 1
+                if depth == 2 and key is not None:
+                    inArray = char == b'[' and lastString == key
+                if depth == elementDepth and inArray:
+                    start = position + index
+                    chunkStart = index
+            elif char in (b'}', b']'):
+                depth -= 1
+                if depth == elementDepth - 1 and inArray:
+                    element.append(chunk[chunkStart:index + 1])
+                    yield start, b''.join(element)
+                    start = None
+                    element = []
+        if start is not None:
+            element.append(chunk[chunkStart:])
+        if stringParts is not None:
+            stringParts.append(chunk[stringStart:])
+        position += len(chunk)
+
+
+def chunkRanges(chunks, ranges):
+    """
+    Cut byte ranges out of a stream, for data that can't be read with ranged
+    reads, such as a compressed file.
+
+    :param chunks: an iterable of byte strings.
+    :param ranges: (offset, length) tuples in increasing offset order.
+    :returns: a generator of the bytes of each range.
+    """
+    ranges = iter(ranges)
+    current = next(ranges, None)
+    position = 0
+    parts = []
+    for chunk in chunks:
+        end = position + len(chunk)
+        while current is not None and current[0] < end:
+            stop = current[0] + current[1] - position
+            parts.append(chunk[max(current[0] - position, 0):stop])
+            if stop > len(chunk):
+                break
+            yield b''.join(parts)
+            parts = []
+            current = next(ranges, None)
+        if current is None:
+            return
+        position = end
+
+
 class JsonMapper(object):
 
     def __init__(self, objConverter, header='[', footer=']',
@@ -0,0 +1,551 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Detection of the format of dataset files.
+
+Each sniffer looks at the start of a file, reading only as many bytes as it
+needs, and reports how confident it is that the file is of its format.  The
+most confident sniffer then collects basic statistics about the file from the
+rest of the same stream, so that a file is only read once.  Additional formats
+can be supported with ``registerSniffer``.
+"""
+
+import csv
+import json
+import struct
+
+import ijson
+
+from girder.utility.model_importer import ModelImporter
+
+from girder.plugins.minerva.utility.compression_utility import ChunkReader
+from girder.plugins.minerva.utility.dataset_utility import \
+    jsonArrayElementRanges
+from girder.plugins.minerva.utility.shapefile_utility import shpHeader, \
+    prjTransformer, transformBounds, SHP_HEADER_SIZE, SHX_RECORD_SIZE
+
+# Sniffers give up on a file after this many bytes without a decision.
+MAX_SNIFF_BYTES = 1024 * 1024
+
+# Results below this confidence are not used.
+MIN_CONFIDENCE = 0.5
+
+GEOJSON_TYPES = frozenset([
+    'FeatureCollection', 'Feature', 'Point', 'MultiPoint', 'LineString',
+    'MultiLineString', 'Polygon', 'MultiPolygon', 'GeometryCollection'])
+
+_sniffers = []
+
+
+def registerSniffer(snifferClass):
+    """
+    Add a sniffer class to those tried on every file.  Earlier registrations
+    win ties in confidence.  Can be used as a class decorator.
+    """
+    _sniffers.append(snifferClass)
+    return snifferClass
+
+
+class SniffStream(object):
+    """
+    Wrap the chunks of a file download so several sniffers can each read the
+    start of the file, after which the full stream can be consumed once
+    without downloading it again.
+    """
+
+    def __init__(self, chunks, limit=MAX_SNIFF_BYTES):
+        self._chunks = iter(chunks)
+        self._data = b''
+        self._exhausted = False
+        self.limit = limit
+
+    def _fill(self, size):
+        while (len(self._data) < size and len(self._data) < self.limit and
+               not self._exhausted):
+            try:
+                self._data += next(self._chunks)
+            except StopIteration:
+                self._exhausted = True
+
+    def head(self, size):
+        """Get up to size bytes from the start of the file."""
+        self._fill(size)
+        return self._data[:size]
+
+    def reader(self):
+        """A file like object reading from the start of the file."""
+        return _SniffReader(self)
+
+    def chunks(self):
+        """Every chunk of the file, starting with those already read."""
+        if self._data:
+            yield self._data
+        self._data = b''
+        for chunk in self._chunks:
+            yield chunk
+
+    def close(self):
+        if hasattr(self._chunks, 'close'):
+            self._chunks.close()
+
+
+class _SniffReader(object):
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.stream.limit
+        data = self.stream.head(self.position + size)[self.position:]
+        self.position += len(data)
+        return data
+
+
+class FormatSniffer(object):
+    """
+    Base class for format sniffers.  A sniffer is created for each file, and
+    subclasses implement ``sniff``, and optionally ``stats`` and
+    ``metadata``.
+    """
+    extensions = ()
+    mimeTypes = ()
+
+    def __init__(self, file):
+        self.file = file
+
+    def claimed(self):
+        """Whether the name or mime type of the file claim this format."""
+        return (bool(set(self.extensions).intersection(self.file['exts'])) or
+                self.file.get('mimeType') in self.mimeTypes)
+
+    def sniff(self, stream, readRange):
+        """
+        Decide whether the file is of this format.
+
+        :param stream: the SniffStream of the file.
+        :param readRange: a function taking an offset and a length and
+            returning those bytes of the file, for formats that need to look
+            beyond the start of the file.
+        :returns: the confidence, from 0 to 1.
+        """
+        return 0
+
+    def stats(self, chunks):
+        """
+        Collect statistics from every chunk of the file.
+
+        :returns: a dict of statistics.
+        """
+        return {}
+
+    def metadata(self):
+        """The Minerva metadata of a dataset made from the file."""
+        return {
+            'original_files': [{
+                'name': self.file['name'], '_id': self.file['_id']}]
+        }
+
+
+def _jsonEvents(stream):
+    """
+    Parse events of the start of a json file, ending quietly when the
+    sniffed bytes run out or the file isn't json.
+    """
+    try:
+        for event in ijson.parse(stream.reader()):
+            yield event
+    except Exception:
+        return
+
+
+def _extendBounds(bounds, x, y):
+    if bounds is None:
+        return [x, y, x, y]
+    bounds[0] = min(bounds[0], x)
+    bounds[1] = min(bounds[1], y)
+    bounds[2] = max(bounds[2], x)
+    bounds[3] = max(bounds[3], y)
+    return bounds
+
+
+def geojsonBounds(obj, bounds=None):
+    """
+    Bounding box [minx, miny, maxx, maxy] of the coordinates in a parsed
+    GeoJSON object, skipping feature properties.
+    """
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if key == 'properties':
+                continue
+            if key == 'coordinates':
+                for x, y in _positions(value):
+                    bounds = _extendBounds(bounds, x, y)
+            else:
+                bounds = geojsonBounds(value, bounds)
+    elif isinstance(obj, list):
+        for value in obj:
+            bounds = geojsonBounds(value, bounds)
+    return bounds
+
+
+def _positions(coordinates):
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        yield float(coordinates[0]), float(coordinates[1])
+    else:
+        for child in coordinates:
+            for position in _positions(child):
+                yield position
+
+
+@registerSniffer
+class GeoJsonTimeseriesSniffer(FormatSniffer):
+    """
+    A json array of objects, each with a ``geojson`` element and usually a
+    ``time``.
+    """
+    extensions = ('geojson', 'json')
+
+    def sniff(self, stream, readRange):
+        for prefix, event, value in _jsonEvents(stream):
+            if prefix == '' and event != 'start_array':
+                return 0
+            if prefix == 'item' and event == 'map_key' and value == 'geojson':
+                return 1.0
+            if prefix == 'item' and event != 'start_map' and \
+                    event != 'map_key':
+                # The first element ended, or isn't an object
+                return 0
+        return 0
+
+    def stats(self, chunks):
+        # The frame ranges are kept for the frame index
+        self.frames = []
+        bounds = None
+        for offset, data in jsonArrayElementRanges(chunks):
+            frame = json.loads(data.decode('utf8'))
+            if not self.frames:
+                # The bounds of a timeseries are those of its first frame
+                bounds = geojsonBounds(frame.get('geojson'))
+            self.frames.append((offset, len(data), frame.get('time')))
+        return {'frame_count': len(self.frames), 'bbox': bounds}
+
+    def metadata(self):
+        metadata = super(GeoJsonTimeseriesSniffer, self).metadata()
+        metadata.update({
+            'original_type': 'geojson-timeseries',
+            'dataset_type': 'geojson-timeseries',
+            'geojson_file': {
+                'name': self.file['name'], '_id': self.file['_id']},
+            'source': {'layer_source': 'GeoJSON'}
+        })
+        return metadata
+
+
+@registerSniffer
+class GeoJsonSniffer(FormatSniffer):
+    """A GeoJSON object, usually a FeatureCollection."""
+    extensions = ('geojson',)
+    mimeTypes = ('application/vnd.geo+json', 'application/geo+json')
+
+    def sniff(self, stream, readRange):
+        for prefix, event, value in _jsonEvents(stream):
+            if prefix == '' and event not in ('start_map', 'map_key'):
+                return 0
+            if prefix == 'type' and event == 'string':
+                return 1.0 if value in GEOJSON_TYPES else 0
+            if prefix == 'features.item.type' and event == 'string':
+                # The type of the collection comes after its features
+                return 0.9 if value == 'Feature' else 0
+        # The start of the file is an object without a decision
+        return 0.5 if self.claimed() else 0
+
+    def stats(self, chunks):
+        featureCount = 0
+        topType = None
+        geometryTypes = set()
+        bounds = None
+        # Index within each open coordinate array, to tell x from y
+        positions = []
+        for prefix, event, value in ijson.parse(ChunkReader(chunks)):
+            path = prefix.split('.')
+            if 'coordinates' in path and \
+                    'properties' not in path[:path.index('coordinates')]:
+                if event == 'start_array':
+                    positions.append([0, None])
+                elif event == 'end_array':
+                    positions.pop()
+                elif event == 'number':
+                    position = positions[-1]
+                    if position[0] == 0:
+                        position[1] = float(value)
+                    elif position[0] == 1:
+                        bounds = _extendBounds(
+                            bounds, position[1], float(value))
+                    position[0] += 1
+                continue
+            if event == 'start_map' and prefix == 'features.item':
+                featureCount += 1
+            elif prefix == 'type' and event == 'string':
+                topType = value
+            if event == 'string' and path[-1] == 'type' and \
+                    'properties' not in path and \
+                    value in GEOJSON_TYPES and \
+                    value not in ('Feature', 'FeatureCollection'):
+                geometryTypes.add(value)
+        if topType == 'Feature':
+            featureCount = 1
+        return {
+            'feature_count': featureCount,
+            'geometry_types': sorted(geometryTypes),
+            'bbox': bounds
+        }
+
+    def metadata(self):
+        metadata = super(GeoJsonSniffer, self).metadata()
+        metadata.update({
+            'original_type': 'geojson',
+            'dataset_type': 'geojson',
+            'geojson_file': {
+                'name': self.file['name'], '_id': self.file['_id']},
+            'source': {'layer_source': 'GeoJSON'}
+        })
+        return metadata
+
+
+@registerSniffer
+class JsonArraySniffer(FormatSniffer):
+    """A json array of objects, such as a tweet dump."""
+    extensions = ('json',)
+    mimeTypes = ('application/json',)
+
+    def sniff(self, stream, readRange):
+        for prefix, event, value in _jsonEvents(stream):
+            if prefix == '' and event != 'start_array':
+                return 0
+            if prefix == 'item':
+                if event == 'end_map':
+                    return 0.9
+                if event not in ('start_map', 'map_key'):
+                    return 0
+        return 0.6 if self.claimed() else 0
+
+    def stats(self, chunks):
+        return {'row_count': sum(1 for _ in jsonArrayElementRanges(chunks))}
+
+    def metadata(self):
+        metadata = super(JsonArraySniffer, self).metadata()
+        metadata.update({'original_type': 'json', 'dataset_type': 'json'})
+        return metadata
+
+
+@registerSniffer
+class CsvSniffer(FormatSniffer):
+    """
+    Delimited text.  Almost any text parses as csv, so only files whose name
+    or mime type claim to be csv are considered.
+    """
+    extensions = ('csv',)
+    mimeTypes = ('text/csv', 'application/csv')
+    sampleSize = 64 * 1024
+
+    def sniff(self, stream, readRange):
+        if not self.claimed():
+            return 0
+        sample = stream.head(self.sampleSize)
+        lines = sample.splitlines()
+        if len(sample) == self.sampleSize:
+            # Drop a partial last line
+            lines = lines[:-1]
+        try:
+            sample = b'\n'.join(lines)
+            if not isinstance(sample, str):
+                sample = sample.decode('utf8')
+            self.dialect = csv.Sniffer().sniff(sample)
+            self.hasHeader = csv.Sniffer().has_header(sample)
+        except (csv.Error, UnicodeDecodeError):
+            return 0.6
+        widths = set(len(row) for row in csv.reader(
+            sample.splitlines(), self.dialect) if row)
+        return 0.9 if len(widths) == 1 and widths.pop() > 1 else 0.6
+
+    def stats(self, chunks):
+        rows = 0
+        partial = b''
+        for chunk in chunks:
+            lines = (partial + chunk).split(b'\n')
+            partial = lines.pop()
+            rows += sum(1 for line in lines if line.strip())
+        if partial.strip():
+            rows += 1
+        if getattr(self, 'hasHeader', False):
+            rows -= 1
+        return {'row_count': rows}
+
+    def metadata(self):
+        metadata = super(CsvSniffer, self).metadata()
+        metadata.update({'original_type': 'csv', 'dataset_type': 'csv'})
+        return metadata
+
+
+# GeoTIFF tags that georeference an image
+_GEOTIFF_TAGS = frozenset([33550, 33922, 34264, 34735])
+_TIFF_WIDTH = 256
+_TIFF_HEIGHT = 257
+
+
+@registerSniffer
+class GeoTiffSniffer(FormatSniffer):
+    """
+    A TIFF with GeoTIFF tags in its first image file directory.  Only the
+    header and the directory are read.
+    """
+    extensions = ('tif', 'tiff')
+    mimeTypes = ('image/tiff',)
+
+    def sniff(self, stream, readRange):
+        header = stream.head(16)
+        if header[:4] in (b'II*\x00', b'MM\x00*'):
+            big = False
+        elif header[:4] in (b'II+\x00', b'MM\x00+'):
+            big = True
+        else:
+            return 0
+        order = '<' if header[:2] == b'II' else '>'
+        if big:
+            offset = struct.unpack(order + 'Q', header[8:16])[0]
+            countFormat, entryFormat, entrySize = 'Q', 'HHQQ', 20
+        else:
+            offset = struct.unpack(order + 'I', header[4:8])[0]
+            countFormat, entryFormat, entrySize = 'H', 'HHII', 12
+        valueFormat = entryFormat[-1]
+        countSize = struct.calcsize(countFormat)
+        tags = {}
+        try:
+            count = struct.unpack(
+                order + countFormat, readRange(offset, countSize))[0]
+            entries = readRange(offset + countSize, count * entrySize)
+            for index in range(count):
+                tag, fieldType, valueCount, value = struct.unpack(
+                    order + entryFormat,
+                    entries[index * entrySize:(index + 1) * entrySize])
+                if fieldType == 3:
+                    # Short values are left justified in the value field
+                    value = struct.unpack(order + 'H', struct.pack(
+                        order + valueFormat, value)[:2])[0]
+                tags[tag] = value
+        except struct.error:
+            # A truncated file
+            return 0
+        self.size = {'width': tags.get(_TIFF_WIDTH),
+                     'height': tags.get(_TIFF_HEIGHT)}
+        if not _GEOTIFF_TAGS.intersection(tags):
+            return 0
+        return 1.0 if self.claimed() else 0.9
+
+    def stats(self, chunks):
+        return self.size
+
+    def metadata(self):
+        metadata = super(GeoTiffSniffer, self).metadata()
+        metadata.update({
+            'original_type': 'tiff',
+            'dataset_type': 'geotiff',
+            'source': {'layer_source': 'Tiff'}
+        })
+        return metadata
+
+
+@registerSniffer
+class ShapefileSniffer(FormatSniffer):
+    """
+    The .shp file of a shapefile, with its .shx index and usually .dbf and
+    .prj files in the same item.  Only the .shp header is read.
+    """
+    extensions = ('shp',)
+    components = ('shx', 'dbf', 'prj', 'cpg')
+
+    def _components(self):
+        base = self.file['name'].rsplit('.', 1)[0]
+        components = {}
+        for file in ModelImporter.model('item').childFiles(
+                item={'_id': self.file['itemId']}, limit=0):
+            name, _, ext = file['name'].rpartition('.')
+            if name == base and ext.lower() in self.components:
+                components[ext.lower()] = file
+        return components
+
+    def sniff(self, stream, readRange):
+        # The .shx has the same header, so the extension has to match too.
+        if not self.claimed():
+            return 0
+        self.header = shpHeader(stream.head(SHP_HEADER_SIZE))
+        if self.header is None:
+            return 0
+        self.componentFiles = self._components()
+        if 'shx' not in self.componentFiles:
+            # Records can't be located without the index
+            return 0
+        return 1.0
+
+    def stats(self, chunks):
+        prj = self.componentFiles.get('prj')
+        if prj is not None:
+            prj = b''.join(ModelImporter.model('file').download(
+                prj, headers=False)()).decode('utf8', 'replace')
+        shx = self.componentFiles['shx']
+        return {
+            'feature_count':
+                (shx['size'] - SHP_HEADER_SIZE) // SHX_RECORD_SIZE,
+            'bbox': transformBounds(
+                self.header['bbox'], prjTransformer(prj))
+        }
+
+    def metadata(self):
+        shapefile = {'shp': {'name': self.file['name'], '_id': self.file['_id']}}
+        for ext, file in self.componentFiles.items():
+            shapefile[ext] = {'name': file['name'], '_id': file['_id']}
+        # The shapefile is converted to GeoJSON when it is promoted.
+        return {
+            'original_type': 'shapefile',
+            'dataset_type': 'geojson',
+            'shapefile': shapefile,
+            'source': {'layer_source': 'GeoJSON'}
+        }
+
+
+def sniffFile(file, stream, readRange):
+    """
+    Find the most confident sniffer for a file.
+
+    :param file: the Girder file document.
+    :param stream: the SniffStream of the file.
+    :param readRange: a function reading a range of bytes of the file.
+    :returns: a (confidence, sniffer) tuple; the sniffer is None if no format
+        was detected.
+    """
+    best = (0, None)
+    for snifferClass in _sniffers:
+        sniffer = snifferClass(file)
+        confidence = sniffer.sniff(stream, readRange)
+        if confidence >= MIN_CONFIDENCE and confidence > best[0]:
+            best = (confidence, sniffer)
+    return best
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+import hashlib
+import json
+
+from girder.constants import AccessType
+from girder.utility.model_importer import ModelImporter
+
+from girder.plugins.minerva.utility.minerva_utility import \
+    findMinervaCollection
+
+PROCESS_CACHE_FOLDER = 'gaia_cache'
+
+
+def datasetFileId(minervaMeta):
+    """
+    Get the id of the file holding the data of a dataset, checking the same
+    places that dataset downloads do.
+    """
+    if 'original_files' in minervaMeta:
+        return minervaMeta['original_files'][0]['_id']
+    elif 'geojson_file' in minervaMeta:
+        return minervaMeta['geojson_file']['_id']
+    elif 'geo_render' in minervaMeta:
+        return minervaMeta['geo_render']['file_id']
+
+
+def _canonicalProcess(process, itemIds):
+    """
+    Copy a Gaia process description without the per request tokens, gathering
+    the ids of the Minerva items it reads.  Returns None if the process reads
+    something that can't be checksummed, such as a remote uri.
+    """
+    if isinstance(process, dict):
+        if process.get('uri') or process.get('url'):
+            return None
+        if 'item_id' in process:
+            itemIds.add(str(process['item_id']))
+        canonical = {}
+        for key, value in process.items():
+            if key == 'token':
+                continue
+            value = _canonicalProcess(value, itemIds)
+            if value is None and process[key] is not None:
+                return None
+            canonical[key] = value
+        return canonical
+    elif isinstance(process, list):
+        canonical = [_canonicalProcess(value, itemIds) for value in process]
+        if any(c is None and v is not None for c, v in zip(canonical, process)):
+            return None
+        return canonical
+    return process
+
+
+def processCacheKey(process, user):
+    """
+    Compute a cache key for a Gaia process from its canonical json and the
+    sha512 checksums of the files of every Minerva dataset it reads.  Access to
+    each input is checked for the user.
+
+    :param process: the deserialized process json.
+    :param user: the user running the process.
+    :returns: a hex digest, or None if the result of the process can't be
+        cached, as when an input item doesn't exist.
+    """
+    itemIds = set()
+    canonical = _canonicalProcess(process, itemIds)
+    if canonical is None:
+        return None
+    checksums = []
+    for itemId in sorted(itemIds):
+        item = ModelImporter.model('item').load(
+            itemId, user=user, level=AccessType.READ)
+        if item is None:
+            return None
+        fileId = datasetFileId(item.get('meta', {}).get('minerva', {}))
+        if fileId is None:
+            return None
+        file = ModelImporter.model('file').load(fileId, force=True)
+        if file is None or not file.get('sha512'):
+            return None
+        checksums.append(file['sha512'])
+    spec = json.dumps({'process': canonical, 'inputs': checksums},
+                      sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(spec.encode('utf8')).hexdigest()
+
+
+def findCachedProcessResult(cacheKey, user):
+    """
+    Find the stored result file of a Gaia process that the user can read,
+    either from the output dataset of an earlier asynchronous run or from the
+    process cache folder.
+    """
+    itemModel = ModelImporter.model('item')
+    cursor = itemModel.find({
+        'meta.minerva.process_cache_key': cacheKey,
+        'meta.minerva.geojson_file': {'$exists': True}
+    })
+    for item in itemModel.filterResultsByPermission(
+            cursor, user, AccessType.READ):
+        file = ModelImporter.model('file').load(
+            item['meta']['minerva']['geojson_file']['_id'], force=True)
+        # The result file may have been deleted from its item
+        if file is not None:
+            return file
+    return None
+
+
+def findProcessCacheFolder(currentUser, create=False):
+    """
+    The folder holding results of synchronous Gaia processes.  It is shared by
+    all users, so it is looked up and written without access checks; each
+    result is only found again by users who can read its item.
+    """
+    collection = findMinervaCollection(currentUser, create)
+    if collection is None:
+        return None
+    folderModel = ModelImporter.model('folder')
+    folder = folderModel.findOne({
+        'parentId': collection['_id'],
+        'parentCollection': 'collection',
+        'name': PROCESS_CACHE_FOLDER
+    })
+    if folder is None and create:
+        folder = folderModel.createFolder(
+            collection, PROCESS_CACHE_FOLDER, parentType='collection',
+            public=False, creator=currentUser)
+    return folder
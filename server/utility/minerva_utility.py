@@ -16,12 +16,20 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 ###############################################################################
+import collections
+import tempfile
+import threading
+
 from cryptography.fernet import Fernet
 from girder.utility import config
 from girder.utility.model_importer import ModelImporter
 from girder.exceptions import AccessException
 
 from girder.plugins.minerva.constants import PluginSettings
+from girder.plugins.minerva.utility.compression_utility import gzipChunks
+
+# Gzip companions smaller than this are built in memory rather than on disk.
+GZIP_SPOOL_SIZE = 16 * 1024 * 1024
 
 
 def findNamedFolder(currentUser, user, parent, parentType, name, create=False,
@@ -212,6 +220,17 @@ def jobMM(job, minerva_metadata=None, save=True):
         return job['meta']['minerva']
 
 
+def jobCanceled(job):
+    """
+    Reload the status of a job to see if it has been canceled since it was
+    started.  Long running local jobs should call this periodically.
+    """
+    from girder.plugins.jobs.constants import JobStatus
+    status = ModelImporter.model('job', 'jobs').load(
+        job['_id'], force=True, fields=['status'])['status']
+    return status == JobStatus.CANCELED
+
+
 def addJobOutput(job, output, output_type='dataset', save=True):
     mm = jobMM(job)
     outputs = mm.get('outputs', [])
@@ -226,3 +245,78 @@ def addJobOutput(job, output, output_type='dataset', save=True):
     outputs.append(job_output)
     mm['outputs'] = outputs
     jobMM(job, mm, save)
+
+
+def addGzipCompanion(item, entry, user):
+    """
+    Store a gzip encoded copy of a derived dataset file in the same item, so
+    downloads can send it as is to clients accepting gzip.  It is recorded as
+    the ``gzip_file`` of the file's minerva metadata entry.
+
+    :param item: the dataset item.
+    :param entry: the minerva metadata entry of the file, such as the
+        geojson_file, which is updated.
+    :param user: the user creating the file.
+    """
+    if entry.get('compression'):
+        # Compressed uploads are already served without recompressing.
+        return entry
+    fileModel = ModelImporter.model('file')
+    file = fileModel.load(entry['_id'], force=True)
+    spool = tempfile.SpooledTemporaryFile(max_size=GZIP_SPOOL_SIZE)
+    try:
+        for chunk in gzipChunks(fileModel.download(file, headers=False)()):
+            spool.write(chunk)
+        size = spool.tell()
+        spool.seek(0)
+        gzipFile = ModelImporter.model('upload').uploadFromFile(
+            spool, size, file['name'] + '.gz', parentType='item', parent=item,
+            user=user, mimeType='application/gzip')
+    finally:
+        spool.close()
+    entry['gzip_file'] = {
+        'name': gzipFile['name'],
+        '_id': gzipFile['_id']
+    }
+    return entry
+
+
+class LruCache(object):
+    """
+    A thread safe least recently used cache, evicting entries once the total
+    size of its values exceeds ``maxSize``.
+
+    :param maxSize: the maximum total size of the values.
+    :param sizeOf: a function giving the size of a value, 1 by default.
+    """
+
+    def __init__(self, maxSize, sizeOf=None):
+        self.maxSize = maxSize
+        self.sizeOf = sizeOf or (lambda value: 1)
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is not None:
+                self.entries[key] = value
+            return value
+
+    def put(self, key, value):
+        size = self.sizeOf(value)
+        if size > self.maxSize:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.sizeOf(self.entries.pop(key))
+            self.entries[key] = value
+            self.size += size
+            while self.size > self.maxSize:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= self.sizeOf(evicted)
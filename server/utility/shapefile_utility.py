@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Lazy reading of ESRI shapefiles.
+
+Records are located with the .shx index and read a batch at a time with
+ranged reads of the .shp and .dbf files, so a shapefile is never loaded in
+memory.  Coordinates of a batch are reprojected to longitude and latitude in a
+single call, using the .prj of the shapefile.
+"""
+
+import struct
+
+import numpy
+
+from girder.plugins.minerva.utility.dataset_utility import GeoJsonMapper
+
+SHP_MAGIC = 9994
+SHP_HEADER_SIZE = 100
+SHX_RECORD_SIZE = 8
+
+# Records read and reprojected at a time.
+SHAPEFILE_BATCH_RECORDS = 4096
+
+_NULL = 0
+_POINT_TYPES = frozenset([1, 11, 21])
+_LINE_TYPES = frozenset([3, 13, 23])
+_POLYGON_TYPES = frozenset([5, 15, 25])
+_MULTIPOINT_TYPES = frozenset([8, 18, 28])
+
+
+def shpHeader(data):
+    """
+    Parse the 100 byte header of a .shp or .shx file.
+
+    :returns: a dict with the shape type, the file length in bytes and the
+        bounding box [minx, miny, maxx, maxy], or None if this isn't a
+        shapefile.
+    """
+    if len(data) < SHP_HEADER_SIZE:
+        return None
+    magic, = struct.unpack('>i', data[:4])
+    if magic != SHP_MAGIC:
+        return None
+    length, = struct.unpack('>i', data[24:28])
+    version, shapeType = struct.unpack('<2i', data[28:36])
+    bbox = struct.unpack('<4d', data[36:68])
+    return {
+        'shapeType': shapeType,
+        'length': length * 2,
+        'bbox': list(bbox)
+    }
+
+
+def isGeographic(wkt):
+    """Whether a .prj holds longitude and latitude coordinates."""
+    return not wkt or not wkt.lstrip().upper().startswith('PROJCS')
+
+
+def prjTransformer(wkt):
+    """
+    A function reprojecting arrays of x and y from the coordinate system of
+    a .prj to longitude and latitude, or None if no reprojection is needed.
+    """
+    if isGeographic(wkt):
+        return None
+    # GDAL is only needed for projected shapefiles.
+    from osgeo import osr
+    source = osr.SpatialReference()
+    source.ImportFromESRI([str(wkt)])
+    target = osr.SpatialReference()
+    target.ImportFromEPSG(4326)
+    if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+        # GDAL 3 otherwise returns latitude first
+        source.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        target.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transformation = osr.CoordinateTransformation(source, target)
+
+    def transform(xs, ys):
+        points = numpy.array(transformation.TransformPoints(
+            numpy.column_stack([xs, ys]).tolist()))
+        return points[:, 0], points[:, 1]
+    return transform
+
+
+def transformBounds(bbox, transform, densify=21):
+    """
+    Reproject a bounding box, following its edges since they don't stay
+    straight in the new coordinate system.
+    """
+    if transform is None:
+        return bbox
+    steps = numpy.linspace(0, 1, densify)
+    xs = numpy.concatenate([
+        bbox[0] + (bbox[2] - bbox[0]) * steps,
+        bbox[0] + (bbox[2] - bbox[0]) * steps,
+        numpy.full(densify, bbox[0]), numpy.full(densify, bbox[2])])
+    ys = numpy.concatenate([
+        numpy.full(densify, bbox[1]), numpy.full(densify, bbox[3]),
+        bbox[1] + (bbox[3] - bbox[1]) * steps,
+        bbox[1] + (bbox[3] - bbox[1]) * steps])
+    xs, ys = transform(xs, ys)
+    return [float(numpy.min(xs)), float(numpy.min(ys)),
+            float(numpy.max(xs)), float(numpy.max(ys))]
+
+
+def _dbfFields(header):
+    fields = []
+    position = 32
+    while position + 32 <= len(header) and header[position:position + 1] != b'\r':
+        descriptor = header[position:position + 32]
+        name = descriptor[:11].split(b'\0')[0].decode('latin1')
+        fields.append((name, descriptor[11:12], descriptor[16:17]))
+        position += 32
+    return [(name, fieldType, ord(length)) for name, fieldType, length in fields]
+
+
+def _dbfValue(value, fieldType, encoding):
+    value = value.strip()
+    if fieldType in (b'N', b'F'):
+        if not value or value.startswith(b'*'):
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+    if fieldType == b'L':
+        if value in (b'T', b't', b'Y', b'y'):
+            return True
+        if value in (b'F', b'f', b'N', b'n'):
+            return False
+        return None
+    return value.decode(encoding, 'replace')
+
+
+def _signedArea(ring):
+    x = ring[:, 0]
+    y = ring[:, 1]
+    return 0.5 * float(numpy.dot(x[:-1], y[1:]) - numpy.dot(x[1:], y[:-1]))
+
+
+class ShapefileReader(object):
+    """
+    Read the records of a shapefile lazily.
+
+    :param shpRange: a function taking an offset and a length and returning
+        those bytes of the .shp file.  shxRange and dbfRange are the same for
+        the .shx and .dbf files.
+    :param shxSize: the size of the .shx file.
+    :param prj: the well known text of the .prj file, if any.
+    :param encoding: the encoding of dbf text, as given by a .cpg file.
+    """
+
+    def __init__(self, shpRange, shxRange, shxSize, dbfRange=None, prj=None,
+                 encoding='utf-8'):
+        self.shpRange = shpRange
+        self.shxRange = shxRange
+        self.dbfRange = dbfRange
+        self.count = (shxSize - SHP_HEADER_SIZE) // SHX_RECORD_SIZE
+        self.header = shpHeader(shpRange(0, SHP_HEADER_SIZE))
+        if self.header is None:
+            raise ValueError('Not a shapefile')
+        self.transform = prjTransformer(prj)
+        try:
+            self.encoding = encoding.strip() or 'utf-8'
+            u''.encode(self.encoding)
+        except LookupError:
+            self.encoding = 'utf-8'
+        self.fields = None
+        if dbfRange is not None:
+            dbfHeader = dbfRange(0, 32)
+            self.dbfHeaderLength, self.dbfRecordLength = struct.unpack(
+                '<2H', dbfHeader[8:12])
+            self.fields = _dbfFields(dbfRange(0, self.dbfHeaderLength))
+
+    def bounds(self):
+        """Longitude and latitude bounds, from the .shp header."""
+        return transformBounds(self.header['bbox'], self.transform)
+
+    def _properties(self, start, count):
+        if self.fields is None:
+            return [{} for _ in range(count)]
+        data = self.dbfRange(self.dbfHeaderLength + start * self.dbfRecordLength,
+                             count * self.dbfRecordLength)
+        rows = []
+        for index in range(count):
+            record = data[index * self.dbfRecordLength:
+                          (index + 1) * self.dbfRecordLength]
+            position = 1
+            properties = {}
+            for name, fieldType, length in self.fields:
+                properties[name] = _dbfValue(
+                    record[position:position + length], fieldType,
+                    self.encoding)
+                position += length
+            rows.append(properties)
+        return rows
+
+    def _geometries(self, start, count):
+        """
+        Parse the geometries of a batch of records.
+
+        :returns: a list with, for each record, None or a (shape type, parts)
+            tuple where parts are arrays of points.
+        """
+        index = self.shxRange(SHP_HEADER_SIZE + start * SHX_RECORD_SIZE,
+                              count * SHX_RECORD_SIZE)
+        entries = numpy.frombuffer(index, dtype='>i4').reshape(-1, 2) * 2
+        first = int(entries[0, 0])
+        last = int(entries[-1, 0] + entries[-1, 1]) + 8
+        data = self.shpRange(first, last - first)
+        geometries = []
+        for offset, length in entries.tolist():
+            offset -= first - 8
+            shapeType, = struct.unpack('<i', data[offset:offset + 4])
+            if shapeType == _NULL:
+                geometries.append(None)
+            elif shapeType in _POINT_TYPES:
+                point = numpy.frombuffer(data, '<f8', 2, offset + 4)
+                geometries.append((shapeType, [point.reshape(1, 2)]))
+            elif shapeType in _MULTIPOINT_TYPES:
+                numPoints, = struct.unpack(
+                    '<i', data[offset + 36:offset + 40])
+                points = numpy.frombuffer(
+                    data, '<f8', numPoints * 2, offset + 40).reshape(-1, 2)
+                geometries.append((shapeType, [points]))
+            else:
+                numParts, numPoints = struct.unpack(
+                    '<2i', data[offset + 36:offset + 44])
+                parts = numpy.frombuffer(
+                    data, '<i4', numParts, offset + 44).tolist()
+                pointsOffset = offset + 44 + 4 * numParts
+                points = numpy.frombuffer(
+                    data, '<f8', numPoints * 2, pointsOffset).reshape(-1, 2)
+                bounds = parts[1:] + [numPoints]
+                geometries.append((shapeType, [
+                    points[begin:end] for begin, end in zip(parts, bounds)]))
+        return geometries
+
+    def _reproject(self, geometries):
+        """Reproject the points of a batch of geometries in one call."""
+        parts = [part for geometry in geometries if geometry is not None
+                 for part in geometry[1]]
+        if self.transform is None or not parts:
+            return geometries
+        points = numpy.concatenate(parts)
+        xs, ys = self.transform(points[:, 0], points[:, 1])
+        points = numpy.column_stack([xs, ys])
+        position = 0
+        reprojected = []
+        for geometry in geometries:
+            if geometry is None:
+                reprojected.append(None)
+                continue
+            newParts = []
+            for part in geometry[1]:
+                newParts.append(points[position:position + len(part)])
+                position += len(part)
+            reprojected.append((geometry[0], newParts))
+        return reprojected
+
+    def features(self, batchSize=SHAPEFILE_BATCH_RECORDS):
+        """Generate the records as GeoJSON features."""
+        for start in range(0, self.count, batchSize):
+            count = min(batchSize, self.count - start)
+            geometries = self._reproject(self._geometries(start, count))
+            properties = self._properties(start, count)
+            for geometry, props in zip(geometries, properties):
+                yield {
+                    'type': 'Feature',
+                    'geometry': _geojsonGeometry(geometry),
+                    'properties': props
+                }
+
+    def toGeoJson(self, writer):
+        """
+        Write a GeoJSON FeatureCollection of the shapefile.
+
+        :param writer: a file like object the GeoJSON is written to.
+        """
+        GeoJsonMapper(objConverter=lambda feature: feature).mapToJson(
+            self.features(), writer)
+
+
+def _geojsonGeometry(geometry):
+    if geometry is None:
+        return None
+    shapeType, parts = geometry
+    if shapeType in _POINT_TYPES:
+        return {'type': 'Point', 'coordinates': parts[0][0].tolist()}
+    if shapeType in _MULTIPOINT_TYPES:
+        return {'type': 'MultiPoint', 'coordinates': parts[0].tolist()}
+    if shapeType in _LINE_TYPES:
+        if len(parts) == 1:
+            return {'type': 'LineString', 'coordinates': parts[0].tolist()}
+        return {'type': 'MultiLineString',
+                'coordinates': [part.tolist() for part in parts]}
+    # Outer rings are clockwise, and are followed by their holes.
+    polygons = []
+    for ring in parts:
+        if _signedArea(ring) <= 0 or not polygons:
+            polygons.append([ring.tolist()])
+        else:
+            polygons[-1].append(ring.tolist())
+    if len(polygons) == 1:
+        return {'type': 'Polygon', 'coordinates': polygons[0]}
+    return {'type': 'MultiPolygon', 'coordinates': polygons}
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Simplified levels of GeoJSON datasets.
+
+Line and polygon datasets are simplified at a few web map zoom levels, with a
+tolerance of about a pixel at each zoom, so that a zoomed out map can be sent
+a level without the vertices it would not draw anyway.
+
+Each geometry is simplified on its own: the topology within a geometry is
+preserved, but borders shared by features are not simplified as shared arcs,
+so adjacent polygons can show slivers, gaps or overlaps of up to about a
+pixel along their common borders at the zoom of a level.
+"""
+
+import json
+
+from shapely.geometry import mapping, shape
+
+from girder.plugins.minerva.utility.compression_utility import ChunkReader
+from girder.plugins.minerva.utility.dataset_utility import geojsonFeatures
+
+TILE_SIZE = 256
+SIMPLIFY_ZOOMS = (2, 5, 8)
+
+# A level is only kept if it has at most this fraction of the vertices of the
+# next finer level.
+MAX_LEVEL_RATIO = 0.75
+
+POINT_TYPES = ('Point', 'MultiPoint')
+
+
+def zoomTolerance(zoom):
+    """The size in degrees of a pixel at the equator at a zoom level."""
+    return 360.0 / (TILE_SIZE * 2 ** zoom)
+
+
+def isSimplifiable(stats):
+    """Whether the statistics of a dataset show lines or polygons."""
+    geometryTypes = stats.get('geometry_types')
+    if geometryTypes is None:
+        return True
+    return any(geometryType not in POINT_TYPES and
+               geometryType != 'GeometryCollection'
+               for geometryType in geometryTypes)
+
+
+def vertexCount(coordinates):
+    """The number of positions in GeoJSON coordinates."""
+    if not coordinates:
+        return 0
+    if isinstance(coordinates[0], (int, float)):
+        return 1
+    return sum(vertexCount(child) for child in coordinates)
+
+
+class GeoJsonSimplifier(object):
+    """
+    Write simplified levels of a GeoJSON FeatureCollection in a single pass,
+    reading one feature at a time.  Each level is simplified from the next
+    finer one with the Douglas-Peucker algorithm, preserving the topology of
+    every geometry so that polygons stay valid.  The topology between
+    geometries, such as shared borders, is not preserved.
+    """
+
+    def __init__(self, zooms=SIMPLIFY_ZOOMS):
+        # Finest level first, as each level is simplified from the previous
+        self.zooms = sorted(zooms, reverse=True)
+        self.vertexCount = 0
+        self.levelVertexCounts = [0] * len(self.zooms)
+
+    def _levels(self, geometry):
+        """The geometry of a feature at each level."""
+        if geometry is None or geometry['type'] in POINT_TYPES or \
+                geometry['type'] == 'GeometryCollection':
+            count = vertexCount(geometry.get('coordinates')) \
+                if geometry else 0
+            self.vertexCount += count
+            for level in range(len(self.zooms)):
+                self.levelVertexCounts[level] += count
+            return [geometry] * len(self.zooms)
+        self.vertexCount += vertexCount(geometry['coordinates'])
+        simplified = shape(geometry)
+        levels = []
+        for level, zoom in enumerate(self.zooms):
+            coarser = simplified.simplify(
+                zoomTolerance(zoom), preserve_topology=True)
+            if not coarser.is_empty:
+                simplified = coarser
+            levelGeometry = mapping(simplified)
+            self.levelVertexCounts[level] += vertexCount(
+                levelGeometry['coordinates'])
+            levels.append(levelGeometry)
+        return levels
+
+    def open(self, writers):
+        """
+        :param writers: a file like object per zoom level, finest first,
+            each level is written to as a FeatureCollection.
+        """
+        self.writers = writers
+        self.featureCount = 0
+        for writer in writers:
+            writer.write('{"type": "FeatureCollection", "features": [')
+
+    def addFeature(self, feature):
+        """Write a feature to every level.  Its geometry is replaced."""
+        levels = self._levels(feature.get('geometry'))
+        for writer, geometry in zip(self.writers, levels):
+            if self.featureCount:
+                writer.write(',')
+            writer.write('\n')
+            feature['geometry'] = geometry
+            writer.write(json.dumps(feature))
+        self.featureCount += 1
+
+    def close(self):
+        for writer in self.writers:
+            writer.write('\n]}\n')
+
+    def simplify(self, chunks, writers):
+        """
+        :param chunks: an iterable of byte strings making up the GeoJSON.
+        :param writers: a file like object per zoom level, finest first,
+            each level is written to as a FeatureCollection.
+        """
+        self.open(writers)
+        for feature in geojsonFeatures(ChunkReader(chunks)):
+            self.addFeature(feature)
+        self.close()
+
+    def keptLevels(self):
+        """
+        The indices of the levels worth keeping, those with noticeably fewer
+        vertices than the next finer kept level.
+        """
+        kept = []
+        previous = self.vertexCount
+        for level, count in enumerate(self.levelVertexCounts):
+            if count <= previous * MAX_LEVEL_RATIO:
+                kept.append(level)
+                previous = count
+        return kept
+
+
+def levelForTolerance(levels, tolerance):
+    """
+    The coarsest simplified level whose tolerance is within a tolerance, or
+    None if the dataset has to be served at full resolution.
+
+    :param levels: level entries of the minerva metadata, with a tolerance.
+    """
+    adequate = [level for level in levels if level['tolerance'] <= tolerance]
+    if not adequate:
+        return None
+    return max(adequate, key=lambda level: level['tolerance'])
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Packed R-tree spatial index of GeoJSON files.
+
+The index is a numpy ``.npz`` archive, the ``spatial_index`` file of a
+dataset, with for every feature of the GeoJSON file, in Sort-Tile-Recursive
+order:
+
+- ``bounds``: float64 array of shape (n, 4), minx, miny, maxx, maxy
+- ``offsets``: int64 array, byte offset of the feature's json in the file
+- ``lengths``: int64 array, byte length of the feature's json
+
+and the nodes of the tree, each covering ``node_size`` consecutive entries of
+the level below, leaves first:
+
+- ``node_bounds``: float64 array of shape (m, 4), the nodes of every level
+- ``level_sizes``: int64 array, the number of nodes of each level
+
+Readers that only need the feature arrays, like the Gaia worker, can ignore
+the tree.
+"""
+
+import io
+import json
+import warnings
+
+import numpy
+
+from girder.plugins.minerva.utility.dataset_utility import \
+    jsonArrayElementRanges
+from girder.plugins.minerva.utility.format_utility import geojsonBounds
+
+SPATIAL_INDEX_NODE_SIZE = 16
+
+# Byte ranges closer than this are fetched with a single read.
+RANGE_MERGE_GAP = 64 * 1024
+
+_EMPTY = [numpy.nan] * 4
+
+
+def strOrder(bounds, nodeSize=SPATIAL_INDEX_NODE_SIZE):
+    """
+    The Sort-Tile-Recursive order of boxes: sorted by x center into vertical
+    slices, each sorted by y center, so that consecutive boxes are close.
+    """
+    count = len(bounds)
+    if not count:
+        return numpy.zeros(0, dtype=numpy.int64)
+    centers = numpy.column_stack([
+        (bounds[:, 0] + bounds[:, 2]) / 2, (bounds[:, 1] + bounds[:, 3]) / 2])
+    # Features without a geometry go last
+    centers[numpy.isnan(centers)] = numpy.inf
+    leafCount = -(-count // nodeSize)
+    sliceSize = nodeSize * int(numpy.ceil(numpy.sqrt(leafCount)))
+    order = numpy.argsort(centers[:, 0], kind='stable')
+    for start in range(0, count, sliceSize):
+        part = order[start:start + sliceSize]
+        order[start:start + sliceSize] = part[
+            numpy.argsort(centers[part, 1], kind='stable')]
+    return order
+
+
+def _groupBounds(bounds, nodeSize):
+    """The bounds of each group of nodeSize consecutive boxes."""
+    count = len(bounds)
+    padded = numpy.full((-(-count // nodeSize) * nodeSize, 4), numpy.nan)
+    padded[:count] = bounds
+    groups = padded.reshape(-1, nodeSize, 4)
+    with warnings.catch_warnings():
+        # Groups of only empty boxes stay empty, and are never matched
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return numpy.column_stack([
+            numpy.nanmin(groups[:, :, :2], axis=1),
+            numpy.nanmax(groups[:, :, 2:], axis=1)])
+
+
+class SpatialIndexBuilder(object):
+    """
+    Build the spatial index of a GeoJSON FeatureCollection one feature at a
+    time, so it can be built in the same pass as other derived files.
+    """
+
+    def __init__(self, nodeSize=SPATIAL_INDEX_NODE_SIZE):
+        self.nodeSize = nodeSize
+        self.bounds = []
+        self.offsets = []
+        self.lengths = []
+
+    def addFeature(self, offset, length, feature):
+        """
+        :param offset: the byte offset of the feature's json in the file.
+        :param length: the byte length of the feature's json.
+        :param feature: the parsed feature.
+        """
+        box = geojsonBounds(feature.get('geometry'))
+        self.bounds.append(box if box is not None else _EMPTY)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+    def build(self):
+        """
+        :returns: the bytes of the .npz index and the number of features.
+        """
+        nodeSize = self.nodeSize
+        bounds = numpy.array(self.bounds, dtype=numpy.float64).reshape(-1, 4)
+        order = strOrder(bounds, nodeSize)
+        bounds = bounds[order]
+        levels = []
+        level = bounds
+        while len(level) > 1 or not levels:
+            level = _groupBounds(level, nodeSize)
+            levels.append(level)
+        buffer = io.BytesIO()
+        numpy.savez(
+            buffer, bounds=bounds,
+            offsets=numpy.array(self.offsets, dtype=numpy.int64)[order],
+            lengths=numpy.array(self.lengths, dtype=numpy.int64)[order],
+            node_bounds=numpy.concatenate(levels),
+            level_sizes=numpy.array([len(level) for level in levels],
+                                    dtype=numpy.int64),
+            node_size=numpy.int64(nodeSize))
+        return buffer.getvalue(), len(order)
+
+
+def buildSpatialIndex(chunks, nodeSize=SPATIAL_INDEX_NODE_SIZE):
+    """
+    Build the spatial index of a GeoJSON FeatureCollection.
+
+    :param chunks: an iterable of byte strings making up the GeoJSON.
+    :returns: the bytes of the .npz index and the number of features.
+    """
+    builder = SpatialIndexBuilder(nodeSize)
+    for offset, data in jsonArrayElementRanges(chunks, 'features'):
+        builder.addFeature(offset, len(data), json.loads(data.decode('utf8')))
+    return builder.build()
+
+
+def _intersecting(bounds, bbox):
+    return ((bounds[:, 0] <= bbox[2]) & (bounds[:, 2] >= bbox[0]) &
+            (bounds[:, 1] <= bbox[3]) & (bounds[:, 3] >= bbox[1]))
+
+
+class SpatialIndex(object):
+    """A spatial index loaded from the bytes of its .npz file."""
+
+    def __init__(self, data):
+        index = numpy.load(io.BytesIO(data))
+        self.bounds = index['bounds']
+        self.offsets = index['offsets']
+        self.lengths = index['lengths']
+        self.nodeSize = int(index['node_size'])
+        levelSizes = index['level_sizes'].tolist()
+        nodeBounds = index['node_bounds']
+        starts = numpy.cumsum([0] + levelSizes)
+        self.levels = [nodeBounds[starts[level]:starts[level + 1]]
+                       for level in range(len(levelSizes))]
+
+    def search(self, bbox):
+        """
+        The features whose bounds intersect a box, walking down the tree
+        from its root.
+
+        :param bbox: (minx, miny, maxx, maxy)
+        :returns: an array of feature indices, in file order.
+        """
+        candidates = numpy.arange(len(self.levels[-1]))
+        for depth in range(len(self.levels) - 1, -1, -1):
+            nodes = self.levels[depth]
+            candidates = candidates[_intersecting(nodes[candidates], bbox)]
+            below = self.levels[depth - 1] if depth else self.bounds
+            children = (candidates[:, None] * self.nodeSize +
+                        numpy.arange(self.nodeSize)).ravel()
+            candidates = children[children < len(below)]
+        matches = candidates[_intersecting(self.bounds[candidates], bbox)]
+        return matches[numpy.argsort(self.offsets[matches])]
+
+    def ranges(self, matches):
+        """
+        Group the byte ranges of features into ranges to read.
+
+        :param matches: feature indices in file order.
+        :returns: a list of (start, end, [(offset, length), ...]) ranges, end
+            exclusive, each holding the features within it.
+        """
+        ranges = []
+        for offset, length in zip(self.offsets[matches].tolist(),
+                                  self.lengths[matches].tolist()):
+            if ranges and offset - ranges[-1][1] <= RANGE_MERGE_GAP:
+                ranges[-1][1] = max(ranges[-1][1], offset + length)
+                ranges[-1][2].append((offset, length))
+            else:
+                ranges.append([offset, offset + length, [(offset, length)]])
+        return [tuple(r) for r in ranges]
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Summaries of the feature properties of datasets, built in one pass with
+bounded memory whatever the size of the dataset.
+
+- Strings and booleans are counted exactly while a property has at most
+  MAX_EXACT_VALUES distinct values.  Past that, the number of distinct
+  values is estimated with a HyperLogLog and the most frequent values are
+  tracked with the Misra-Gries algorithm.
+- Numbers get their exact count, minimum, maximum and mean, and quantiles
+  and a histogram from a KLL style quantile sketch.
+"""
+
+import decimal
+import hashlib
+import math
+import random
+import struct
+
+import ijson
+import numpy
+
+from girder.plugins.minerva.utility.compression_utility import ChunkReader
+
+MAX_EXACT_VALUES = 256
+TOP_VALUES = 32
+HLL_PRECISION = 12
+SKETCH_CAPACITY = 4096
+HISTOGRAM_BINS = 64
+QUANTILES = 100
+
+# Summaries computed in memory for datasets promoted without a summary file.
+SUMMARY_CACHE_SIZE = 64
+
+
+class HyperLogLog(object):
+    """Estimate the number of distinct strings."""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = numpy.zeros(2 ** precision, dtype=numpy.uint8)
+
+    def add(self, value):
+        hashed, = struct.unpack(
+            '<Q', hashlib.md5(value.encode('utf8')).digest()[:8])
+        register = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def count(self):
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / numpy.sum(
+            2.0 ** -self.registers.astype(numpy.float64))
+        empty = int(numpy.sum(self.registers == 0))
+        if estimate <= 2.5 * size and empty:
+            # Linear counting is more accurate for small counts
+            estimate = size * math.log(float(size) / empty)
+        return int(round(estimate))
+
+
+class QuantileSketch(object):
+    """
+    Approximate quantiles of numbers.  Values are buffered in levels of
+    doubling weight; a full level is sorted and every other value is kept in
+    the next level.
+    """
+
+    def __init__(self, capacity=SKETCH_CAPACITY):
+        self.capacity = capacity
+        self.levels = [[]]
+        self.random = random.Random(0)
+
+    def add(self, value):
+        self.levels[0].append(value)
+        if len(self.levels[0]) >= self.capacity:
+            self._compact(0)
+
+    def _compact(self, index):
+        values = numpy.sort(numpy.array(self.levels[index]))
+        self.levels[index] = []
+        if index + 1 == len(self.levels):
+            self.levels.append([])
+        self.levels[index + 1].extend(
+            values[self.random.randint(0, 1)::2].tolist())
+        if len(self.levels[index + 1]) >= self.capacity:
+            self._compact(index + 1)
+
+    def weighted(self):
+        """The sorted values of the sketch and their weights."""
+        values = numpy.concatenate(
+            [numpy.array(level, dtype=numpy.float64) for level in self.levels])
+        weights = numpy.concatenate([
+            numpy.full(len(level), 2.0 ** index)
+            for index, level in enumerate(self.levels)])
+        order = numpy.argsort(values, kind='stable')
+        return values[order], weights[order]
+
+
+class PropertySummary(object):
+    def __init__(self):
+        self.count = 0
+        self.missing = 0
+        self.other = 0
+        self.numbers = 0
+        self.minimum = None
+        self.maximum = None
+        self.total = 0.0
+        self.sketch = QuantileSketch()
+        self.strings = 0
+        self.values = {}
+        self.distinct = None
+        self.top = None
+
+    def add(self, value):
+        self.count += 1
+        if value is None:
+            self.missing += 1
+        elif isinstance(value, bool):
+            self._addString('true' if value else 'false')
+        elif isinstance(value, (int, float, decimal.Decimal)):
+            value = float(value)
+            if math.isnan(value) or math.isinf(value):
+                self.other += 1
+                return
+            self.numbers += 1
+            self.total += value
+            if self.minimum is None or value < self.minimum:
+                self.minimum = value
+            if self.maximum is None or value > self.maximum:
+                self.maximum = value
+            self.sketch.add(value)
+        elif isinstance(value, (list, dict)):
+            self.other += 1
+        else:
+            self._addString(value)
+
+    def _addString(self, value):
+        self.strings += 1
+        if self.distinct is None:
+            self.values[value] = self.values.get(value, 0) + 1
+            if len(self.values) > MAX_EXACT_VALUES:
+                # Too many values to count exactly
+                self.distinct = HyperLogLog()
+                for seen in self.values:
+                    self.distinct.add(seen)
+                self.top = dict(sorted(
+                    self.values.items(), key=lambda item: -item[1]
+                )[:TOP_VALUES])
+                self.values = None
+            return
+        self.distinct.add(value)
+        if value in self.top:
+            self.top[value] += 1
+        elif len(self.top) < TOP_VALUES:
+            self.top[value] = 1
+        else:
+            # Misra-Gries: a new value decrements every tracked count
+            for tracked in list(self.top):
+                self.top[tracked] -= 1
+                if not self.top[tracked]:
+                    del self.top[tracked]
+
+    def summary(self):
+        summary = {
+            'count': self.count,
+            'missing': self.missing
+        }
+        if self.other:
+            summary['other'] = self.other
+        if self.numbers:
+            values, weights = self.sketch.weighted()
+            cumulative = numpy.cumsum(weights)
+            ranks = numpy.linspace(0, 1, QUANTILES + 1) * cumulative[-1]
+            quantiles = values[numpy.minimum(
+                numpy.searchsorted(cumulative, ranks), len(values) - 1)]
+            quantiles[0] = self.minimum
+            quantiles[-1] = self.maximum
+            histogram, edges = numpy.histogram(
+                values, bins=HISTOGRAM_BINS, weights=weights,
+                range=(self.minimum, self.maximum))
+            summary['number'] = {
+                'count': self.numbers,
+                'min': self.minimum,
+                'max': self.maximum,
+                'mean': self.total / self.numbers,
+                'quantiles': quantiles.tolist(),
+                'histogram': {
+                    'edges': edges.tolist(),
+                    # Counts are exact while the sketch holds every value
+                    'counts': numpy.round(histogram).astype(int).tolist()
+                }
+            }
+        if self.strings:
+            if self.distinct is None:
+                summary['string'] = {
+                    'count': self.strings,
+                    'distinct': len(self.values),
+                    'exact': True,
+                    'values': self.values
+                }
+            else:
+                summary['string'] = {
+                    'count': self.strings,
+                    'distinct': self.distinct.count(),
+                    'exact': False,
+                    'top': sorted(self.top, key=lambda value: -self.top[value])
+                }
+        return summary
+
+
+class PropertySummarizer(object):
+    """
+    Summarize the properties of the features of a GeoJSON FeatureCollection
+    one feature at a time.
+    """
+
+    def __init__(self):
+        self.summaries = {}
+        self.featureCount = 0
+
+    def addProperties(self, properties):
+        """:param properties: the properties of a feature."""
+        if not isinstance(properties, dict):
+            properties = {}
+        for name in self.summaries:
+            if name not in properties:
+                self.summaries[name].add(None)
+        for name, value in properties.items():
+            if name not in self.summaries:
+                self.summaries[name] = PropertySummary()
+                # Missing from the previous features
+                self.summaries[name].count = self.featureCount
+                self.summaries[name].missing = self.featureCount
+            self.summaries[name].add(value)
+        self.featureCount += 1
+
+    def summary(self):
+        """:returns: a dict with the feature count and a summary per property."""
+        return {
+            'feature_count': self.featureCount,
+            'properties': dict((name, summary.summary())
+                               for name, summary in self.summaries.items())
+        }
+
+
+def summarizeGeojsonProperties(chunks):
+    """
+    Summarize the properties of the features of a GeoJSON FeatureCollection,
+    parsing only the properties.
+
+    :param chunks: an iterable of byte strings making up the GeoJSON.
+    :returns: a dict with the feature count and a summary per property.
+    """
+    summarizer = PropertySummarizer()
+    for properties in ijson.items(ChunkReader(chunks),
+                                  'features.item.properties'):
+        summarizer.addProperties(properties)
+    return summarizer.summary()
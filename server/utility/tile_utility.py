@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Sizes of the caches of opened raster tile sources and of their tiles,
+shared by every request of the server process, and prefetching of the tiles
+around those that are requested.
+"""
+
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Opened tile sources kept, with their file handles.
+TILE_SOURCE_CACHE_SIZE = 32
+
+# Total size of the cached tiles.
+TILE_CACHE_SIZE = 256 * 1024 * 1024
+
+# Metadata of tile sources not stored with their dataset.
+TILE_METADATA_CACHE_SIZE = 256
+
+PREFETCH_THREADS = 4
+
+# Tiles waiting to be prefetched; more are dropped until the queue drains.
+PREFETCH_QUEUE_SIZE = 256
+
+
+def neighbourTiles(z, x, y, minLevel, maxLevel):
+    """
+    The tiles a map is likely to show after tile (z, x, y): its neighbours at
+    the same level, the tiles covering it one level up and the tile
+    containing it one level down.
+
+    :param minLevel: the lowest zoom level of the tile source.
+    :param maxLevel: the highest zoom level of the tile source.
+    :returns: a list of (z, x, y) tuples.
+    """
+    tiles = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            if dx or dy:
+                tiles.append((z, x + dx, y + dy))
+    if z < maxLevel:
+        tiles.extend((z + 1, 2 * x + dx, 2 * y + dy)
+                     for dx in (0, 1) for dy in (0, 1))
+    if z > minLevel:
+        tiles.append((z - 1, x // 2, y // 2))
+    return [(tz, tx, ty) for tz, tx, ty in tiles
+            if 0 <= tx < 2 ** tz and 0 <= ty < 2 ** tz]
+
+
+class TilePrefetcher(object):
+    """
+    Fetch tiles in background threads.  Tiles already queued are not queued
+    again, and tiles are dropped when the queue is full, so prefetching never
+    holds up the requests it is for.
+
+    :param fetch: a function fetching the tile of a key.
+    """
+
+    def __init__(self, fetch, threads=PREFETCH_THREADS,
+                 queueSize=PREFETCH_QUEUE_SIZE):
+        self.fetch = fetch
+        self.threads = threads
+        self.queue = queue.Queue(queueSize)
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.workers = []
+
+    def _start(self):
+        while len(self.workers) < self.threads:
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def _work(self):
+        while True:
+            key = self.queue.get()
+            try:
+                self.fetch(key)
+            except Exception:
+                # A tile that fails here is fetched again when requested
+                pass
+            finally:
+                with self.lock:
+                    self.pending.discard(key)
+
+    def prefetch(self, keys):
+        with self.lock:
+            self._start()
+            for key in keys:
+                if key in self.pending:
+                    continue
+                try:
+                    self.queue.put_nowait(key)
+                except queue.Full:
+                    break
+                self.pending.add(key)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Compact TopoJSON encoding of GeoJSON datasets.
+
+Coordinates are quantized to integers on a grid over the bounding box of the
+dataset and the positions of lines and rings are delta encoded, so most of
+them are written as a few digits.  Every line and ring becomes its own arc;
+arcs shared between features are not detected.
+"""
+
+import json
+import re
+import tempfile
+
+import numpy
+
+from girder.plugins.minerva.constants import PluginSettings
+from girder.plugins.minerva.utility.compression_utility import ChunkReader
+from girder.plugins.minerva.utility.dataset_utility import geojsonFeatures
+from girder.plugins.minerva.utility.format_utility import geojsonBounds
+
+# Grid steps along each axis of the bounding box of a dataset; about 400
+# meters at the equator for a dataset spanning the whole world.
+TOPOJSON_QUANTIZATION = 100000
+
+# Size of the arcs kept in memory before spilling to disk.
+ARC_SPOOL_SIZE = 16 * 1024 * 1024
+
+
+def topojsonName(name):
+    """The name of the TopoJSON encoding of a GeoJSON file."""
+    baseName = re.sub(r'(\.(geo)?json)?(\.(gz|gzip|bz2|zip))?$', '', name,
+                      flags=re.IGNORECASE)
+    return baseName + PluginSettings.TOPOJSON_EXTENSION
+
+
+class TopoJsonEncoder(object):
+    """
+    Encode a GeoJSON FeatureCollection as a TopoJSON Topology holding a
+    single GeometryCollection object, reading one feature at a time.
+
+    :param objectName: the name of the object of the topology.
+    :param quantization: the number of grid steps along each axis.
+    """
+
+    def __init__(self, objectName, quantization=TOPOJSON_QUANTIZATION):
+        self.objectName = objectName
+        self.quantization = quantization
+        self.arcCount = 0
+
+    def _transform(self, bounds):
+        x0, y0, x1, y1 = bounds or (0, 0, 0, 0)
+        kx = (x1 - x0) / (self.quantization - 1) if x1 > x0 else 1
+        ky = (y1 - y0) / (self.quantization - 1) if y1 > y0 else 1
+        return {'scale': [kx, ky], 'translate': [x0, y0]}
+
+    def _quantize(self, positions):
+        if not len(positions):
+            return numpy.zeros((0, 2), dtype=numpy.int64)
+        points = numpy.asarray(positions, dtype=numpy.float64)[:, :2]
+        return numpy.round((points - self.translate) / self.scale).astype(
+            numpy.int64)
+
+    def _arc(self, positions, minimum):
+        """Write a line or ring as a delta encoded arc, returning its index."""
+        points = self._quantize(positions)
+        # Positions that fall in the same grid cell are dropped
+        keep = numpy.ones(len(points), dtype=bool)
+        keep[1:] = (points[1:] != points[:-1]).any(axis=1)
+        if keep.sum() >= minimum:
+            points = points[keep]
+        deltas = points.copy()
+        deltas[1:] -= points[:-1]
+        if self.arcCount:
+            self.arcs.write(',')
+        self.arcs.write(json.dumps(deltas.tolist(), separators=(',', ':')))
+        self.arcCount += 1
+        return self.arcCount - 1
+
+    def _geometry(self, geometry):
+        if geometry is None:
+            return {'type': None}
+        geometryType = geometry['type']
+        coordinates = geometry.get('coordinates')
+        if geometryType == 'GeometryCollection':
+            return {'type': geometryType, 'geometries': [
+                self._geometry(child) for child in geometry['geometries']]}
+        if geometryType == 'Point':
+            encoded = self._quantize([coordinates])[0].tolist()
+            return {'type': geometryType, 'coordinates': encoded}
+        if geometryType == 'MultiPoint':
+            encoded = self._quantize(coordinates).tolist() \
+                if coordinates else []
+            return {'type': geometryType, 'coordinates': encoded}
+        if geometryType == 'LineString':
+            arcs = self._arc(coordinates, 2)
+        elif geometryType == 'MultiLineString':
+            arcs = [self._arc(line, 2) for line in coordinates]
+        elif geometryType == 'Polygon':
+            arcs = [self._arc(ring, 4) for ring in coordinates]
+        elif geometryType == 'MultiPolygon':
+            arcs = [[self._arc(ring, 4) for ring in polygon]
+                    for polygon in coordinates]
+        else:
+            raise ValueError('Unknown geometry type %s' % geometryType)
+        return {'type': geometryType, 'arcs': arcs}
+
+    def toTopoJson(self, chunks, writer):
+        """
+        Write the TopoJSON encoding of a GeoJSON file.  The file is read
+        twice, first for its bounding box and then to encode its features.
+
+        :param chunks: a function returning an iterable of byte strings
+            making up the GeoJSON.
+        :param writer: a file like object the TopoJSON is written to.
+        """
+        bounds = None
+        for feature in geojsonFeatures(ChunkReader(chunks())):
+            bounds = geojsonBounds(feature.get('geometry'), bounds)
+        transform = self._transform(bounds)
+        self.scale = numpy.array(transform['scale'])
+        self.translate = numpy.array(transform['translate'])
+
+        self.arcs = tempfile.SpooledTemporaryFile(ARC_SPOOL_SIZE, 'w+')
+        try:
+            writer.write('{"type":"Topology","bbox":%s,"transform":%s,'
+                         '"objects":{%s:{"type":"GeometryCollection",'
+                         '"geometries":[' % (
+                             json.dumps(bounds), json.dumps(transform),
+                             json.dumps(self.objectName)))
+            features = geojsonFeatures(ChunkReader(chunks()))
+            for index, feature in enumerate(features):
+                encoded = self._geometry(feature.get('geometry'))
+                if feature.get('properties') is not None:
+                    encoded['properties'] = feature['properties']
+                if 'id' in feature:
+                    encoded['id'] = feature['id']
+                if index:
+                    writer.write(',')
+                writer.write(json.dumps(encoded, separators=(',', ':')))
+            writer.write(']}},"arcs":[')
+            self.arcs.seek(0)
+            while True:
+                data = self.arcs.read(ARC_SPOOL_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+            writer.write(']}')
+        finally:
+            self.arcs.close()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Zonal statistics of rasters: the statistics of the pixels of a raster under
+each polygon of a GeoJSON dataset.  Only the window of the raster covering
+a polygon is read, and the polygon is rasterized over that window with
+numpy.
+"""
+
+import numpy
+
+# Windows larger than this along either side are read at a lower resolution.
+MAX_WINDOW_SIZE = 4096
+
+ZONAL_STATISTICS = ('count', 'sum', 'mean', 'min', 'max', 'histogram')
+
+
+def polygonRings(geometry):
+    """The rings of the polygons of a geometry, holes included."""
+    if not geometry:
+        return []
+    geometryType = geometry['type']
+    if geometryType == 'Polygon':
+        return list(geometry['coordinates'])
+    if geometryType == 'MultiPolygon':
+        return [ring for polygon in geometry['coordinates']
+                for ring in polygon]
+    if geometryType == 'GeometryCollection':
+        return [ring for child in geometry['geometries']
+                for ring in polygonRings(child)]
+    return []
+
+
+class PixelTransform(object):
+    """
+    Convert longitude and latitude to the pixels of a north up raster.
+
+    :param metadata: the metadata of the tile source of the raster, with its
+        size and bounds.
+    :param reproject: a function converting an array of longitude, latitude
+        positions to the projection of the bounds, if they are projected.
+    """
+
+    def __init__(self, metadata, reproject=None):
+        bounds = metadata['bounds']
+        self.width = metadata['sizeX']
+        self.height = metadata['sizeY']
+        self.left = bounds['xmin']
+        self.top = bounds['ymax']
+        self.scaleX = self.width / float(bounds['xmax'] - bounds['xmin'])
+        self.scaleY = self.height / float(bounds['ymax'] - bounds['ymin'])
+        self.reproject = reproject
+
+    def pixels(self, positions):
+        positions = numpy.asarray(positions, dtype=numpy.float64)[:, :2]
+        if self.reproject is not None:
+            positions = self.reproject(positions)
+        return numpy.column_stack([
+            (positions[:, 0] - self.left) * self.scaleX,
+            (self.top - positions[:, 1]) * self.scaleY])
+
+    def window(self, rings):
+        """
+        The pixel window covering rings, clipped to the raster, as left,
+        top, right and bottom, or None if the rings are outside the raster.
+        """
+        if not rings:
+            return None
+        pixels = numpy.concatenate(rings)
+        left = max(0, int(numpy.floor(pixels[:, 0].min())))
+        top = max(0, int(numpy.floor(pixels[:, 1].min())))
+        right = min(self.width, int(numpy.ceil(pixels[:, 0].max())))
+        bottom = min(self.height, int(numpy.ceil(pixels[:, 1].max())))
+        if right <= left or bottom <= top:
+            return None
+        return left, top, right, bottom
+
+
+def geographicReprojector(srs):
+    """
+    A function converting longitude and latitude to a projection, or None
+    if the projection is geographic or unknown.
+    """
+    if not srs:
+        return None
+    from osgeo import osr
+    target = osr.SpatialReference()
+    if target.SetFromUserInput(str(srs)) != 0 or target.IsGeographic():
+        return None
+    source = osr.SpatialReference()
+    source.ImportFromEPSG(4326)
+    if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+        # GDAL 3 otherwise expects latitude first
+        source.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        target.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transformation = osr.CoordinateTransformation(source, target)
+
+    def reproject(positions):
+        return numpy.array(transformation.TransformPoints(
+            positions.tolist()))[:, :2]
+    return reproject
+
+
+def rasterizeRings(rings, width, height):
+    """
+    The pixels of a window whose centers are inside rings, by the even-odd
+    rule, so holes are left out.
+
+    :param rings: arrays of (x, y) positions in the pixels of the window.
+    :returns: a boolean array of shape (height, width).
+    """
+    centers = numpy.arange(height) + 0.5
+    # Crossings of the row through each pixel center, left of the pixel
+    crossings = numpy.zeros((height, width + 1), dtype=numpy.int32)
+    for ring in rings:
+        ring = numpy.asarray(ring, dtype=numpy.float64)
+        if len(ring) < 3:
+            continue
+        if (ring[0] != ring[-1]).any():
+            ring = numpy.concatenate([ring, ring[:1]])
+        x1, y1 = ring[:-1, 0], ring[:-1, 1]
+        x2, y2 = ring[1:, 0], ring[1:, 1]
+        rows, edges = numpy.nonzero(
+            (centers[:, None] >= numpy.minimum(y1, y2)) &
+            (centers[:, None] < numpy.maximum(y1, y2)))
+        x = x1[edges] + (centers[rows] - y1[edges]) / (
+            y2[edges] - y1[edges]) * (x2[edges] - x1[edges])
+        columns = numpy.clip(numpy.floor(x - 0.5).astype(numpy.int64) + 1,
+                             0, width)
+        numpy.add.at(crossings, (rows, columns), 1)
+    return numpy.cumsum(crossings, axis=1)[:, :width] % 2 == 1
+
+
+def zoneStatistics(task):
+    """
+    The statistics of the pixels of a window under a polygon.  This is run
+    in a process pool, so it only takes picklable arguments.
+
+    :param task: a tuple of a 2d array of the pixel values of the window,
+        the rings of the polygon in the pixels of the window, the area of a
+        pixel of the window in raster pixels, the number of histogram bins
+        and the nodata value of the raster, or None.
+    :returns: a dict of ZONAL_STATISTICS.
+    """
+    values, rings, pixelArea, bins, nodata = task
+    if values is None:
+        values = numpy.zeros((0, 0))
+    mask = rasterizeRings(rings, values.shape[1], values.shape[0])
+    values = values[mask].astype(numpy.float64)
+    valid = ~numpy.isnan(values)
+    if nodata is not None:
+        valid &= values != nodata
+    values = values[valid]
+    if not len(values):
+        return {'count': 0, 'sum': 0, 'mean': None, 'min': None,
+                'max': None, 'histogram': None}
+    counts, edges = numpy.histogram(values, bins=bins)
+    return {
+        'count': int(round(len(values) * pixelArea)),
+        'sum': float(values.sum() * pixelArea),
+        'mean': float(values.mean()),
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'histogram': {
+            'edges': edges.tolist(),
+            'counts': numpy.round(counts * pixelArea).astype(int).tolist()
+        }
+    }
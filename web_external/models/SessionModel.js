@@ -1,4 +1,5 @@
 import _ from 'underscore';
+import { restRequest } from 'girder/rest';
 
 import MinervaModel from '../MinervaModel';
 
@@ -68,6 +69,23 @@ const SessionModel = MinervaModel.extend({
         return this.metadata()[key];
     },
 
+    /**
+     * Async function that loads the session and the datasets it references in
+     * a single request.
+     *
+     * @returns {Promise} resolved with the datasets of the session and the ids of
+     * those missing or not readable.
+     */
+    load: function () {
+        return restRequest({
+            type: 'GET',
+            url: `minerva_session/${this.get('_id')}/load`
+        }).then((resp) => {
+            this.set(resp.session);
+            return { datasets: resp.datasets, missing: resp.missing };
+        });
+    },
+
     /**
      * Async function that initializes the session with minerva metadata, including some defaults
      * for the map.
@@ -34,8 +34,19 @@ router.route('session/:id', 'session', function (id) {
         _id: id
     });
     var datasetCollection = new DatasetCollection();
-    _whenAll([session.fetch(), datasetCollection.fetch()])
-        .then(() => {
+    _whenAll([session.load(), datasetCollection.fetch()])
+        .then(([loaded]) => {
+            // datasets of the session that aren't listed, such as those shared
+            // with the user after the session was saved
+            datasetCollection.add(loaded.datasets);
+            if (loaded.missing.length) {
+                events.trigger('g:alert', {
+                    icon: 'attention',
+                    text: `${loaded.missing.length} dataset(s) of this session could not be loaded.`,
+                    type: 'warning',
+                    timeout: 4000
+                });
+            }
             return events.trigger('g:navigateTo', SessionView, {
                 datasetCollection: datasetCollection,
                 session: session
@@ -17,7 +17,7 @@ class LargeImageRepresentation extends MapRepresentation {
         var itemId = dataset.get('_id');
         var apiRoot = getApiRoot();
         var params = encodeURI('encoding=PNG&projection=EPSG:3857');
-        var url = `${apiRoot}/item/${itemId}/tiles/zxy`;
+        var url = `${apiRoot}/minerva_dataset/${itemId}/tiles/zxy`;
         if (_.isEmpty(visProperties)) {
             layer.url((x, y, z) => `${url}/${z}/${x}/${y}?${params}`);
         } else {
@@ -66,11 +66,6 @@ export default Panel.extend({
             el: $('#g-dialog-container'),
             collection: this.collection,
             parentView: this
-        }).on('m:dataset_created', function (datasetId) {
-            var dataset = new DatasetModel({ _id: datasetId });
-            dataset.on('g:fetched', function () {
-                this.collection.add(dataset);
-            }, this).fetch();
         });
         postgresWidget.render();
     },
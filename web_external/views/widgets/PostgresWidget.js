@@ -1,5 +1,6 @@
 import _ from 'underscore';
 import { restRequest } from 'girder/rest';
+import events from 'girder/events';
 import Backbone from 'backbone';
 import bootbox from 'bootbox';
 import 'dot/doT';
@@ -184,8 +185,9 @@ const PostgresWidget = View.extend({
                 filter: JSON.stringify(queryFilter),
                 geometryField: JSON.stringify(this.geometryFieldGenerator())
             }
-        }).done((datasetId) => {
-            this.trigger('m:dataset_created', datasetId);
+        }).done(() => {
+            // The dataset is added by the DataPanel when the job succeeds.
+            events.trigger('m:job.created');
             this.$el.modal('hide');
         });
     },